@@ -13,19 +13,18 @@ from sampling_strategies import (
     LEVEL_ORDER,
     LEVEL_TO_FEATURE,
 )
+from src.jsonl_io import iter_jsonl
 
 # ----------------- 通用工具函数 -----------------
 
 def load_index_list(index_file: Path) -> List[int]:
     """加载 index_tag.jsonl，返回 index 列表（保持顺序）。"""
     index_list: List[int] = []
-    with open(index_file, "r", encoding="utf-8") as fin:
-        for line in fin:
-            try:
-                obj = json.loads(line)
-                index_list.append(obj["index"])
-            except Exception:
-                continue
+    for obj in iter_jsonl(index_file):
+        try:
+            index_list.append(obj["index"])
+        except Exception:
+            continue
     return index_list
 
 
@@ -179,29 +178,11 @@ def create_dataset_with_sampling(
 
 # ----------------- 主入口 -----------------
 
-# python3 attempt_maker.py --exp_name exp1a --attempt_id 1 --sample_per_label 350
-def main():
-    parser = argparse.ArgumentParser(
-        description="根据基础数据集构建 attempt 数据集，仅生成 jsonl 文件"
-    )
-    parser.add_argument("--exp_name", required=True, help="实验名称，例如 exp1")
-    parser.add_argument("--attempt_id", type=int, default=1, help="attempt 序号，默认 1")
-    parser.add_argument(
-        "--sample_per_label",
-        type=int,
-        default=1000,
-        help="每个标签(0/1)在每个测试数据集中的样本数量",
-    )
-    parser.add_argument(
-        "--skip_existing",
-        action="store_true",
-        help="若目标 jsonl 已存在，则跳过生成 (增量式)"
-    )
-    args = parser.parse_args()
-
+def make_attempt(exp_name: str, attempt_id: int = 1, sample_per_label: int = 1000, skip_existing: bool = False):
+    """为 baseset/<exp_name> 生成 dataset/<exp_name>/attempt<attempt_id> 下的全部测试数据集。"""
     base_dir = Path(__file__).resolve().parent
-    baseset_dir = base_dir / "baseset" / args.exp_name
-    dataset_dir = base_dir / "dataset" / args.exp_name / f"attempt{args.attempt_id}"
+    baseset_dir = base_dir / "baseset" / exp_name
+    dataset_dir = base_dir / "dataset" / exp_name / f"attempt{attempt_id}"
 
     # 加载按 level 划分的 index
     indices_tag0_by_level = load_level_index_map(baseset_dir / "nonmember")
@@ -216,9 +197,9 @@ def main():
 
     # ---------- 测试 0：原始 MIA 数据集 ----------
     out_file_test0 = dataset_dir / "test0_originalMIA.jsonl"
-    if out_file_test0.exists() and args.skip_existing:
+    if out_file_test0.exists() and skip_existing:
         print(f"跳过生成 test0_originalMIA，文件已存在: {out_file_test0}")
-    elif not out_file_test0.exists() or not args.skip_existing:
+    elif not out_file_test0.exists() or not skip_existing:
         records_test0: List[dict] = []
         # 仅使用 level=0 的索引集
         for idx in indices_tag0_by_level.get("0", []):
@@ -283,7 +264,7 @@ def main():
                 test_configs = test_configs_all
             for strategy_name, extra_params in test_configs:
                 out_file = subdir / f"{strategy_name}.jsonl"
-                if out_file.exists() and args.skip_existing:
+                if out_file.exists() and skip_existing:
                     # 增量模式：文件已存在，跳过
                     continue
                 create_dataset_with_sampling(
@@ -292,7 +273,7 @@ def main():
                     out_file,
                     strategy_name,
                     type2,
-                    sample_per_label=args.sample_per_label,
+                    sample_per_label=sample_per_label,
                     **extra_params,
                 )
 
@@ -303,7 +284,7 @@ def main():
             subdir = dataset_dir / f"i{i}_{type2}"
             subdir.mkdir(parents=True, exist_ok=True)
             out_file = subdir / "test6_per_level_sync.jsonl"
-            if out_file.exists() and args.skip_existing:
+            if out_file.exists() and skip_existing:
                 continue
             create_dataset_with_sampling(
                 indices_tag0_by_level,
@@ -311,7 +292,7 @@ def main():
                 out_file,
                 "test6_per_level_sync",
                 type2,
-                sample_per_label=args.sample_per_label,
+                sample_per_label=sample_per_label,
                 i=i,
             )
 
@@ -322,7 +303,7 @@ def main():
             subdir = dataset_dir / f"i{i}_vs_{i+1}_{type2}"
             subdir.mkdir(parents=True, exist_ok=True)
             out_file = subdir / "test7_adjacent_levels.jsonl"
-            if out_file.exists() and args.skip_existing:
+            if out_file.exists() and skip_existing:
                 continue
             create_dataset_with_sampling(
                 indices_tag0_by_level,
@@ -330,12 +311,35 @@ def main():
                 out_file,
                 "test7_adjacent_levels",
                 type2,
-                sample_per_label=args.sample_per_label,
+                sample_per_label=sample_per_label,
                 i=i,
             )
 
     print("所有 attempt 数据集已生成完毕！")
 
 
+# python3 attempt_maker.py --exp_name exp1a --attempt_id 1 --sample_per_label 350
+def main():
+    parser = argparse.ArgumentParser(
+        description="根据基础数据集构建 attempt 数据集，仅生成 jsonl 文件"
+    )
+    parser.add_argument("--exp_name", required=True, help="实验名称，例如 exp1")
+    parser.add_argument("--attempt_id", type=int, default=1, help="attempt 序号，默认 1")
+    parser.add_argument(
+        "--sample_per_label",
+        type=int,
+        default=1000,
+        help="每个标签(0/1)在每个测试数据集中的样本数量",
+    )
+    parser.add_argument(
+        "--skip_existing",
+        action="store_true",
+        help="若目标 jsonl 已存在，则跳过生成 (增量式)"
+    )
+    args = parser.parse_args()
+
+    make_attempt(args.exp_name, args.attempt_id, args.sample_per_label, args.skip_existing)
+
+
 if __name__ == "__main__":
     main()
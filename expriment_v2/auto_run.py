@@ -1,71 +1,466 @@
 import argparse
+import contextlib
+import hashlib
 import subprocess
 import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 import os
 
+import attempt_maker
+import exp_maker
+import result_maker
+from src.build import BuildGraph, Node
+from src.run import BaseSetAccessor
+from src.textcache import DEFAULT_TEXT_CACHE_NAME
+
+# 二进制列式样本存储 (见 src/store.py)。整个 sweep 只转换一次 source，
+# 之后每个 result_maker 子进程都以 mmap 方式打开同一份文件，由 OS 页缓存在进程间共享。
+DEFAULT_STORE_BASE = str(Path(__file__).resolve().parent / "store")
+
+# 文本压缩长度缓存 (见 src/textcache.py)：各实验的 result_maker 共用，同一文本的 zlib 长度只计算一次
+DEFAULT_TEXT_CACHE = str(Path(__file__).resolve().parent / DEFAULT_TEXT_CACHE_NAME)
+
+# 并行调度：单个实验 (accessor 缓存 + 打分) 的估算峰值内存，以及各实验日志目录
+DEFAULT_MEM_PER_JOB_MB = 4096
+# 默认并发实验数：每个实验各持有一份 accessor 缓存，取保守值，需要更多时以 --workers 指定
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_LOG_DIR = str(Path(__file__).resolve().parent / "logs")
+
+# 增量构建状态目录 (见 src/build.py)
+DEFAULT_BUILD_STATE = str(Path(__file__).resolve().parent / ".build")
+
+
 def run_command(cmd: List[str], description: str) -> bool:
-    """运行单个命令，返回是否成功"""
+    """运行单个命令，返回是否成功
+
+    子进程直接写入当前的 stdout/stderr (终端或并行调度时的日志文件)，不在内存中缓冲。
+    """
     print(f"\n{'='*50}")
     print(f"正在执行: {description}")
     print(f"命令: {' '.join(cmd)}")
-    print(f"{'='*50}")
+    print(f"{'='*50}", flush=True)
     
+    streams = {}
+    with contextlib.suppress(AttributeError, OSError, ValueError):
+        sys.stderr.flush()
+        streams = {"stdout": sys.stdout.fileno(), "stderr": sys.stderr.fileno()}
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        subprocess.run(cmd, check=True, **streams)
         print("执行成功!")
-        if result.stdout:
-            print("输出:", result.stdout)
         return True
     except subprocess.CalledProcessError as e:
         print(f"执行失败! 错误码: {e.returncode}")
-        if e.stdout:
-            print("标准输出:", e.stdout)
-        if e.stderr:
-            print("错误输出:", e.stderr)
         return False
 
 
-def run_experiment_sequence(exp_name: str, attempt_id: int, size: int, lb: int, rb: int, sample_per_label: int, seed: int = 123) -> bool:
-    """运行单个实验的完整流程"""
+def prepare_store(store_base: str) -> bool:
+    """将 source 转换为列式存储；已是最新的文件会被跳过，因此重复调用开销很小。"""
+    cmd = ["python3", "-m", "src.store", "--store_base", store_base]
+    return run_command(cmd, "同步二进制样本存储")
+
+
+class PipelineContext:
+    """进程内流水线共享的状态。
+
+    覆盖矩阵 (exp_maker) 与 BaseSetAccessor (result_maker) 在首次使用时创建，之后由全部实验复用，
+    不再为每个阶段重新启动解释器、重新加载 source。timings 记录每个实验各阶段的耗时 (秒)。
+    """
+
+    def __init__(self, store_base: str = "", coverage_path: str = ""):
+        self.store_base = store_base
+        self.coverage_path = coverage_path
+        self._coverage = None
+        self._accessor: Optional[BaseSetAccessor] = None
+        self.timings: List[Tuple[str, Dict[str, float]]] = []
+
+    @property
+    def coverage(self):
+        if self._coverage is None:
+            self._coverage = exp_maker.load_coverage(self.coverage_path)
+        return self._coverage
+
+    @property
+    def accessor(self) -> BaseSetAccessor:
+        if self._accessor is None:
+            self._accessor = BaseSetAccessor(source_base=exp_maker.SOURCE_BASE, store_base=self.store_base,
+                                             mmap=bool(self.store_base))
+        return self._accessor
+
+    def report(self):
+        """打印各实验的分阶段耗时。"""
+        if not self.timings:
+            return
+        print(f"\n{'='*50}")
+        print("各阶段耗时 (秒):")
+        for name, stages in self.timings:
+            detail = ", ".join(f"{stage}={sec:.1f}" for stage, sec in stages.items())
+            print(f"  {name}: {detail} (合计 {sum(stages.values()):.1f})")
+        print(f"{'='*50}")
+
+
+def run_stage(timings: Dict[str, float], stage: str, fn: Callable[[], Optional[bool]]) -> bool:
+    """执行单个阶段并把耗时写入 timings[stage]。
+
+    fn 返回 False 或抛出异常视为失败 (异常只打印堆栈，不向上传播)；返回 None 视为成功。
+    """
+    start = time.perf_counter()
+    try:
+        ok = fn() is not False
+    except Exception:
+        traceback.print_exc()
+        ok = False
+    timings[stage] = time.perf_counter() - start
+    return ok
+
+
+def make_basesets(configs: List[Tuple[str, int, int, int, int]], ctx: Optional[PipelineContext] = None,
+                  isolate: bool = False) -> bool:
+    """一次生成多个 baseset，configs 为 (exp_name, size, lb, rb, seed)。
+
+    覆盖矩阵与长度索引只加载一次；每个配置使用独立的随机流，结果与逐个运行一致。
+    isolate=True 时以 exp_maker 批量模式子进程运行，否则在当前进程内复用 ctx。
+    """
+    timings: Dict[str, float] = {}
+    if isolate:
+        cmd = ["python3", "exp_maker.py", "--batch"] + [
+            f"{exp_name}:{size}:{lb}:{rb}:{seed}" for exp_name, size, lb, rb, seed in configs
+        ]
+        ok = run_stage(timings, "exp_maker", lambda: run_command(cmd, f"批量创建基础数据集 ({len(configs)} 个)"))
+    else:
+        ctx = ctx or PipelineContext()
+        ok = run_stage(timings, "exp_maker", lambda: exp_maker.build_basesets(configs, cov=ctx.coverage))
+    if ctx is not None:
+        ctx.timings.append((f"baseset 批量 ({len(configs)} 个)", timings))
+    return ok
+
+
+def run_experiment_sequence(exp_name: str, attempt_id: int, size: int, lb: int, rb: int, sample_per_label: int, seed: int = 123,
+                            store_base: str = "", build_baseset: bool = True, ctx: Optional[PipelineContext] = None,
+                            isolate: bool = False, state_dir: str = "", source_digest: str = "",
+                            adopt_existing: bool = False, text_cache: str = "") -> bool:
+    """运行单个实验的完整流程
+
+    默认在当前进程内依次调用 exp_maker / attempt_maker / result_maker 的函数入口，并通过
+    ctx 共享覆盖矩阵与 accessor；isolate=True 时各阶段仍以独立子进程运行。
+    store_base 非空时 result_maker 以 mmap 方式读取该存储，不再各自解析 source 下的 JSON
+    (进程内模式下取 ctx.store_base)。
+    build_baseset=False 表示 baseset 已由 make_basesets 批量生成，跳过 exp_maker。
+    state_dir 非空时按 src/build.py 的内容哈希增量构建，只重跑过期的阶段；source_digest 为
+    source_corpus_digest 的结果，为空时现场计算 (并行调度时由父进程统一计算后传入)。
+    adopt_existing=True 时，没有构建记录但输出已存在的阶段直接采纳 (见 BuildGraph.run)，不覆盖已有数据集与结果。
+    text_cache 非空时 result_maker 从该文件加载文本压缩长度缓存，结束后写回新增条目。
+    """
     print(f"\n开始实验: {exp_name}, attempt_id={attempt_id}")
+    if not isolate and ctx is None:
+        ctx = PipelineContext(store_base)
+    timings: Dict[str, float] = {}
+
+    def finish(ok: bool) -> bool:
+        if ctx is not None:
+            ctx.timings.append((exp_name, timings))
+        print(f"阶段耗时: " + ", ".join(f"{stage}={sec:.1f}s" for stage, sec in timings.items()))
+        return ok
+
+    # 1. 运行 exp_maker
+    if isolate:
+        cmd1 = [
+            "python3", "exp_maker.py",
+            "--exp_name", exp_name,
+            "--size", str(size),
+            "--lb", str(lb),
+            "--rb", str(rb),
+            "--seed", str(seed)
+        ]
+        stage1 = lambda: run_command(cmd1, "创建基础数据集")
+    else:
+        stage1 = lambda: exp_maker.build_basesets([(exp_name, size, lb, rb, seed)], cov=ctx.coverage)
     
-    # 1. 运行 exp_maker.py
-    cmd1 = [
-        "python3", "exp_maker.py",
-        "--exp_name", exp_name,
-        "--size", str(size),
-        "--lb", str(lb),
-        "--rb", str(rb),
-        "--seed", str(seed)
-    ]
-    if not run_command(cmd1, "创建基础数据集"):
-        return False
-    
-    # 2. 运行 attempt_maker.py
-    cmd2 = [
-        "python3", "attempt_maker.py",
-        "--exp_name", exp_name,
-        "--attempt_id", str(attempt_id),
-        "--sample_per_label", str(sample_per_label),
-        # "--skip_existing"
-    ]
-    if not run_command(cmd2, "创建测试数据集"):
-        return False
+    # 2. 运行 attempt_maker
+    if isolate:
+        cmd2 = [
+            "python3", "attempt_maker.py",
+            "--exp_name", exp_name,
+            "--attempt_id", str(attempt_id),
+            "--sample_per_label", str(sample_per_label),
+            # "--skip_existing"
+        ]
+        stage2 = lambda: run_command(cmd2, "创建测试数据集")
+    else:
+        stage2 = lambda: attempt_maker.make_attempt(exp_name, attempt_id, sample_per_label)
     
-    # 3. 运行 result_maker.py
-    cmd3 = [
-        "python3", "result_maker.py",
-        "--exp_name", exp_name,
-        "--attempt_id", str(attempt_id),
-        # "--skip_existing"
-    ]
-    if not run_command(cmd3, "生成评估结果"):
-        return False
+    # 3. 运行 result_maker
+    if isolate:
+        cmd3 = [
+            "python3", "result_maker.py",
+            "--exp_name", exp_name,
+            "--attempt_id", str(attempt_id),
+            # "--skip_existing"
+        ]
+        if store_base:
+            cmd3 += ["--store_base", store_base, "--mmap"]
+        if text_cache:
+            cmd3 += ["--text_cache", text_cache]
+        stage3 = lambda: run_command(cmd3, "生成评估结果")
+    else:
+        stage3 = lambda: result_maker.make_results(exp_name, attempt_id, accessor=ctx.accessor, text_cache=text_cache)
+
+    if state_dir and not source_digest:
+        source_digest = source_corpus_digest(state_dir)
+    stages = experiment_nodes(exp_name, attempt_id, size, lb, rb, sample_per_label, seed,
+                              coverage_path=ctx.coverage_path if ctx is not None else "",
+                              source_digest=source_digest)
+    actions = {"exp_maker": stage1, "attempt_maker": stage2, "result_maker": stage3}
+    if not build_baseset:
+        stages = [n for n in stages if n.params.get("stage") != "exp_maker"]
+        stages[0].deps = []
+
+    if not state_dir:
+        for node in stages:
+            stage = node.params["stage"]
+            if not run_stage(timings, stage, actions[stage]):
+                return finish(False)
+    else:
+        # 增量构建：输入 / 参数 / 代码均未变化且输出完好的阶段直接跳过
+        if ctx is not None and build_baseset:
+            _ = ctx.coverage  # 先刷新覆盖矩阵，使 baseset 节点的键基于最新的覆盖矩阵
+        graph = BuildGraph(state_dir)
+        for node in stages:
+            stage = node.params["stage"]
+            node.action = lambda stage=stage: run_stage(timings, stage, actions[stage])
+            graph.add(node)
+        status = graph.run(adopt_existing=adopt_existing)
+        print("增量构建: " + ", ".join(f"{name}={st}" for name, st in status.items()))
+        if any(st in ("failed", "blocked") for st in status.values()):
+            return finish(False)
     
     print(f"实验 {exp_name} (attempt_id={attempt_id}) 完成!")
-    return True
+    return finish(True)
+
+
+def _source_dirs() -> List[str]:
+    return [os.path.join(exp_maker.SOURCE_BASE, d) for d in exp_maker.MEMBER_DIRS_REL + exp_maker.NONMEMBER_DIRS_REL]
+
+
+def source_corpus_digest(state_dir: str) -> str:
+    """结果节点依赖的全部 source 目录的合并内容哈希。
+
+    整个语料只在调用方 (并行调度时为父进程) 哈希一次，再作为参数传给各实验的结果节点；
+    文件哈希缓存写入 state_dir，之后按 (mtime, size) 复用。
+    """
+    graph = BuildGraph(state_dir)
+    h = hashlib.sha256()
+    for d in _source_dirs():
+        h.update(d.encode("utf-8"))
+        h.update(graph.path_digest(d).encode("ascii"))
+    graph.save_digest_cache()
+    return h.hexdigest()
+
+
+def experiment_nodes(exp_name: str, attempt_id: int, size: int, lb: int, rb: int, sample_per_label: int, seed: int,
+                     coverage_path: str = "", source_digest: str = "") -> List[Node]:
+    """单个实验 baseset -> attempt 数据集 -> 结果 三个阶段的构建节点 (action 由调用方填入)。
+
+    baseset 只取决于覆盖矩阵 (index 与 input 长度)；结果取决于 attempt 数据集与 source 中的样本，
+    后者以 source_digest (见 source_corpus_digest) 计入结果节点的参数，而不是逐个节点重新哈希 source。
+    params["stage"] 标记阶段名。
+    """
+    base_dir = Path(__file__).resolve().parent
+    baseset_dir = str(base_dir / "baseset" / exp_name)
+    dataset_dir = str(base_dir / "dataset" / exp_name / f"attempt{attempt_id}")
+    result_dir = str(base_dir / "result" / exp_name / f"attempt{attempt_id}")
+    src_code = sorted(str(p) for p in (base_dir / "src").glob("*.py"))
+
+    baseset = Node(
+        name=f"{exp_name}.baseset",
+        action=lambda: None,
+        inputs=[exp_maker.resolve_coverage_path(coverage_path)],
+        outputs=[baseset_dir],
+        params={"stage": "exp_maker", "size": size, "lb": lb, "rb": rb, "seed": seed},
+        code=[str(base_dir / "exp_maker.py"), str(base_dir / "sampling_strategies.py"), str(base_dir / "src" / "coverage.py")],
+    )
+    attempt = Node(
+        name=f"{exp_name}.attempt{attempt_id}.dataset",
+        action=lambda: None,
+        inputs=[baseset_dir],
+        outputs=[dataset_dir],
+        params={"stage": "attempt_maker", "sample_per_label": sample_per_label},
+        code=[str(base_dir / "attempt_maker.py"), str(base_dir / "sampling_strategies.py")],
+        deps=[baseset.name],
+    )
+    result = Node(
+        name=f"{exp_name}.attempt{attempt_id}.result",
+        action=lambda: None,
+        inputs=[dataset_dir],
+        outputs=[result_dir],
+        params={"stage": "result_maker", "source": source_digest},
+        code=[str(base_dir / "result_maker.py"), str(base_dir / "sampling_strategies.py")] + src_code,
+        deps=[attempt.name],
+    )
+    return [baseset, attempt, result]
+
+
+# -----------------------------------------------------------------------------
+# 并行调度
+
+# 实验元组: (exp_name, attempt_id, size, lb, rb, sample_per_label, seed)
+Experiment = Tuple[str, int, int, int, int, int, int]
+
+# 工作进程内的共享上下文：同一进程先后执行的实验复用覆盖矩阵与 accessor
+_WORKER_CTX: Optional[PipelineContext] = None
+
+
+def available_memory_mb() -> Optional[int]:
+    """读取 /proc/meminfo 的 MemAvailable (MB)；非 Linux 或读取失败时返回 None。"""
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as fin:
+            for line in fin:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _run_experiment_job(exp: Experiment, store_base: str, build_baseset: bool, isolate: bool,
+                        log_dir: str, state_dir: str, source_digest: str = "",
+                        adopt_existing: bool = False, text_cache: str = "") -> Tuple[bool, float]:
+    """工作进程入口：运行单个实验，stdout/stderr 写入 <log_dir>/<exp_name>.log，返回 (是否成功, 耗时)。"""
+    global _WORKER_CTX
+    if _WORKER_CTX is None:
+        _WORKER_CTX = PipelineContext(store_base)
+    exp_name, attempt_id, size, lb, rb, sample_per_label, seed = exp
+    start = time.perf_counter()
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, f"{exp_name}.log"), "w", encoding="utf-8") as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            ok = run_experiment_sequence(exp_name, attempt_id, size, lb, rb, sample_per_label, seed,
+                                         store_base=store_base, build_baseset=build_baseset, ctx=_WORKER_CTX,
+                                         isolate=isolate, state_dir=state_dir, source_digest=source_digest,
+                                         adopt_existing=adopt_existing, text_cache=text_cache)
+        except Exception:
+            traceback.print_exc()
+            ok = False
+    return ok, time.perf_counter() - start
+
+
+def run_experiments_parallel(experiments: List[Experiment], workers: Optional[int] = None,
+                             mem_per_job_mb: int = DEFAULT_MEM_PER_JOB_MB, store_base: str = "",
+                             build_baseset: Union[bool, Set[str]] = True, isolate: bool = False,
+                             log_dir: str = DEFAULT_LOG_DIR, state_dir: str = "",
+                             adopt_existing: bool = False, text_cache: str = "") -> Dict[str, bool]:
+    """在进程池中并行运行多个互相独立的实验，返回 {exp_name: 是否成功}。
+
+    • 并发度不超过 workers (默认 DEFAULT_WORKERS)；MemAvailable 不足 mem_per_job_mb 时暂缓提交新实验
+      (没有实验在运行时除外，避免死锁)；
+    • 每完成一个实验打印一行进度，各实验的完整输出见 <log_dir>/<exp_name>.log；
+    • build_baseset 为布尔值时对全部实验生效，为集合时只有其中的实验运行 exp_maker；
+    • 单个实验失败 (返回 False 或抛异常) 不影响其余实验；工作进程被杀 (如 OOM) 导致进程池损坏时，
+      在途实验在新进程池中各单独重试一次，再次损坏则记为失败，其余实验照常继续。
+    """
+    workers = workers or DEFAULT_WORKERS
+    # source 语料只在父进程中哈希一次，各工作进程直接使用
+    source_digest = source_corpus_digest(state_dir) if state_dir else ""
+    pending = list(experiments)
+    results: Dict[str, bool] = {}
+    total = len(pending)
+    start = time.perf_counter()
+
+    def report(exp_name: str, ok: bool, elapsed: float, running: List[str]):
+        status = "完成" if ok else "失败"
+        print(f"[{len(results)}/{total}] {exp_name} {status} ({elapsed:.1f}s, 总计 {time.perf_counter() - start:.0f}s)"
+              f" 运行中: {', '.join(running) or '-'}", flush=True)
+
+    # 进程池损坏时在途的实验：首次放回队列重试，再次遇到则记为失败
+    crashed: Set[str] = set()
+    while pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            running: Dict = {}
+            try:
+                while pending or running:
+                    # 按并发度与可用内存提交新实验；重试中的实验单独运行，以便定位导致崩溃的实验
+                    while pending and len(running) < workers:
+                        mem = available_memory_mb()
+                        if running and mem is not None and mem < mem_per_job_mb:
+                            break
+                        if running and (pending[0][0] in crashed or any(e[0] in crashed for e in running.values())):
+                            break
+                        exp = pending.pop(0)
+                        build = exp[0] in build_baseset if isinstance(build_baseset, set) else build_baseset
+                        running[pool.submit(_run_experiment_job, exp, store_base, build, isolate, log_dir,
+                                              state_dir, source_digest, adopt_existing, text_cache)] = exp
+                    done, _ = wait(list(running), timeout=5, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        try:
+                            ok, elapsed = fut.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            print(f"实验 {running[fut][0]} 异常: {e}")
+                            ok, elapsed = False, 0.0
+                        exp_name = running.pop(fut)[0]
+                        results[exp_name] = ok
+                        report(exp_name, ok, elapsed, sorted(e[0] for e in running.values()))
+            except BrokenProcessPool:
+                # 无法确定是哪个实验导致进程退出：在途实验各单独重试一次，仍失败则记为失败
+                print("工作进程异常退出 (可能内存不足)，使用新的进程池继续……", flush=True)
+                for exp in running.values():
+                    if exp[0] in crashed:
+                        results[exp[0]] = False
+                        report(exp[0], False, 0.0, [])
+                    else:
+                        crashed.add(exp[0])
+                        pending.append(exp)
+    return results
+
+
+DEFAULT_EXPERIMENTS: List[Experiment] = [
+    ("exp_len_100a", 1, 100, 100, 200, 100, 88),
+    # ("exp_len_200a", 1, 100, 200, 250, 100, 88),
+    ("exp_len_300a", 1, 100, 350, 400, 100, 88),
+    ("exp_len_400a", 1, 100, 400, 450, 100, 88),
+    ("exp_len_500a", 1, 100, 550, 600, 100, 88),
+    ("exp_len_600a", 1, 100, 600, 700, 100, 88),
+    ("exp_len_100b", 1, 100, 100, 200, 100, 66),
+    ("exp_len_200b", 1, 100, 200, 250, 100, 66),
+    ("exp_len_300b", 1, 100, 350, 400, 100, 66),
+    ("exp_len_400b", 1, 100, 400, 450, 100, 66),
+    ("exp_len_500b", 1, 100, 550, 600, 100, 66),
+    ("exp_len_600b", 1, 100, 600, 700, 100, 66),
+    ("exp_len_100c", 1, 100, 100, 200, 100, 32),
+    ("exp_len_200c", 1, 100, 200, 250, 100, 32),
+    ("exp_len_300c", 1, 100, 350, 400, 100, 32),
+    ("exp_len_400c", 1, 100, 400, 450, 100, 32),
+    ("exp_len_500c", 1, 100, 550, 600, 100, 32),
+    ("exp_len_600c", 1, 100, 600, 700, 100, 32),
+    ("exp_len_100d", 1, 100, 100, 200, 100, 77),
+    ("exp_len_200d", 1, 100, 200, 250, 100, 77),
+    ("exp_len_300d", 1, 100, 350, 400, 100, 77),
+    ("exp_len_400d", 1, 100, 400, 450, 100, 77),
+    ("exp_len_500d", 1, 100, 550, 600, 100, 77),
+    ("exp_len_600d", 1, 100, 600, 700, 100, 77),
+]
+
+
+def parse_experiments(configs: List[str], default_seed: int) -> List[Experiment]:
+    """解析 --experiments：exp_name:attempt_id:size:lb:rb:sample_per_label[:seed]，格式错误时退出。"""
+    experiments: List[Experiment] = []
+    for exp_config in configs:
+        try:
+            parts = exp_config.split(":")
+            if len(parts) not in (6, 7):
+                raise ValueError(f"配置格式错误: {exp_config}")
+            seed = int(parts[6]) if len(parts) == 7 else default_seed
+            experiments.append((parts[0], *(int(p) for p in parts[1:6]), seed))
+        except ValueError as e:
+            print(f"解析配置失败: {exp_config}, 错误: {e}")
+            sys.exit(1)
+    return experiments
 
 
 def main():
@@ -108,32 +503,80 @@ def main():
     # run_experiment_sequence("exp4d", 1, 350, 400, 500, 350, 77)
     # run_experiment_sequence("exp5d", 1, 250, 500, 600, 250, 77)
 
-    run_experiment_sequence("exp_len_100a", 1, 100, 100, 200, 100, 88)
-    # run_experiment_sequence("exp_len_200a", 1, 100, 200, 250, 100, 88)
-    run_experiment_sequence("exp_len_300a", 1, 100, 350, 400, 100, 88)
-    run_experiment_sequence("exp_len_400a", 1, 100, 400, 450, 100, 88)
-    run_experiment_sequence("exp_len_500a", 1, 100, 550, 600, 100, 88)
-    run_experiment_sequence("exp_len_600a", 1, 100, 600, 700, 100, 88)
-    run_experiment_sequence("exp_len_100b", 1, 100, 100, 200, 100, 66)
-    run_experiment_sequence("exp_len_200b", 1, 100, 200, 250, 100, 66)
-    run_experiment_sequence("exp_len_300b", 1, 100, 350, 400, 100, 66)
-    run_experiment_sequence("exp_len_400b", 1, 100, 400, 450, 100, 66)
-    run_experiment_sequence("exp_len_500b", 1, 100, 550, 600, 100, 66)
-    run_experiment_sequence("exp_len_600b", 1, 100, 600, 700, 100, 66)
-    run_experiment_sequence("exp_len_100c", 1, 100, 100, 200, 100, 32)
-    run_experiment_sequence("exp_len_200c", 1, 100, 200, 250, 100, 32)
-    run_experiment_sequence("exp_len_300c", 1, 100, 350, 400, 100, 32)
-    run_experiment_sequence("exp_len_400c", 1, 100, 400, 450, 100, 32)
-    run_experiment_sequence("exp_len_500c", 1, 100, 550, 600, 100, 32)
-    run_experiment_sequence("exp_len_600c", 1, 100, 600, 700, 100, 32)
-    run_experiment_sequence("exp_len_100d", 1, 100, 100, 200, 100, 77)
-    run_experiment_sequence("exp_len_200d", 1, 100, 200, 250, 100, 77)
-    run_experiment_sequence("exp_len_300d", 1, 100, 350, 400, 100, 77)
-    run_experiment_sequence("exp_len_400d", 1, 100, 400, 450, 100, 77)
-    run_experiment_sequence("exp_len_500d", 1, 100, 550, 600, 100, 77)
-    run_experiment_sequence("exp_len_600d", 1, 100, 600, 700, 100, 77)
+    parser = argparse.ArgumentParser(
+        description="自动运行实验流程",
+        epilog="默认行为：source 同步到 --store_base 的列式存储并以 mmap 读取；按 --state_dir 增量构建，"
+               "没有构建记录的已有数据集 / 结果直接采纳；baseset/ 下已存在的 baseset 原样复用，只生成缺失的，"
+               "重新采样须显式给出 --rebuild_basesets。")
+    parser.add_argument("--experiments", nargs="+", default=None,
+                        help="实验配置，格式: exp_name:attempt_id:size:lb:rb:sample_per_label[:seed]，"
+                             "默认 DEFAULT_EXPERIMENTS")
+    parser.add_argument("--seed", type=int, default=123, help="--experiments 未给出 seed 时使用的随机种子")
+    parser.add_argument("--store_base", default=DEFAULT_STORE_BASE,
+                        help=f"共享的二进制样本存储目录 (首次运行时转换全部 source)，为空则不使用，默认 {DEFAULT_STORE_BASE}")
+    parser.add_argument("--isolate", action="store_true", help="各阶段以独立子进程运行 (默认在当前进程内共享上下文)")
+    parser.add_argument("--state_dir", default=DEFAULT_BUILD_STATE,
+                        help=f"增量构建状态目录，为空则每次全部重跑 (会覆盖已有数据集与结果)，默认 {DEFAULT_BUILD_STATE}")
+    parser.add_argument("--text_cache", default=DEFAULT_TEXT_CACHE,
+                        help=f"result_maker 共用的文本压缩长度缓存文件，为空则仅在进程内缓存，默认 {DEFAULT_TEXT_CACHE}")
+    parser.add_argument("--rebuild_basesets", action="store_true",
+                        help="重新生成全部 baseset (覆盖 baseset/ 下已有的文件，采样结果可能不同)；默认只生成缺失的 baseset")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"并行运行的实验数 (0 表示 CPU 核数，1 即串行)，默认 {DEFAULT_WORKERS}")
+    parser.add_argument("--mem_per_job_mb", type=int, default=DEFAULT_MEM_PER_JOB_MB,
+                        help="单个实验的估算峰值内存 (MB)，可用内存不足时暂缓启动新实验")
+    args = parser.parse_args()
+
+    experiments = parse_experiments(args.experiments, args.seed) if args.experiments else list(DEFAULT_EXPERIMENTS)
+    print(f"将运行 {len(experiments)} 个实验:")
+    for i, (exp_name, attempt_id, size, lb, rb, sample_per_label, seed) in enumerate(experiments, 1):
+        print(f"  {i}. {exp_name} (attempt_id={attempt_id}, size={size}, lb={lb}, rb={rb}, "
+              f"sample_per_label={sample_per_label}, seed={seed})")
+
+    # 先一次性同步存储；失败时退回到各进程直接解析 JSON
+    store_base = args.store_base if args.store_base and prepare_store(args.store_base) else ""
+
+    # 三个阶段在当前进程内运行，覆盖矩阵与 accessor 由全部实验共享
+    ctx = PipelineContext(store_base)
+
+    # 已有的 baseset 原样复用 (仓库中已提交的 baseset 不会被静默覆盖)，只有 --rebuild_basesets 时才重新采样
+    to_build = [e for e in experiments
+                if args.rebuild_basesets or not os.path.isdir(os.path.join(exp_maker.DEFAULT_DEST_BASE, e[0]))]
+    if len(to_build) < len(experiments):
+        print(f"复用已有 baseset {len(experiments) - len(to_build)} 个 (重新生成请加 --rebuild_basesets)")
+    # 需要的 baseset 批量生成；失败时这些实验退回到各自运行 exp_maker
+    batched = not to_build or make_basesets([(e[0], e[2], e[3], e[4], e[6]) for e in to_build], ctx,
+                                            isolate=args.isolate)
+    build_baseset = set() if batched else {e[0] for e in to_build}
+    # 重新生成 baseset 时下游阶段须随之重建，不采纳已有输出
+    adopt_existing = not args.rebuild_basesets
+    ctx.report()
+
+    # 各实验互相独立：在进程池中并行运行 attempt_maker / result_maker
+    if args.workers != 1:
+        results = run_experiments_parallel(experiments, workers=args.workers or os.cpu_count() or 1,
+                                           mem_per_job_mb=args.mem_per_job_mb, store_base=store_base,
+                                           build_baseset=build_baseset, isolate=args.isolate, state_dir=args.state_dir,
+                                           adopt_existing=adopt_existing, text_cache=args.text_cache)
+        print(f"所有实验完成! 成功: {sum(results.values())}/{len(experiments)}")
+        return
+
+    source_digest = source_corpus_digest(args.state_dir) if args.state_dir else ""
+    success_count = 0
+    for exp_name, attempt_id, size, lb, rb, sample_per_label, seed in experiments:
+        if run_experiment_sequence(exp_name, attempt_id, size, lb, rb, sample_per_label, seed, store_base=store_base,
+                                   build_baseset=exp_name in build_baseset, ctx=ctx, isolate=args.isolate,
+                                   state_dir=args.state_dir, source_digest=source_digest,
+                                   adopt_existing=adopt_existing, text_cache=args.text_cache):
+            success_count += 1
+        else:
+            print(f"实验 {exp_name} (attempt_id={attempt_id}) 失败，继续下一个...")
+
+    print(f"\n{'='*50}")
+    print(f"所有实验完成! 成功: {success_count}/{len(experiments)}")
+    print(f"{'='*50}")
+    ctx.report()
 
-    
     # run_command(["python3", "exp_maker.py", "--exp_name", "exp3a", "--size", "350", "--lb", "300", "--rb", "400", "--seed", "123"], "运行exp_maker.py")
     # run_command(["python3", "exp_maker.py", "--exp_name", "exp3b", "--size", "350", "--lb", "300", "--rb", "400", "--seed", "66"], "运行exp_maker.py")
     # run_command(["python3", "exp_maker.py", "--exp_name", "exp3c", "--size", "350", "--lb", "300", "--rb", "400", "--seed", "32"], "运行exp_maker.py")
@@ -147,51 +590,6 @@ def main():
     # run_command(["python3", "result_maker.py", "--exp_name", "exp3c", "--attempt_id", "1" ], "运行result_maker.py")
     # run_command(["python3", "result_maker.py", "--exp_name", "exp3d", "--attempt_id", "1" ], "运行result_maker.py")
 
-    return
-    parser = argparse.ArgumentParser(description="自动运行实验流程")
-    parser.add_argument("--experiments", nargs="+", required=True, 
-                       help="实验配置，格式: exp_name:attempt_id:size:lb:rb:sample_per_label")
-    parser.add_argument("--seed", type=int, default=123, help="随机种子")
-    
-
-    args = parser.parse_args()
-    
-    # 解析实验配置
-    experiments: List[Tuple[str, int, int, int, int, int]] = []
-    for exp_config in args.experiments:
-        try:
-            parts = exp_config.split(":")
-            if len(parts) != 6:
-                raise ValueError(f"配置格式错误: {exp_config}")
-            
-            exp_name = parts[0]
-            attempt_id = int(parts[1])
-            size = int(parts[2])
-            lb = int(parts[3])
-            rb = int(parts[4])
-            sample_per_label = int(parts[5])
-            
-            experiments.append((exp_name, attempt_id, size, lb, rb, sample_per_label))
-        except ValueError as e:
-            print(f"解析配置失败: {exp_config}, 错误: {e}")
-            sys.exit(1)
-    
-    print(f"将运行 {len(experiments)} 个实验:")
-    for i, (exp_name, attempt_id, size, lb, rb, sample_per_label) in enumerate(experiments, 1):
-        print(f"  {i}. {exp_name} (attempt_id={attempt_id}, size={size}, lb={lb}, rb={rb}, sample_per_label={sample_per_label})")
-    
-    # 运行所有实验
-    success_count = 0
-    for exp_name, attempt_id, size, lb, rb, sample_per_label in experiments:
-        if run_experiment_sequence(exp_name, attempt_id, size, lb, rb, sample_per_label, args.seed):
-            success_count += 1
-        else:
-            print(f"实验 {exp_name} (attempt_id={attempt_id}) 失败，继续下一个...")
-    
-    print(f"\n{'='*50}")
-    print(f"所有实验完成! 成功: {success_count}/{len(experiments)}")
-    print(f"{'='*50}")
-
 
 if __name__ == "__main__":
     main()
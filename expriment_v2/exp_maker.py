@@ -2,7 +2,7 @@ import os
 import json
 import random
 import argparse
-from typing import List, Set, Dict, Tuple
+from typing import List, Optional, Set, Dict, Tuple
 
 FEATURES = [
     "original",
@@ -56,215 +56,54 @@ NONMEMBER_DIRS_REL = [p.replace("memall", "nmeall") for p in MEMBER_DIRS_REL]
 
 SOURCE_BASE = "/home/yunxiang/work_june/source"
 
+DEFAULT_DEST_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseset")
+
 # 引入 level 编码映射，便于生成 per-level index 文件
 from sampling_strategies import LEVEL_ORDER
+from src.coverage import DEFAULT_COVERAGE_NAME, CoverageIndex
 
-def load_candidate_indices(feature_file: str, lb: int, rb: int) -> List[int]:
-    """读取 *level3_0.8RE.jsonl_* 等特征文件，优先遍历其中的 index，
-    然后在对应的 original.jsonl_ 中检查 input 字段长度是否符合要求，
-    最终返回满足条件的 index 列表。
-
-    参数说明：
-        feature_file  : 形如 ``mem_level3_0.8RE.jsonl_`` 或 ``nme_level3_0.8RE.jsonl_`` 的文件路径
-        lb, rb        : 输入(input) 字段长度的下界和上界（闭区间）
-    """
-
-    # 1. 收集候选 index —— 直接遍历 feature_file
-    idx_set: Set[int] = set()
-    with open(feature_file, "r", encoding="utf-8") as fr:
-        for line in fr:
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            if "index" in obj:
-                idx_set.add(obj["index"])
-
-    if not idx_set:
-        return []
-
-    # 2. 推断同目录下的 original.jsonl_ 文件路径
-    dir_name, base_name = os.path.split(feature_file)
-    # 将 feature 片段替换为 original
-    # 例如 mem_level3_0.8RE.jsonl_ -> original.jsonl_
-    orig_base = "original.jsonl_"
-    original_file = os.path.join(dir_name, orig_base)
-
-    if not os.path.exists(original_file):
-        raise FileNotFoundError(f"推断的 original 文件不存在: {original_file}")
-
-    # 3. 遍历 original 文件，对 idx_set 进行筛选
-    accepted: List[int] = []
-    remaining = set(idx_set)
-    with open(original_file, "r", encoding="utf-8") as fr:
-        for line in fr:
-            if not remaining:
-                break  # 提前结束
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            idx = obj.get("index")
-            if idx not in remaining:
-                continue
-
-            inp = obj.get("input", "")
-            if inp is None:
-                remaining.remove(idx)
-                continue
-            # 输入有可能是 list，统一转为 str 计算长度
-            if not isinstance(inp, str):
-                inp = str(inp)
-
-            if lb <= len(inp) <= rb:
-                accepted.append(idx)
-            # 无论是否满足，都无需再检查该 idx
-            remaining.remove(idx)
-
-    return accepted
-
-
-def sample_indices(candidates: List[int], size: int) -> Set[int]:
+def sample_indices(candidates: List[int], size: int, rng: Optional[random.Random] = None) -> Set[int]:
+    """从 candidates 中无放回采样；rng 为空时使用全局 random。"""
     if len(candidates) < size:
         raise ValueError("候选样本数量不足，无法采样指定数量的 index")
-    return set(random.sample(candidates, size))
-
+    return set((rng or random).sample(candidates, size))
 
-def get_feature_file_map(dir_abs: str) -> Dict[str, str]:
-    """返回 {feature: filename} 的映射(仅文件名，不含路径)，确保每个特征恰有一个文件对应"""
-    files = [f for f in os.listdir(dir_abs) if os.path.isfile(os.path.join(dir_abs, f))]
-    mapping: Dict[str, str] = {}
-    for feat in FEATURES:
-        matched = [f for f in files if feat in f]
-        if len(matched) != 1:
-            raise FileNotFoundError(
-                f"目录 {dir_abs} 下与特征 {feat} 对应的文件数目为 {len(matched)}，应当恰为 1"
-            )
-        mapping[feat] = matched[0]
-    return mapping
-
-
-def indices_exist_in_all_dirs(sample_set: Set[int], dirs_abs: List[str]) -> bool:
-    """检查 sample_set 中的每个 index 是否在所有目录的 9 个特征文件中都存在"""
-    for d in dirs_abs:
-        try:
-            feat_file_map = get_feature_file_map(d)
-        except Exception as e:
-            print(e)
-            return False
-
-        for feat, fname in feat_file_map.items():
-            fpath = os.path.join(d, fname)
-            found = set()
-            with open(fpath, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        idx = json.loads(line)["index"]
-                    except Exception:
-                        continue
-                    if idx in sample_set:
-                        found.add(idx)
-                        if len(found) == len(sample_set):
-                            break
-            if len(found) < len(sample_set):
-                print(f"目录 {d} 下特征 {feat} 的文件 {fname} 缺失的 index: {sample_set - found}")
-                # print(f"目录 {d} 下缺失的 index: {sample_set - found}")
-                return False
-    return True
-
-
-def gather_lines_for_indices(sample_set: Set[int], dir_abs: str) -> Dict[str, List[str]]:
-    """收集 dir_abs 中每个特征文件对应 sample_set 的行，返回 {basename: lines}"""
-    feat_file_map = get_feature_file_map(dir_abs)
-    res: Dict[str, List[str]] = {}
-    for feat, fname in feat_file_map.items():
-        fpath = os.path.join(dir_abs, fname)
-        lines: List[str] = []
-        with open(fpath, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-                if obj.get("index") in sample_set:
-                    lines.append(line.rstrip("\n"))
-                if len(lines) == len(sample_set):
-                    break
-        if len(lines) != len(sample_set):
-            raise RuntimeError(f"采样行收集失败: {fpath}")
-        res[fname] = lines
-    return res
-
-
-def write_dataset(dest_root: str, dirs_rel: List[str], tag: int, sample_set: Set[int]):
-    os.makedirs(dest_root, exist_ok=True)
-    # 写 index-tag 文件
-    index_path = os.path.join(dest_root, "index_tag.jsonl")
-    with open(index_path, "w", encoding="utf-8") as fw:
-        for idx in sorted(sample_set):
-            fw.write(json.dumps({"index": idx, "tag": tag}, ensure_ascii=False) + "\n")
-
-    for rel in dirs_rel:
-        src_abs = os.path.join(SOURCE_BASE, rel)
-        dest_abs = os.path.join(dest_root, rel)
-        os.makedirs(dest_abs, exist_ok=True)
-        lines_dict = gather_lines_for_indices(sample_set, src_abs)
-        for basename, lines in lines_dict.items():
-            dest_file = os.path.join(dest_abs, basename)
-            with open(dest_file, "w", encoding="utf-8") as fw:
-                for l in lines:
-                    fw.write(l + "\n")
 
 # ------------------------ 新增工具函数 ------------------------
 
 
-def load_candidate_indices_len(feature_file: str, lb: int, rb: int) -> List[int]:
-    """直接在 *feature_file* 中根据 input 长度筛选候选 index。
+def feature_candidates(cov: CoverageIndex, dirs_rel: List[str], prefix: str,
+                       bounds: List[Tuple[int, int]]) -> List[Dict[str, List[int]]]:
+    """借助覆盖矩阵求每个 [lb, rb] 区间内各特征的候选 index (升序)，与 bounds 一一对应。
 
-    仅检查自身文件，不再回退 original.jsonl_。
+    候选为 dirs_rel[0] 中该特征文件里 lb <= len(input) <= rb，且在 dirs_rel 全部目录的
+    同名特征文件中都存在的 index；不扫描任何源文件。每个特征只调用一次 length_buckets，
+    批量模式下全部区间共享同一份排好序的长度数组。prefix 为 "mem" / "nme"。
     """
-    idxs: List[int] = []
-    with open(feature_file, "r", encoding="utf-8") as fr:
-        for line in fr:
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            inp = obj.get("input", "")
-            if not isinstance(inp, str):
-                inp = str(inp)
-            if lb <= len(inp) <= rb and "index" in obj:
-                idxs.append(obj["index"])
-    return idxs
-
-
-def indices_exist_in_feature_all_dirs(sample_set: Set[int], dirs_abs: List[str], feature: str) -> bool:
-    """检查 *sample_set* 中的每个 index 是否在 *dirs_abs* 的同名特征文件中均存在。"""
-    for d in dirs_abs:
-        try:
-            feat_file_map = get_feature_file_map(d)
-            fname = feat_file_map[feature]
-        except Exception as e:
-            print(e)
-            return False
-
-        fpath = os.path.join(d, fname)
-        found = set()
-        with open(fpath, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    idx = json.loads(line)["index"]
-                except Exception:
-                    continue
-                if idx in sample_set:
-                    found.add(idx)
-                    if len(found) == len(sample_set):
-                        break
-        if len(found) < len(sample_set):
-            missing = sample_set - found
-            print(f"目录 {d} 的特征 {feature} 缺失 index: {missing}")
-            return False
-    return True
+    who = "成员" if prefix == "mem" else "非成员"
+    out: List[Dict[str, List[int]]] = [{} for _ in bounds]
+    for feat in FEATURES:
+        fname = "original.jsonl_" if feat == "original" else f"{prefix}_{feat}.jsonl_"
+        ref_rel = f"{dirs_rel[0]}/{fname}"
+        if not cov.covers(ref_rel):
+            raise FileNotFoundError(f"{who}数据 feature={feat} 的参考文件不在覆盖矩阵中 (源文件缺失?): "
+                                    f"{os.path.join(SOURCE_BASE, ref_rel)}")
+        buckets = cov.length_buckets(cov.column(ref_rel), bounds, require_cols=cov.columns_for(dirs_rel, feat))
+        for per_bound, bucket in zip(out, buckets):
+            per_bound[feat] = bucket.tolist()
+    return out
+
+
+def sample_feature_sets(candidates: Dict[str, List[int]], prefix: str, size: int,
+                        rng: Optional[random.Random] = None) -> Dict[str, Set[int]]:
+    """按 FEATURES 顺序从 feature_candidates 的结果中为每个特征采样 *size* 个 index。"""
+    samples: Dict[str, Set[int]] = {}
+    for feat in FEATURES:
+        if len(candidates[feat]) < size:
+            who = "成员" if prefix == "mem" else "非成员"
+            raise RuntimeError(f"{who}数据中 feature={feat} 候选不足 (found={len(candidates[feat])} < size={size})")
+        samples[feat] = sample_indices(candidates[feat], size, rng)
+    return samples
 
 
 def write_dataset_per_level(dest_root: str, dirs_rel: List[str], tag: int, sample_sets: Dict[str, Set[int]]):
@@ -286,70 +125,110 @@ def write_dataset_per_level(dest_root: str, dirs_rel: List[str], tag: int, sampl
 
     # 2) 原始样本文件不再复制 —— 仅保留索引文件，实际数据在 source 目录读取。
 
+def build_baseset(cov: CoverageIndex, exp_name: str, size: int, lb: int, rb: int, seed: int, dest_base: str,
+                  candidates: Optional[Tuple[Dict[str, List[int]], Dict[str, List[int]]]] = None) -> str:
+    """生成单个实验的 baseset，返回其根目录。
+
+    candidates 为 (member, nonmember) 的 feature_candidates 结果 (批量模式预先求出)；为空时按 [lb, rb] 现算。
+    每次调用使用独立的 random.Random(seed)：member 与 nonmember 依次从同一随机流采样，
+    结果只由 seed 决定，与批量运行中的先后次序无关。
+    注意候选来自覆盖矩阵的交集 (按 index 有序)，同一 seed 采到的 index 与改用覆盖矩阵之前的版本不同。
+    """
+    if candidates is None:
+        candidates = (feature_candidates(cov, MEMBER_DIRS_REL, "mem", [(lb, rb)])[0],
+                      feature_candidates(cov, NONMEMBER_DIRS_REL, "nme", [(lb, rb)])[0])
+    member_candidates, nonmember_candidates = candidates
+    rng = random.Random(seed)
+    experiment_root = os.path.join(dest_base, exp_name)
+
+    # ------------------------ member ------------------------
+    member_samples = sample_feature_sets(member_candidates, "mem", size, rng)
+    write_dataset_per_level(os.path.join(experiment_root, "member"), MEMBER_DIRS_REL, tag=1, sample_sets=member_samples)
+
+    # ------------------------ nonmember ------------------------
+    nonmember_samples = sample_feature_sets(nonmember_candidates, "nme", size, rng)
+    write_dataset_per_level(os.path.join(experiment_root, "nonmember"), NONMEMBER_DIRS_REL, tag=0, sample_sets=nonmember_samples)
+
+    return experiment_root
+
+
+def parse_batch_config(text: str) -> Tuple[str, int, int, int, int]:
+    """解析 "exp_name:size:lb:rb:seed" 格式的批量配置。"""
+    parts = text.split(":")
+    if len(parts) != 5:
+        raise ValueError(f"配置格式错误 (应为 exp_name:size:lb:rb:seed): {text}")
+    return parts[0], int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4])
+
+
+def resolve_coverage_path(coverage_path: str = "") -> str:
+    """覆盖矩阵路径；为空时使用 <SOURCE_BASE>/_coverage.npz。"""
+    return coverage_path or os.path.join(SOURCE_BASE, DEFAULT_COVERAGE_NAME)
+
+
+def load_coverage(coverage_path: str = "") -> CoverageIndex:
+    """加载 (必要时增量刷新) source 覆盖矩阵。"""
+    return CoverageIndex.load_or_build(resolve_coverage_path(coverage_path), SOURCE_BASE,
+                                       MEMBER_DIRS_REL + NONMEMBER_DIRS_REL)
+
+
+def build_basesets(configs: List[Tuple[str, int, int, int, int]], dest_base: str = DEFAULT_DEST_BASE,
+                   coverage_path: str = "", cov: Optional[CoverageIndex] = None) -> List[str]:
+    """批量生成 baseset：覆盖矩阵只加载一次 (或由调用方传入 cov)，各特征的候选按全部配置的
+    [lb, rb] 区间一次性分桶 (CoverageIndex.length_buckets)，再逐个配置采样。"""
+    if cov is None:
+        cov = load_coverage(coverage_path)
+    bounds = list(dict.fromkeys((lb, rb) for _, _, lb, rb, _ in configs))
+    try:
+        member = feature_candidates(cov, MEMBER_DIRS_REL, "mem", bounds)
+        nonmember = feature_candidates(cov, NONMEMBER_DIRS_REL, "nme", bounds)
+    except FileNotFoundError as e:
+        names = ", ".join(exp_name for exp_name, *_ in configs)
+        raise FileNotFoundError(f"生成 baseset {names} 失败: {e}") from e
+    by_bound = {bound: (m, nm) for bound, m, nm in zip(bounds, member, nonmember)}
+
+    roots: List[str] = []
+    for exp_name, size, lb, rb, seed in configs:
+        try:
+            roots.append(build_baseset(cov, exp_name, size, lb, rb, seed, dest_base, candidates=by_bound[(lb, rb)]))
+        except RuntimeError as e:
+            raise RuntimeError(f"生成 baseset {exp_name} 失败: {e}") from e
+        print(f"基础数据集已生成于: {roots[-1]}")
+    return roots
+
+
 # python3 exp_maker.py --exp_name exp1a --size 350 --lb 100 --rb 200 --seed 123
 # python3 exp_maker.py --exp_name exp2a --size 350 --lb 200 --rb 300 --seed 123
 # python3 exp_maker.py --exp_name exp3a --size 350 --lb 300 --rb 400 --seed 123
 # python3 exp_maker.py --exp_name exp4a --size 350 --lb 400 --rb 500 --seed 123
 # python3 exp_maker.py --exp_name exp5a --size 350 --lb 500 --rb 600 --seed 123
+# python3 exp_maker.py --batch exp1a:350:100:200:123 exp1b:350:100:200:66
 def main():
     parser = argparse.ArgumentParser(description="构造实验基础数据集 (baseset)")
-    parser.add_argument("--exp_name", required=True, help="实验名称，例如 exp1")
-    parser.add_argument("--size", type=int, required=True, help="采样样本数量")
-    parser.add_argument("--lb", type=int, required=True, help="输入长度下界 (inclusive)")
-    parser.add_argument("--rb", type=int, required=True, help="输入长度上界 (inclusive)")
+    parser.add_argument("--exp_name", help="实验名称，例如 exp1")
+    parser.add_argument("--size", type=int, help="采样样本数量")
+    parser.add_argument("--lb", type=int, help="输入长度下界 (inclusive)")
+    parser.add_argument("--rb", type=int, help="输入长度上界 (inclusive)")
     parser.add_argument("--seed", type=int, default=42, help="随机种子")
-    parser.add_argument("--dest_base", default=os.path.join(os.path.dirname(__file__), "baseset"), help="目标根目录")
+    parser.add_argument("--batch", nargs="+", default=None,
+                        help="批量模式，每项格式 exp_name:size:lb:rb:seed；给定时忽略 --exp_name/--size/--lb/--rb/--seed")
+    parser.add_argument("--dest_base", default=DEFAULT_DEST_BASE, help="目标根目录")
+    parser.add_argument("--coverage", default="",
+                        help=f"source 覆盖矩阵文件 (默认 <SOURCE_BASE>/{DEFAULT_COVERAGE_NAME})，不存在或过期时自动生成 / 增量刷新")
 
     args = parser.parse_args()
-    random.seed(args.seed)
-
-    experiment_root = os.path.join(args.dest_base, args.exp_name)
-
-    # ------------------------ member ------------------------
-    member_samples: Dict[str, Set[int]] = {}
-    member_dirs_abs = [os.path.join(SOURCE_BASE, p) for p in MEMBER_DIRS_REL]
 
-    for feat in FEATURES:
-        if feat == "original":
-            fname = "original.jsonl_"
-        else:
-            fname = f"mem_{feat}.jsonl_"
-        feature_file = os.path.join(SOURCE_BASE, MEMBER_DIRS_REL[0], fname)
-        candidates = load_candidate_indices_len(feature_file, args.lb, args.rb)
-        if len(candidates) < args.size:
-            raise RuntimeError(f"成员数据中 feature={feat} 候选不足 (found={len(candidates)} < size={args.size})")
-        while True:
-            sample_set = sample_indices(candidates, args.size)
-            if indices_exist_in_feature_all_dirs(sample_set, member_dirs_abs, feat):
-                member_samples[feat] = sample_set
-                break
-            print(f"[member] feature={feat} 采样集合存在缺失，重新采样……")
-
-    write_dataset_per_level(os.path.join(experiment_root, "member"), MEMBER_DIRS_REL, tag=1, sample_sets=member_samples)
-
-    # ------------------------ nonmember ------------------------
-    nonmember_samples: Dict[str, Set[int]] = {}
-    nonmember_dirs_abs = [os.path.join(SOURCE_BASE, p) for p in NONMEMBER_DIRS_REL]
-
-    for feat in FEATURES:
-        if feat == "original":
-            fname = "original.jsonl_"
-        else:
-            fname = f"nme_{feat}.jsonl_"
-        feature_file = os.path.join(SOURCE_BASE, NONMEMBER_DIRS_REL[0], fname)
-        candidates = load_candidate_indices_len(feature_file, args.lb, args.rb)
-        if len(candidates) < args.size:
-            raise RuntimeError(f"非成员数据中 feature={feat} 候选不足 (found={len(candidates)} < size={args.size})")
-        while True:
-            sample_set = sample_indices(candidates, args.size)
-            if indices_exist_in_feature_all_dirs(sample_set, nonmember_dirs_abs, feat):
-                nonmember_samples[feat] = sample_set
-                break
-            print(f"[nonmember] feature={feat} 采样集合存在缺失，重新采样……")
-
-    write_dataset_per_level(os.path.join(experiment_root, "nonmember"), NONMEMBER_DIRS_REL, tag=0, sample_sets=nonmember_samples)
-
-    print(f"基础数据集已生成于: {experiment_root}")
+    if args.batch:
+        try:
+            configs = [parse_batch_config(c) for c in args.batch]
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        missing = [f"--{k}" for k in ("exp_name", "size", "lb", "rb") if getattr(args, k) is None]
+        if missing:
+            parser.error(f"缺少参数: {' '.join(missing)} (或使用 --batch)")
+        configs = [(args.exp_name, args.size, args.lb, args.rb, args.seed)]
+
+    build_basesets(configs, args.dest_base, args.coverage)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import gc
+import multiprocessing
 from pathlib import Path
 import sys
 from tqdm import tqdm
@@ -9,25 +12,80 @@ SRC_DIR = CURRENT_DIR / "src"
 if str(SRC_DIR) not in sys.path:
     sys.path.append(str(SRC_DIR))
 
-from src.run import process_jsonl, BaseSetAccessor
+from src.run import process_jsonl, BaseSetAccessor, collect_needed_indices, make_selection
+from src.features import FeatureTable, reject_text_metrics
+from src.textcache import get_text_cache, use_text_cache
 
-# python3 result_maker.py --exp_name exp1 --attempt_id 1
-# python3 result_maker.py --exp_name exp2 --attempt_id 1
-def main():
-    parser = argparse.ArgumentParser(description="批量运行 attempt 目录下所有测试数据集并生成结果")
-    parser.add_argument("--exp_name", required=True, help="实验名称 (如 exp1)")
-    parser.add_argument("--attempt_id", type=int, default=1, help="attempt 序号 (默认 1)")
-    parser.add_argument(
-        "--skip_existing",
-        action="store_true",
-        help="若结果目录下已存在 predictions.jsonl，则跳过该数据集 (增量式)"
-    )
-    args = parser.parse_args()
+# 并行模式下由父进程在 fork 前设置，子进程以写时复制方式只读共享已加载的源文件 / 特征表
+_POOL_ACCESSOR: "BaseSetAccessor | None" = None
+_POOL_FEATURES: "FeatureTable | None" = None
+
+
+def _process_one(jf: str, baseset_dir: str, out_dir: str, metrics=None, models=None, ref_pairs=None):
+    """工作进程入口：处理单个数据集，返回 (错误信息 (成功时为 None), 新增的文本长度缓存条目)。
+
+    文本长度缓存由父进程统一合并、写回，子进程不写文件。
+    """
+    err = None
+    try:
+        process_jsonl(jf, baseset_dir, out_dir, accessor=_POOL_ACCESSOR, feature_table=_POOL_FEATURES,
+                      metrics=metrics, models=models, ref_pairs=ref_pairs)
+    except Exception as e:
+        err = str(e)
+    return err, get_text_cache().take_new()
+
+
+def _run_parallel(pending, baseset_dir: Path, accessor: "BaseSetAccessor", feature_table: "FeatureTable | None",
+                  needed_keys, workers: int, metrics=None, models=None, ref_pairs=None):
+    """fork 出 workers 个进程并行处理 pending；父进程先加载全部所需数据，子进程不再重复解析。"""
+    global _POOL_ACCESSOR, _POOL_FEATURES
+    keys = sorted(needed_keys)
+    if feature_table is not None:
+        feature_table.preload(keys)
+    else:
+        for tag, level_code in keys:
+            accessor.prefetch([tag], [level_code])
+    _POOL_ACCESSOR, _POOL_FEATURES = accessor, feature_table
+    # 已加载对象移出 GC 跟踪，避免子进程垃圾回收遍历时写对象头导致整页复制
+    gc.freeze()
+    # 父进程已有的条目由父进程自己保存，子进程只交回 fork 之后新增的部分
+    text_cache = get_text_cache()
+    text_cache.take_new()
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = {pool.submit(_process_one, str(jf), str(baseset_dir), str(out_dir), metrics, models,
+                                   ref_pairs): jf
+                       for jf, out_dir in pending}
+            for fut in tqdm(as_completed(futures), total=len(futures), desc="Running datasets"):
+                jf = futures[fut]
+                try:
+                    err, new_lengths = fut.result()
+                    text_cache.update(new_lengths)
+                except Exception as e:
+                    err = f"工作进程异常退出: {e}"
+                if err is not None:
+                    print(f"处理 {jf} 时出错: {err}")
+    finally:
+        gc.unfreeze()
+        _POOL_ACCESSOR = _POOL_FEATURES = None
 
+
+def make_results(exp_name: str, attempt_id: int = 1, *, skip_existing: bool = False,
+                 accessor: "BaseSetAccessor | None" = None, feature_table: "FeatureTable | None" = None,
+                 workers: int = 1, metrics=None, models=None, ref_pairs=None, text_cache: str = ""):
+    """对 dataset/<exp_name>/attempt<attempt_id> 下全部数据集打分，结果写入 result/ 对应目录。
+
+    accessor 可由调用方传入并在多个实验间复用 (auto_run 的进程内流水线)；为空时新建默认 accessor。
+    workers > 1 时以 fork 进程池并行处理各数据集 (不支持 fork 的平台退回串行)。
+    metrics / models 限定计算的指标与模型 (见 src/batch.py 的 MetricSelection)，未选模型 / variant 的源文件不会被读取。
+    ref_pairs 为 Ref 指标的 "目标:参考" 列表 (见 src/batch.py 的 parse_ref_pairs)。
+    text_cache 为文本压缩长度缓存文件 (见 src/textcache.py)，运行前加载、结束后写回；为空时仅在进程内缓存。
+    """
     base_dir = Path(__file__).resolve().parent
-    dataset_root = base_dir / "dataset" / args.exp_name / f"attempt{args.attempt_id}"
-    baseset_dir = base_dir / "baseset" / args.exp_name
-    result_root = base_dir / "result" / args.exp_name / f"attempt{args.attempt_id}"
+    dataset_root = base_dir / "dataset" / exp_name / f"attempt{attempt_id}"
+    baseset_dir = base_dir / "baseset" / exp_name
+    result_root = base_dir / "result" / exp_name / f"attempt{attempt_id}"
 
     if not dataset_root.exists():
         raise FileNotFoundError(f"找不到数据集目录: {dataset_root}")
@@ -41,28 +99,153 @@ def main():
 
     print(f"共发现 {len(jsonl_files)} 个数据集文件，开始处理……")
 
-    # 预创建一个共享 accessor，避免在每个数据集处理时重复解析大文件
-    shared_accessor = BaseSetAccessor(str(baseset_dir))
-
-    for jf in tqdm(jsonl_files, desc="Running datasets"):
+    # 若启用跳过逻辑且结果已存在，则不再处理该文件
+    pending = []
+    for jf in jsonl_files:
         rel_path = jf.relative_to(dataset_root)
         out_dir = result_root / rel_path.parent / rel_path.stem
-
-        # 若启用跳过逻辑且结果已存在，则继续下一文件
         auc_file = out_dir / "auc.txt"
-        if args.skip_existing and auc_file.exists():
-            tqdm.write(f"[SKIP] 已存在结果: {auc_file}")
+        if skip_existing and auc_file.exists():
+            print(f"[SKIP] 已存在结果: {auc_file}")
             continue
+        pending.append((jf, out_dir))
 
-        try:
-            process_jsonl(str(jf), str(baseset_dir), str(out_dir), accessor=shared_accessor)
-        except Exception as e:
-            print(f"处理 {jf} 时出错: {e}")
+    if text_cache:
+        use_text_cache(text_cache)
+    if accessor is None:
+        accessor = BaseSetAccessor(str(baseset_dir))
+    selection = make_selection(metrics, models, ref_pairs)
+    if feature_table is not None:
+        reject_text_metrics(selection)
+    if selection is not None:
+        accessor.select_variants(selection.variants(BaseSetAccessor._MODEL_DIRS))
+    # 预扫描全部待处理数据集，源文件只保留被引用到的 index
+    needed = collect_needed_indices(str(jf) for jf, _ in pending)
+    accessor.set_needed_indices(needed)
 
-        # return
+    if workers > 1 and len(pending) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        _run_parallel(pending, baseset_dir, accessor, feature_table, needed.keys(),
+                      min(workers, len(pending)), metrics, models, ref_pairs)
+    else:
+        for jf, out_dir in tqdm(pending, desc="Running datasets"):
+            try:
+                process_jsonl(str(jf), str(baseset_dir), str(out_dir), accessor=accessor,
+                              feature_table=feature_table, metrics=metrics, models=models,
+                              ref_pairs=ref_pairs)
+            except Exception as e:
+                print(f"处理 {jf} 时出错: {e}")
 
+            # return
+
+    accessor.save_manifest()
+    get_text_cache().save()
+    print(f"缓存统计: {accessor.cache_stats}，文本长度缓存: {get_text_cache().stats}")
     print("全部数据集处理完毕！")
 
 
+# python3 result_maker.py --exp_name exp1 --attempt_id 1
+# python3 result_maker.py --exp_name exp2 --attempt_id 1
+def main():
+    parser = argparse.ArgumentParser(description="批量运行 attempt 目录下所有测试数据集并生成结果")
+    parser.add_argument("--exp_name", required=True, help="实验名称 (如 exp1)")
+    parser.add_argument("--attempt_id", type=int, default=1, help="attempt 序号 (默认 1)")
+    parser.add_argument(
+        "--skip_existing",
+        action="store_true",
+        help="若结果目录下已存在 predictions.jsonl，则跳过该数据集 (增量式)"
+    )
+    parser.add_argument(
+        "--store_base",
+        default="",
+        help="二进制列式存储根目录 (由 python3 -m src.store 生成)，为空则直接解析 source 下的 JSON"
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="以内存映射方式读取 store，logprobs 以零拷贝视图传给打分 (需配合 --store_base)"
+    )
+    parser.add_argument(
+        "--manifest",
+        default="",
+        help="路径与样本偏移清单 (由 python3 -m src.manifest 生成)，为空则不使用；按需 pread 读取单条样本"
+    )
+    parser.add_argument(
+        "--max_cache_records",
+        type=int,
+        default=0,
+        help="accessor 文件缓存的记录数上限，超出按文件 LRU 淘汰 (0 表示不限)"
+    )
+    parser.add_argument(
+        "--max_cache_mb",
+        type=int,
+        default=0,
+        help="accessor 文件缓存的估算内存上限 (MB)，超出按文件 LRU 淘汰 (0 表示不限)"
+    )
+    parser.add_argument(
+        "--prefetch_workers",
+        type=int,
+        default=0,
+        help="每遇到新的 (tag, level) 时并发预取其全部模型文件的工作线程/进程数 (0 表示串行按需加载)"
+    )
+    parser.add_argument(
+        "--feature_table",
+        default="",
+        help="预计算的逐样本特征表目录 (由 python3 -m src.features 生成)；给定时打分只做 index join，不访问 source (不支持 ppl/<压缩器> 指标)"
+    )
+    parser.add_argument(
+        "--coverage",
+        default="",
+        help="source 覆盖矩阵文件 (由 python3 -m src.coverage 生成，过期时自动增量刷新)；fetch 前据此排除缺失的 index"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并行处理数据集的进程数；父进程先加载所需源数据，fork 后子进程写时复制共享 (默认 1 即串行)"
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=None,
+        help="只计算这些指标：裸指标名对所选全部模型计算 (如 Min_20%%++)，带模型前缀的只对该模型计算 "
+             "(如 starcoder2_7b_Min_20%%++)；默认输出全部默认指标。其他压缩器的参考熵需显式选择，"
+             "如 ppl/lzma ppl/bz2-1 ppl/zstd-19 (zstd 需安装 zstandard)"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=None,
+        help="只读取 / 计算这些模型 (如 starcoder2_7b codellama_13b)，未选模型的源文件不会被打开；默认全部"
+    )
+    parser.add_argument(
+        "--ref_pairs",
+        nargs="+",
+        default=None,
+        help="Ref 指标的 目标:参考 模型对 (如 codellama_13b:starcoder2_3b)，可用 * 通配，all 表示全部有序对；"
+             "默认四个同系列大小模型对"
+    )
+    parser.add_argument(
+        "--text_cache",
+        default="",
+        help="按文本内容哈希的 zlib 长度缓存文件 (可由 python3 -m src.textcache 预先生成，运行后写回新增条目)；"
+             "为空则仅在本进程内缓存"
+    )
+    args = parser.parse_args()
+
+    feature_table = FeatureTable(args.feature_table) if args.feature_table else None
+
+    # 预创建一个共享 accessor，避免在每个数据集处理时重复解析大文件
+    shared_accessor = BaseSetAccessor(store_base=args.store_base, mmap=args.mmap,
+                                      manifest_path=args.manifest,
+                                      max_cache_records=args.max_cache_records,
+                                      max_cache_bytes=args.max_cache_mb * 1024 * 1024,
+                                      prefetch_workers=args.prefetch_workers,
+                                      coverage_path=args.coverage)
+
+    make_results(args.exp_name, args.attempt_id, skip_existing=args.skip_existing, accessor=shared_accessor,
+                 feature_table=feature_table, workers=args.workers, metrics=args.metrics, models=args.models,
+                 ref_pairs=args.ref_pairs, text_cache=args.text_cache)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,601 @@
+"""批量打分引擎。
+
+calc.calculate_all_scores 逐样本、逐模型计算，每次都要为 PPL / Min-K / Min-K++ / Neighbor
+分配若干小数组。本模块把一个数据集的全部样本按模型拼成不等长 (ragged) 数组：
+
+    values   float64 (m,)     全部样本 logprob 的扁平拼接
+    offsets  int64   (n+1,)   第 i 个样本对应 values[offsets[i]:offsets[i+1]]
+
+再用 NumPy 分段运算 (reduceat / 段内排序 + 前缀和) 一次性算出全部样本的指标，
+得到 (样本 × 指标) 矩阵。指标语义与 calc.calculate_all_scores 逐一对应
+(包括 Min-K 在 k=0 时用更大比例的值回填)，score_samples 再把矩阵还原为逐样本的 pred 字典。
+
+指标与中间量均在注册表中声明 (register_metric / register_intermediate)：
+
+    中间量  名称 + 依赖 + 计算函数，如 mean <- lp，std <- lp, mean
+    指标    名称 + 所需中间量 + 计算函数，如 Min_20%++ <- lp, mean, std
+
+打分时只对请求的指标沿依赖求值，每个中间量在每个 (数据集, 模型) 上至多计算一次；
+未被请求的指标及其独占的中间量 (如 nb logprobs、段内排序) 完全不计算。
+
+其他压缩器的参考熵 ppl/<压缩器>[-<级别>] (如 ppl/lzma、ppl/bz2-1) 不进入全局注册表：
+MetricSelection 解析 --metrics 时为该次选择单独构造 (见 codec_metric)，默认输出不含这些指标。
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .calc import MINK_RATIOS, REF_PAIRS, ref_metric_name
+from .textcache import compressed_lengths, parse_codec, zlib_lengths
+
+logger = logging.getLogger(__name__)
+
+def _to_float(val: Any) -> float:
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class RaggedArray:
+    """不等长 float64 序列的扁平表示 (values, offsets)。"""
+
+    def __init__(self, values: np.ndarray, offsets: np.ndarray):
+        self.values = values
+        self.offsets = offsets
+        self.lengths = np.diff(offsets)
+        self._mean = None
+        self._csum = None
+
+    @classmethod
+    def from_sequences(cls, seqs: Sequence[Any]) -> "RaggedArray":
+        arrays = [np.asarray(s, dtype=np.float64).ravel() for s in seqs]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        if arrays:
+            np.cumsum([len(a) for a in arrays], out=offsets[1:])
+        values = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.float64)
+        return cls(values, offsets)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def segment_sum(self, values: np.ndarray = None) -> np.ndarray:
+        """逐段求和；空段为 0。"""
+        values = self.values if values is None else values
+        out = np.zeros(len(self), dtype=np.float64)
+        nonempty = self.lengths > 0
+        if nonempty.any():
+            out[nonempty] = np.add.reduceat(values, self.offsets[:-1][nonempty])
+        return out
+
+    def mean(self) -> np.ndarray:
+        """逐段均值；空段为 NaN。"""
+        if self._mean is None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self._mean = self.segment_sum() / self.lengths
+        return self._mean
+
+    def std(self) -> np.ndarray:
+        """逐段总体标准差 (同 np.std)；空段为 NaN。"""
+        dev = self.values - np.repeat(self.mean(), self.lengths)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.sqrt(self.segment_sum(dev * dev) / self.lengths)
+
+    def _sorted_prefix(self) -> np.ndarray:
+        """段内升序排序、减去段均值后的扁平前缀和 (长度 m+1)。
+
+        各段中心化后的和约为 0，全局前缀和在段边界处保持在 0 附近，
+        段内差分不会因累积了前面全部样本而损失精度。
+        """
+        if self._csum is None:
+            # 先按值排序，再按段号稳定排序；段号取最小整数类型 (段数 < 65536 时 NumPy 走基数排序)
+            seg = np.repeat(np.arange(len(self), dtype=np.min_scalar_type(max(len(self) - 1, 0))), self.lengths)
+            order = np.argsort(self.values)
+            order = order[np.argsort(seg[order], kind="stable")]
+            centered = self.values[order] - np.repeat(self.mean(), self.lengths)
+            self._csum = np.concatenate(([0.0], np.cumsum(centered)))
+        return self._csum
+
+    def smallest_k_mean(self, k: np.ndarray) -> np.ndarray:
+        """逐段最小 k 个值的均值；k=0 的段为 NaN。"""
+        csum = self._sorted_prefix()
+        start = self.offsets[:-1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = self.mean() + (csum[start + k] - csum[start]) / k
+        out[k == 0] = np.nan
+        return out
+
+
+def _model_keys(sample: Dict[str, Any]) -> List[str]:
+    """与 calc.calculate_all_scores 相同的模型识别规则。"""
+    return sorted({k[:-len("_logprobs")] for k in sample if k.endswith("_logprobs") and "nb" not in k})
+
+
+# -----------------------------------------------------------------------------
+# 注册表
+
+
+@dataclass
+class Intermediate:
+    """中间量：fn 按 needs 的顺序接收依赖的值。per_model=False 的中间量与模型无关，全数据集共享。"""
+    name: str
+    needs: Tuple[str, ...]
+    fn: Callable[..., Any]
+    per_model: bool = True
+
+
+@dataclass
+class Metric:
+    """指标：per_model=True 时对每个模型输出一列 <model>_<name>，否则输出单列 <name>。"""
+    name: str
+    needs: Tuple[str, ...]
+    fn: Callable[..., np.ndarray]
+    per_model: bool = True
+
+
+INTERMEDIATES: Dict[str, Intermediate] = {}
+# 注册顺序即默认输出顺序 (决定 auc.txt 的行序)
+METRICS: Dict[str, Metric] = {}
+
+
+def register_intermediate(name: str, needs: Sequence[str] = (), per_model: bool = True):
+    def decorator(fn):
+        INTERMEDIATES[name] = Intermediate(name, tuple(needs), fn, per_model)
+        return fn
+    return decorator
+
+
+def register_metric(name: str, needs: Sequence[str], per_model: bool = True):
+    def decorator(fn):
+        METRICS[name] = Metric(name, tuple(needs), fn, per_model)
+        return fn
+    return decorator
+
+
+class _Context:
+    """按需求值并缓存中间量。根上下文持有 samples，模型上下文另持有 model 并继承根上下文。
+
+    intermediates 默认为全局注册表；模型上下文沿用根上下文的。
+    """
+
+    def __init__(self, values: Dict[str, Any], parent: "Optional[_Context]" = None,
+                 intermediates: Optional[Dict[str, Intermediate]] = None):
+        self._values = dict(values)
+        self._parent = parent
+        if intermediates is None:
+            intermediates = parent._specs if parent is not None else INTERMEDIATES
+        self._specs = intermediates
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self._values:
+            return self._values[name]
+        spec = self._specs.get(name)
+        if (spec is None or not spec.per_model) and self._parent is not None:
+            return self._parent[name]
+        if spec is None:
+            raise KeyError(f"未注册的中间量: {name}")
+        value = spec.fn(*(self[dep] for dep in spec.needs))
+        self._values[name] = value
+        return value
+
+    def evaluate(self, metric: Metric) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            return np.asarray(metric.fn(*(self[dep] for dep in metric.needs)), dtype=np.float64)
+
+
+def _mink_ratio_name(r: float) -> str:
+    return f"Min_{int(r * 100)}%"
+
+
+# ------------------------- 中间量 -------------------------
+
+
+@register_intermediate("zlib_len", needs=("samples",), per_model=False)
+def _zlib_len(samples):
+    # 特征表样本自带 zlib_entropy；其余按文本内容查缓存 (见 src/textcache.py)，每段文本只压缩一次
+    out = np.empty(len(samples), dtype=np.float64)
+    rows = [i for i, s in enumerate(samples) if "zlib_entropy" not in s]
+    for i, s in enumerate(samples):
+        if "zlib_entropy" in s:
+            out[i] = s["zlib_entropy"]
+    if rows:
+        out[rows] = zlib_lengths([samples[i].get("text", "") or "" for i in rows])
+    return out
+
+
+@register_intermediate("lp", needs=("samples", "model"))
+def _lp(samples, model):
+    return RaggedArray.from_sequences([s.get(f"{model}_logprobs", []) for s in samples])
+
+
+@register_intermediate("mean", needs=("lp",))
+def _mean(lp):
+    return lp.mean()
+
+
+@register_intermediate("std", needs=("lp",))
+def _std(lp):
+    return lp.std()
+
+
+@register_intermediate("loss", needs=("mean",))
+def _loss(mean):
+    return -mean
+
+
+@register_intermediate("nb_loss", needs=("samples", "model"))
+def _nb_loss(samples, model):
+    # 特征表样本直接给出 nb_loss，其余由 nb logprobs 计算
+    key = f"{model}_nb_loss"
+    nb = RaggedArray.from_sequences([[] if key in s else s.get(f"{model}_nb_logprobs", []) for s in samples])
+    nb_loss = -nb.mean()
+    for i, s in enumerate(samples):
+        if key in s:
+            nb_loss[i] = _to_float(s[key])
+    return nb_loss
+
+
+@register_intermediate("rec_new_loss", needs=("samples", "model"))
+def _rec_new_loss(samples, model):
+    return np.asarray([_to_float(s.get(f"{model}_rec_new_Loss", float("nan"))) for s in samples],
+                      dtype=np.float64)
+
+
+# ------------------------- 指标 -------------------------
+
+
+@register_metric("zlib_entropy", needs=("zlib_len",), per_model=False)
+def _m_zlib_entropy(zlib_len):
+    return zlib_len
+
+
+@register_metric("ppl", needs=("loss",))
+def _m_ppl(loss):
+    return np.exp(loss)
+
+
+def _loss_per_length(loss, length):
+    return np.where((length == 0) | np.isnan(loss), np.nan, loss / length)
+
+
+@register_metric("ppl/zlib", needs=("loss", "zlib_len"))
+def _m_ppl_zlib(loss, zlib_len):
+    return _loss_per_length(loss, zlib_len)
+
+
+def _register_mink(r: float):
+    # k = int(n * ratio)；k=0 时与 calc 一致，改用更大比例中最近的 k>0 (即回填其 Min-K 值)
+    larger = sorted(x for x in MINK_RATIOS if x > r)
+
+    @register_metric(_mink_ratio_name(r), needs=("lp",))
+    def _m_mink(lp):
+        k = (lp.lengths * r).astype(np.int64)
+        for x in larger:
+            k = np.where(k == 0, (lp.lengths * x).astype(np.int64), k)
+        return -lp.smallest_k_mean(k)
+
+
+def _register_mink_pp(r: float):
+    # z-score 后的最小 k 个均值 = (原值最小 k 个均值 - μ) / σ，k 至少为 1
+    @register_metric(_mink_ratio_name(r) + "++", needs=("lp", "mean", "std"))
+    def _m_mink_pp(lp, mean, std):
+        k = np.maximum((lp.lengths * r).astype(np.int64), 1)
+        k[lp.lengths == 0] = 0
+        return -(lp.smallest_k_mean(k) - mean) / (std + 1e-6)
+
+
+for _r in MINK_RATIOS:
+    _register_mink(_r)
+for _r in MINK_RATIOS:
+    _register_mink_pp(_r)
+
+
+@register_metric("Neighbor", needs=("loss", "nb_loss"))
+def _m_neighbor(loss, nb_loss):
+    return loss - nb_loss
+
+
+@register_metric("ReCall_new", needs=("loss", "rec_new_loss"))
+def _m_recall_new(loss, rec_new_loss):
+    ok = ~np.isnan(rec_new_loss) & ~np.isnan(loss) & ~np.isclose(loss, 0)
+    return np.where(ok, -rec_new_loss / loss, np.nan)
+
+
+@register_metric("loss", needs=("loss",))
+def _m_loss(loss):
+    return loss
+
+
+@register_metric("nb_loss", needs=("nb_loss",))
+def _m_nb_loss(nb_loss):
+    return nb_loss
+
+
+@register_metric("rec_new_Loss", needs=("rec_new_loss",))
+def _m_rec_new_loss(rec_new_loss):
+    return rec_new_loss
+
+
+# Ref 跨模型，在 score_matrix 中按 (目标, 参考) 对计算 (默认 calc.REF_PAIRS)，只依赖各模型的 loss
+REF_METRIC = "Ref"
+_REF_NEEDS = ("loss",)
+ALL_REF_PAIRS = "all"
+
+
+def parse_ref_pairs(specs: Iterable[str], known_models: Iterable[str]) -> List[Tuple[str, str]]:
+    """解析 --ref_pairs：每项为 "目标:参考"，目标或参考可写 * 表示全部模型；"all" 即 "*:*"。
+
+    结果去重并去掉目标与参考相同的组合，如 ["all"] 得到全部 N×(N-1) 个有序对。
+    """
+    known = list(known_models)
+    pairs: List[Tuple[str, str]] = []
+    for spec in specs:
+        if spec == ALL_REF_PAIRS:
+            spec = "*:*"
+        target, sep, reference = spec.partition(":")
+        if not sep or not target or not reference:
+            raise ValueError(f"无法解析 Ref 对: {spec}，应为 目标:参考 (如 starcoder2_7b:starcoder2_3b)")
+        for name in (target, reference):
+            if name != "*" and name not in known:
+                raise ValueError(f"未知模型: {name}；可选: {known}")
+        targets = known if target == "*" else [target]
+        references = known if reference == "*" else [reference]
+        pairs.extend((t, r) for t in targets for r in references if t != r)
+    return list(dict.fromkeys(pairs))
+
+# 中间量 -> 其读取的 source variant 后缀；origin ("") 始终读取，用于识别模型与取 text
+_VARIANT_SUFFIX = {"nb_loss": "_nb", "rec_new_loss": "_rec_new"}
+VARIANT_SUFFIXES = ("", "_nb", "_rec_new")
+
+
+_CODEC_METRIC_RE = re.compile(r"(?:^|_)(ppl/([a-z0-9-]+))$")
+
+
+def codec_metric(codec: str) -> Tuple[Metric, Intermediate]:
+    """构造 codec 的参考熵指标 ppl/<codec> 及其依赖的长度中间量 len/<codec> (不写入全局注册表)。
+
+    未知或不可用的压缩器抛 ValueError。长度按文本内容缓存，未命中者的压缩见 textcache.compressed_lengths。
+    """
+    parse_codec(codec)
+    length_name = f"len/{codec}"
+
+    def _codec_len(samples):
+        # 特征表样本不含 text，记为 NaN (对应指标为 NaN)
+        out = np.full(len(samples), np.nan)
+        rows = [i for i, s in enumerate(samples) if "text" in s]
+        if rows:
+            out[rows] = compressed_lengths(codec, [samples[i]["text"] or "" for i in rows])
+        return out
+    return (Metric(f"ppl/{codec}", ("loss", length_name), _loss_per_length),
+            Intermediate(length_name, ("samples",), _codec_len, per_model=False))
+
+
+def _all_metric_names() -> List[str]:
+    return list(METRICS) + [REF_METRIC]
+
+
+def _split_metric_name(name: str) -> Tuple[Optional[str], str]:
+    """"starcoder2_7b_Min_20%++" -> ("starcoder2_7b", "Min_20%++")；裸指标名返回 (None, name)。
+
+    按最长的指标名后缀匹配 (如 "x_nb_loss" 解析为 nb_loss 而非 loss)；无法解析时抛 ValueError。
+    """
+    if name in METRICS or name == REF_METRIC:
+        return None, name
+    m = _CODEC_METRIC_RE.search(name)
+    if m is not None and m.group(1) not in METRICS:
+        parse_codec(m.group(2))
+        return name[:m.start()] or None, m.group(1)
+    target, sep, _ = name.partition(f"_{REF_METRIC}_")
+    if sep and target:
+        return target, REF_METRIC
+    for metric in sorted(_all_metric_names(), key=len, reverse=True):
+        if name.endswith("_" + metric) and len(name) > len(metric) + 1:
+            return name[:-len(metric) - 1], metric
+    raise ValueError(f"未知指标: {name}；可选: {_all_metric_names()} 或 ppl/<压缩器>[-<级别>] "
+                     f"(可加模型前缀，如 starcoder2_7b_Min_20%++)")
+
+
+class MetricSelection:
+    """指标 / 模型选择 (result_maker 的 --metrics / --models)。
+
+    metrics 中的名称可以是裸指标名 (对所选全部模型计算，如 "Min_20%++")，也可以带模型前缀
+    (只对该模型计算，如 "starcoder2_7b_Min_20%++")；两者均为空时计算全部指标。
+    models 为空时：若 metrics 全部带模型前缀则只取这些模型，否则取全部模型。
+    ref_pairs 为 Ref 指标的 (目标, 参考) 对，默认 calc.REF_PAIRS (见 parse_ref_pairs)。
+    known_models 非空时校验模型名。
+    metrics 中的 ppl/<压缩器>[-<级别>] 指标及其中间量只存在于本实例 (codec_metrics / intermediates)。
+    """
+
+    def __init__(self, metrics: Optional[Iterable[str]] = None, models: Optional[Iterable[str]] = None,
+                 known_models: Optional[Iterable[str]] = None,
+                 ref_pairs: Optional[Sequence[Tuple[str, str]]] = None):
+        known = set(known_models) if known_models else None
+        self.ref_pairs: List[Tuple[str, str]] = list(REF_PAIRS if ref_pairs is None else ref_pairs)
+        # 对所选全部模型计算的指标；None 表示全部
+        self.bare: Optional[Set[str]] = None
+        # 仅对单个模型计算的 (model, metric)
+        self.pairs: Set[Tuple[str, str]] = set()
+        # 本次选择的 ppl/<压缩器> 指标 (按请求顺序输出在注册指标之后)，及含其中间量的注册表
+        self.codec_metrics: Dict[str, Metric] = {}
+        self.intermediates: Dict[str, Intermediate] = INTERMEDIATES
+        if metrics:
+            self.bare = set()
+            for name in metrics:
+                model, metric = _split_metric_name(name)
+                if metric != REF_METRIC and metric not in METRICS and metric not in self.codec_metrics:
+                    spec, length = codec_metric(metric[len("ppl/"):])
+                    self.codec_metrics[metric] = spec
+                    self.intermediates = {**self.intermediates, length.name: length}
+                if model is None:
+                    self.bare.add(metric)
+                else:
+                    self.pairs.add((model, metric))
+
+        self.models: Optional[List[str]] = list(dict.fromkeys(models)) if models else None
+        pair_models = [m for m, _ in sorted(self.pairs) if self.models is None or m not in self.models]
+        if self.models is not None:
+            self.models.extend(dict.fromkeys(pair_models))
+        elif self.bare is not None and not any(self._is_model_metric(name) for name in self.bare):
+            # 裸指标均与模型无关 (如 zlib_entropy) 时，只需带前缀指标涉及的模型
+            self.models = list(dict.fromkeys(pair_models))
+        if known is not None:
+            unknown = [m for m in list(self.models or []) + [m for m, _ in self.pairs] if m not in known]
+            if unknown:
+                raise ValueError(f"未知模型: {unknown}；可选: {sorted(known)}")
+
+    @property
+    def is_default(self) -> bool:
+        return self.bare is None and self.models is None and self.ref_pairs == list(REF_PAIRS)
+
+    def metric(self, name: str) -> Metric:
+        """指标名 (REF_METRIC 除外) 对应的 Metric：注册指标或本次选择的 ppl/<压缩器>。"""
+        return self.codec_metrics.get(name) or METRICS[name]
+
+    def _is_model_metric(self, name: str) -> bool:
+        return name == REF_METRIC or self.metric(name).per_model
+
+    def _metric_needs(self, name: str) -> Tuple[str, ...]:
+        return _REF_NEEDS if name == REF_METRIC else self.metric(name).needs
+
+    def metric_names(self) -> List[str]:
+        """需要求值的指标名 (不含模型前缀)，按注册顺序，ppl/<压缩器> 指标按请求顺序排在最后。"""
+        if self.bare is None:
+            return _all_metric_names()
+        wanted = self.bare | {metric for _, metric in self.pairs}
+        return [name for name in _all_metric_names() if name in wanted] + list(self.codec_metrics)
+
+    def keep(self, model: Optional[str], metric: str) -> bool:
+        """输出列 <model>_<metric> (model 为 None 时为与模型无关的指标) 是否被选中。"""
+        if model is not None and self.models is not None and model not in self.models:
+            return False
+        if self.bare is None or metric in self.bare:
+            return True
+        return (model, metric) in self.pairs
+
+    def keep_name(self, name: str) -> bool:
+        try:
+            model, metric = _split_metric_name(name)
+        except ValueError:
+            return False
+        return self.keep(model, metric)
+
+    def fetch_models(self, available: Iterable[str]) -> List[str]:
+        """需要读取数据的模型：所选模型，加上被选 Ref 指标的参考模型。"""
+        available = list(available)
+        models = [m for m in available if self.models is None or m in self.models]
+        if REF_METRIC in self.metric_names():
+            refs = {small for big, small in self.ref_pairs if big in models and self.keep(big, REF_METRIC)}
+            models += [m for m in available if m in refs and m not in models]
+        if not models and available:
+            # 只选了与模型无关的指标：仍需一个模型的 origin 文件提供 text
+            models = available[:1]
+        return models
+
+    def variant_suffixes(self) -> List[str]:
+        """所选指标需要读取的 variant 后缀 ("" 即 origin、"_nb"、"_rec_new")。"""
+        seen: Set[str] = set()
+        stack = [dep for name in self.metric_names() for dep in self._metric_needs(name)]
+        while stack:
+            dep = stack.pop()
+            if dep in seen or dep not in self.intermediates:
+                continue
+            seen.add(dep)
+            stack.extend(self.intermediates[dep].needs)
+        return [suffix for suffix in VARIANT_SUFFIXES
+                if suffix == "" or any(_VARIANT_SUFFIX.get(dep) == suffix for dep in seen)]
+
+    def variants(self, available_models: Iterable[str]) -> List[str]:
+        """需要读取的全部 variant 名 (如 starcoder2_7b、starcoder2_7b_nb)。"""
+        suffixes = self.variant_suffixes()
+        return [f"{m}{suffix}" for m in self.fetch_models(available_models) for suffix in suffixes]
+
+
+# -----------------------------------------------------------------------------
+# 打分
+
+
+def score_matrix(samples: Sequence[Dict[str, Any]], metrics: Optional[Iterable[str]] = None,
+                 models: Optional[Iterable[str]] = None, *,
+                 selection: Optional[MetricSelection] = None) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """对全部样本批量打分。
+
+    metrics / models 的含义见 MetricSelection，均为空时计算全部模型的全部已注册指标；
+    也可直接传入已解析的 selection。
+    只对被选中的 (模型, 指标) 求值；未选模型的数据即使在样本中也不会被读取。
+    返回 (指标名列表, 分数矩阵, 有效掩码)，后两者形状均为 (样本数, 指标数)。
+    某样本缺少某模型时，该模型的各指标 (及涉及它的 Ref) 在掩码中为 False。
+    """
+    if selection is None:
+        selection = MetricSelection(metrics, models)
+    selected = selection.metric_names()
+    n = len(samples)
+    per_sample_models = [_model_keys(s) for s in samples]
+    sample_models = sorted(set().union(*per_sample_models)) if samples else []
+    compute_models = sorted(selection.fetch_models(sample_models))
+    present = {m: np.zeros(n, dtype=bool) for m in compute_models}
+    for i, ms in enumerate(per_sample_models):
+        for m in ms:
+            if m in present:
+                present[m][i] = True
+
+    root = _Context({"samples": samples}, intermediates=selection.intermediates)
+    names: List[str] = []
+    columns: List[np.ndarray] = []
+    masks: List[np.ndarray] = []
+    for name in selected:
+        if name != REF_METRIC and not selection.metric(name).per_model and selection.keep(None, name):
+            names.append(name)
+            columns.append(root.evaluate(selection.metric(name)))
+            masks.append(np.ones(n, dtype=bool))
+
+    model_selected = [selection.metric(name) for name in selected
+                      if name != REF_METRIC and selection.metric(name).per_model]
+    contexts = {m: _Context({"model": m}, parent=root) for m in compute_models}
+    for m in compute_models:
+        for metric in model_selected:
+            if selection.keep(m, metric.name):
+                names.append(f"{m}_{metric.name}")
+                columns.append(contexts[m].evaluate(metric))
+                masks.append(present[m])
+
+    if REF_METRIC in selected:
+        pairs = [(big, small) for big, small in selection.ref_pairs
+                 if big in contexts and small in contexts and selection.keep(big, REF_METRIC)]
+        if pairs:
+            # (样本 × 模型) 的 loss 矩阵上一次广播相减，得到全部 Ref 列
+            involved = sorted({m for pair in pairs for m in pair})
+            col = {m: j for j, m in enumerate(involved)}
+            loss = np.column_stack([contexts[m]["loss"] for m in involved])
+            has = np.column_stack([present[m] for m in involved])
+            target = np.asarray([col[big] for big, _ in pairs])
+            reference = np.asarray([col[small] for _, small in pairs])
+            with np.errstate(invalid="ignore"):
+                ref = loss[:, target] - loss[:, reference]
+            ref_mask = has[:, target] & has[:, reference]
+            names.extend(ref_metric_name(big, small) for big, small in pairs)
+            columns.extend(ref.T)
+            masks.extend(ref_mask.T)
+
+    if not columns:
+        return names, np.zeros((n, 0)), np.zeros((n, 0), dtype=bool)
+    return names, np.column_stack(columns), np.column_stack(masks)
+
+
+def score_samples(samples: Sequence[Dict[str, Any]], metrics: Optional[Iterable[str]] = None,
+                  models: Optional[Iterable[str]] = None, *,
+                  selection: Optional[MetricSelection] = None) -> List[Dict[str, float]]:
+    """批量打分并还原为逐样本的 pred 字典 (默认键与顺序同 calc.calculate_all_scores)。"""
+    if not samples:
+        return []
+    names, scores, mask = score_matrix(samples, metrics, models, selection=selection)
+    preds: List[Dict[str, float]] = []
+    for sample, row, row_mask in zip(samples, scores.tolist(), mask.tolist()):
+        if not _model_keys(sample):
+            logger.error("样本中未找到任何 *_logprobs 字段！")
+            preds.append({})
+            continue
+        preds.append({name: val for name, val, ok in zip(names, row, row_mask) if ok})
+    return preds
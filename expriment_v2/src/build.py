@@ -0,0 +1,228 @@
+"""基于内容哈希的增量构建图 (build graph)。
+
+过去的缓存策略是 "输出文件存在即跳过" (attempt_maker / result_maker 的 --skip_existing，
+source/mutation/mutation.py 的 all_exist 检查)：输入变化后不会重算，输出缺一个文件又会整体重跑。
+本模块把流水线描述为节点 DAG，每个节点的键为
+
+    sha256(输入文件/目录的内容哈希 + 参数 + 实现代码文件的内容哈希)
+
+键与上次成功构建时一致、且输出仍与当时记录的内容哈希一致时跳过该节点；否则执行并记录。
+上游重跑但产出内容不变时，下游的键不变，因此也不会重跑。
+
+节点状态按节点名分别保存在 <state_dir>/<节点名>.json，多个进程并行构建不同节点互不干扰；
+文件内容哈希按 (路径, mtime, size) 缓存在 <state_dir>/_digests.json，大文件只需哈希一次。
+"""
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_CACHE = "_digests.json"
+_MISSING = "missing"
+_CHUNK = 1 << 20
+
+
+@dataclass
+class Node:
+    """构建图中的一个节点。
+
+    action 返回 False 或抛出异常视为失败；inputs / outputs 可以是文件或目录 (目录按其下全部文件计算)。
+    deps 为必须先构建的上游节点名；上游产物通常也列在 inputs 中，以便内容变化时传导。
+    """
+    name: str
+    action: Callable[[], Any]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    params: Dict[str, Any] = field(default_factory=dict)
+    code: List[str] = field(default_factory=list)
+    deps: List[str] = field(default_factory=list)
+
+
+class BuildGraph:
+    """节点注册、拓扑排序与增量执行。"""
+
+    def __init__(self, state_dir: str):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.nodes: Dict[str, Node] = {}
+        # 绝对路径 -> [mtime_ns, size, sha256]
+        self._digests: Dict[str, List[Any]] = self._load_digest_cache()
+        self._digests_dirty = False
+
+    # ------------------------- 内容哈希 -------------------------
+
+    def _load_digest_cache(self) -> Dict[str, List[Any]]:
+        path = self.state_dir / _DIGEST_CACHE
+        try:
+            with open(path, "r", encoding="utf-8") as fin:
+                return json.load(fin)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def save_digest_cache(self):
+        """写回文件哈希缓存 (run 结束时自动调用；单独使用 path_digest 时由调用方调用)。"""
+        if not self._digests_dirty:
+            return
+        # 与其他进程写入的条目合并后原子替换
+        merged = self._load_digest_cache()
+        merged.update(self._digests)
+        tmp_path = self.state_dir / f"{_DIGEST_CACHE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            json.dump(merged, fout)
+        os.replace(tmp_path, self.state_dir / _DIGEST_CACHE)
+        self._digests_dirty = False
+
+    def file_digest(self, path: str) -> str:
+        """单个文件的 sha256；(mtime, size) 未变时直接使用缓存。不存在时返回 "missing"。"""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return _MISSING
+        cached = self._digests.get(path)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as fin:
+            for chunk in iter(lambda: fin.read(_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._digests[path] = [st.st_mtime_ns, st.st_size, digest]
+        self._digests_dirty = True
+        return digest
+
+    def path_digest(self, path: str) -> str:
+        """文件或目录的内容哈希；目录按 (相对路径, 文件哈希) 的有序列表计算。"""
+        if not os.path.isdir(path):
+            return self.file_digest(path)
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                fpath = os.path.join(root, fname)
+                h.update(os.path.relpath(fpath, path).encode("utf-8"))
+                h.update(self.file_digest(fpath).encode("ascii"))
+        return h.hexdigest()
+
+    def node_key(self, node: Node) -> str:
+        payload = {
+            "inputs": {p: self.path_digest(p) for p in node.inputs},
+            "params": node.params,
+            "code": {p: self.file_digest(p) for p in node.code},
+        }
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    # ------------------------- 节点状态 -------------------------
+
+    def _state_path(self, name: str) -> Path:
+        safe = "".join(c if c.isalnum() or c in "-_.=" else "_" for c in name)
+        return self.state_dir / f"{safe}.json"
+
+    def _load_state(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._state_path(name), "r", encoding="utf-8") as fin:
+                return json.load(fin)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _save_state(self, name: str, state: Dict[str, Any]):
+        path = self._state_path(name)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            json.dump(state, fout, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def stale_reason(self, node: Node, key: str) -> Optional[str]:
+        """返回需要重新构建的原因；节点仍是最新时返回 None。"""
+        state = self._load_state(node.name)
+        if state is None:
+            return "无构建记录"
+        if state.get("key") != key:
+            return "输入 / 参数 / 代码已变化"
+        recorded = state.get("outputs", {})
+        for out in node.outputs:
+            if self.path_digest(out) != recorded.get(out):
+                return f"输出缺失或被修改: {out}"
+        return None
+
+    # ------------------------- 执行 -------------------------
+
+    def add(self, node: Node) -> Node:
+        if node.name in self.nodes:
+            raise ValueError(f"重复的节点名: {node.name}")
+        self.nodes[node.name] = node
+        return node
+
+    def order(self, targets: Optional[Iterable[str]] = None) -> List[Node]:
+        """targets (默认全部节点) 及其上游的拓扑序；存在环或未知依赖时抛 ValueError。"""
+        ordered: List[Node] = []
+        marks: Dict[str, int] = {}  # 1 = 访问中, 2 = 已完成
+
+        def visit(name: str):
+            if marks.get(name) == 2:
+                return
+            if marks.get(name) == 1:
+                raise ValueError(f"构建图存在环: {name}")
+            if name not in self.nodes:
+                raise ValueError(f"未知节点: {name}")
+            marks[name] = 1
+            for dep in self.nodes[name].deps:
+                visit(dep)
+            marks[name] = 2
+            ordered.append(self.nodes[name])
+
+        for name in (targets if targets is not None else list(self.nodes)):
+            visit(name)
+        return ordered
+
+    def run(self, targets: Optional[Iterable[str]] = None, force: bool = False,
+            adopt_existing: bool = False) -> Dict[str, str]:
+        """按拓扑序构建，返回 {节点名: "built" | "skipped" | "failed" | "blocked"}。
+
+        某节点失败后，依赖它的节点记为 blocked 不再执行，其余节点照常构建。
+        adopt_existing=True 时，没有构建记录但输出已全部存在的节点直接记录为最新 (从旧的
+        "存在即跳过" 迁移时避免重跑代价高昂的节点)。
+        """
+        status: Dict[str, str] = {}
+        try:
+            for node in self.order(targets):
+                if any(status.get(dep) in ("failed", "blocked") for dep in node.deps):
+                    status[node.name] = "blocked"
+                    continue
+                key = self.node_key(node)
+                reason = "强制重建" if force else self.stale_reason(node, key)
+                if (adopt_existing and not force and self._load_state(node.name) is None
+                        and node.outputs and all(os.path.exists(out) for out in node.outputs)):
+                    logger.info(f"[build] 采纳已有输出 {node.name}")
+                    reason = None
+                    self._save_state(node.name, {
+                        "key": key,
+                        "outputs": {out: self.path_digest(out) for out in node.outputs},
+                    })
+                if reason is None:
+                    logger.info(f"[build] 跳过 {node.name} (已是最新)")
+                    status[node.name] = "skipped"
+                    continue
+                logger.info(f"[build] 构建 {node.name}：{reason}")
+                try:
+                    ok = node.action() is not False
+                except Exception as e:
+                    logger.error(f"[build] {node.name} 失败: {e}")
+                    ok = False
+                if not ok:
+                    status[node.name] = "failed"
+                    continue
+                self._save_state(node.name, {
+                    "key": key,
+                    "outputs": {out: self.path_digest(out) for out in node.outputs},
+                })
+                status[node.name] = "built"
+        finally:
+            self.save_digest_cache()
+        return status
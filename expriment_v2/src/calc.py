@@ -12,21 +12,79 @@ if not logger.hasHandlers():
     logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
-def calculate_ppl(all_log_probs: list[float]) -> tuple[float, float | None]:
+MINK_RATIOS = [0.05, 0.1, 0.2, 0.3, 0.4]
+
+# 默认 Ref 对 (目标模型, 参考模型)：<目标>_Ref = loss(目标) - loss(参考)
+REF_PAIRS = [
+    ("starcoder2_7b", "starcoder2_3b"),
+    ("deepseekcoder_6.7b", "deepseekcoder_1.3b"),
+    ("codellama_13b", "codellama_7b"),
+    ("deepseekcoder_33b", "deepseekcoder_6.7b"),
+]
+
+
+def ref_metric_name(target: str, reference: str) -> str:
+    """默认 Ref 对沿用 <目标>_Ref；其余 (目标, 参考) 组合命名为 <目标>_Ref_<参考>。"""
+    if (target, reference) in REF_PAIRS:
+        return f"{target}_Ref"
+    return f"{target}_Ref_{reference}"
+
+
+class LogprobStats:
+    """单条 logprob 序列的共享中间量：长度、均值、标准差，以及升序排列后减去均值的前缀和。
+
+    仅对最小的 max_k 个值做 np.partition + 排序，此后任意不超过 max_k 的 Min-K / Min-K++
+    比例都只需一次前缀和查表。PPL、loss、Min-K、Min-K++ 共用同一个实例，不再各自求均值 / 排序。
+    """
+
+    def __init__(self, lp_list: list[float] | np.ndarray, max_ratio: float = max(MINK_RATIOS)):
+        arr = np.asarray(lp_list, dtype=np.float64).ravel()
+        self.n = len(arr)
+        if self.n == 0:
+            self.mean = float('nan')
+            self.std = float('nan')
+            self.csum = np.zeros(1)
+            return
+        self._arr = arr
+        self.mean = float(np.mean(arr))
+        self.std = float(np.std(arr))
+        self._prefix(min(max(int(self.n * max_ratio), 1), self.n))
+
+    def _prefix(self, max_k: int):
+        arr = self._arr
+        if max_k < self.n:
+            smallest = np.sort(np.partition(arr, max_k - 1)[:max_k])
+        else:
+            smallest = np.sort(arr)
+        # 中心化后再累加，Min-K++ 的 (均值 - μ) 不会因相减而损失精度
+        self.csum = np.concatenate(([0.0], np.cumsum(smallest - self.mean)))
+
+    def smallest_centered_mean(self, k: int) -> float:
+        """最小 k 个值减去均值后的均值 (1 <= k <= n)；k 超出已排序部分时补做一次全量排序。"""
+        if k >= len(self.csum):
+            self._prefix(self.n)
+        return float(self.csum[k]) / k
+
+    def smallest_mean(self, k: int) -> float:
+        """最小 k 个值的均值 (1 <= k <= n)。"""
+        return self.mean + self.smallest_centered_mean(k)
+
+
+def calculate_ppl(all_log_probs: list[float] | np.ndarray) -> tuple[float, float | None]:
     """
     根据对数概率列表计算困惑度 (PPL)。
 
     Args:
-        all_log_probs (list[float]): 对数概率列表。
+        all_log_probs (list[float] | np.ndarray): 对数概率列表 (或 store 的 mmap 视图)。
 
     Returns:
         tuple[float, float | None]: (PPL 值, 平均对数概率)。
                                      如果无法计算，PPL 为 NaN，平均对数概率为 None 或 NaN。
     """
-    if not all_log_probs:
+    if len(all_log_probs) == 0:
         return float('nan'), None
     try:
-        avg_log_prob = np.mean(all_log_probs)
+        avg_log_prob = np.mean(all_log_probs, dtype=np.float64)
         if avg_log_prob is not None and not np.isnan(avg_log_prob):
             ppl = np.exp(-avg_log_prob).item()
             return ppl, avg_log_prob
@@ -49,9 +107,10 @@ def calculate_zlib_entropy(text: str) -> int:
     return 0
 
 
-def calculate_ppl_zlib(text: str, avg_log_prob: float | None, ppl_val: float) -> float:
-    """计算 PPL/zlib。"""
-    zlib_entropy = calculate_zlib_entropy(text)
+def calculate_ppl_zlib(text: str, avg_log_prob: float | None, ppl_val: float, zlib_entropy: int | None = None) -> float:
+    """计算 PPL/zlib。zlib_entropy 已知时 (如来自特征表) 不再重复压缩 text。"""
+    if zlib_entropy is None:
+        zlib_entropy = calculate_zlib_entropy(text)
     if zlib_entropy == 0:
         return float('nan')
 
@@ -68,26 +127,27 @@ def calculate_ppl_zlib(text: str, avg_log_prob: float | None, ppl_val: float) ->
     return ppl_zlib_score
 
 
-def calculate_mink_scores(all_prob: list[float]) -> dict:
-    """计算 Min-k Prob 分数。"""
+def calculate_mink_scores(all_prob: list[float] | np.ndarray, ratios: list[float] | None = None,
+                          stats: LogprobStats | None = None) -> dict:
+    """计算 Min-k Prob 分数。stats 可由调用方传入以复用同一次排序。"""
     mink_scores = {}
-    ratios = [0.05, 0.1, 0.2, 0.3, 0.4]
+    if ratios is None:
+        ratios = MINK_RATIOS
 
-    if not all_prob:
+    if len(all_prob) == 0:
         for ratio in ratios:
             mink_scores[f"Min_{int(ratio*100)}%"] = float('nan')
         return mink_scores
 
     try:
+        if stats is None:
+            stats = LogprobStats(all_prob, max(ratios))
         for ratio in ratios:
-            k_length = int(len(all_prob) * ratio)
-            sorted_probs = np.sort(all_prob)
-            topk_prob = sorted_probs[:k_length]
-
+            k_length = int(stats.n * ratio)
             if k_length == 0:
                 mink_scores[f"Min_{int(ratio*100)}%"] = float('nan')
             else:
-                mink_scores[f"Min_{int(ratio*100)}%"] = -np.mean(topk_prob).item()
+                mink_scores[f"Min_{int(ratio*100)}%"] = -stats.smallest_mean(k_length)
 
         reverse_ratios = sorted(ratios, reverse=True)
         for i in range(len(reverse_ratios)):
@@ -106,17 +166,18 @@ def calculate_mink_scores(all_prob: list[float]) -> dict:
     return mink_scores
 
 
-def _get_loss_from_logprobs(lp_list: list[float]) -> float:
+def _get_loss_from_logprobs(lp_list: list[float] | np.ndarray) -> float:
     """给定 logprob 序列，返回 Loss=-avg_logprob。若 lp_list 为空返回 NaN。"""
-    if not lp_list:
+    if len(lp_list) == 0:
         return float('nan')
     try:
-        return -float(np.mean(lp_list))
+        return -float(np.mean(lp_list, dtype=np.float64))
     except Exception:
         return float('nan')
 
 
-def _calculate_min_k_plus_scores(lp_list: list[float], ratios: list[float] | None = None) -> dict:
+def _calculate_min_k_plus_scores(lp_list: list[float] | np.ndarray, ratios: list[float] | None = None,
+                                 stats: LogprobStats | None = None) -> dict:
     """实现规范中的 Min_K%++ 指标。
 
     步骤：
@@ -125,32 +186,25 @@ def _calculate_min_k_plus_scores(lp_list: list[float], ratios: list[float] | Non
            其中 μ 是 logprob 的均值，σ 是标准差
         2. 取最小的 K% s_i，平均后取负数。
 
+    标准化不改变顺序，因此 mean(s[:k]) = (mean(lp[:k]) - μ) / σ，直接由 stats 的前缀和得到。
     返回字典键名形如 'Min_{ratio*100}%++'。
     """
     result: dict = {}
     if ratios is None:
-        ratios = [0.05, 0.1, 0.2, 0.3, 0.4]
+        ratios = MINK_RATIOS
 
-    if not lp_list:
+    if len(lp_list) == 0:
         for r in ratios:
             result[f"Min_{int(r*100)}%++"] = float('nan')
         return result
 
     try:
-        lp_arr = np.array(lp_list, dtype=float)
-        # 计算均值和标准差
-        mu = np.mean(lp_arr)
-        sigma = np.std(lp_arr) + 1e-6  # 添加小常数避免除以零
-        
-        # 执行 z-score 标准化
-        norm_scores = (lp_arr - mu) / sigma
-
-        sorted_norm = np.sort(norm_scores)  # 从小到大
-        n = len(sorted_norm)
+        if stats is None:
+            stats = LogprobStats(lp_list, max(ratios))
+        sigma = stats.std + 1e-6  # 添加小常数避免除以零
         for r in ratios:
-            k = max(int(n * r), 1)  # 至少取 1
-            avg_val = float(np.mean(sorted_norm[:k]))
-            result[f"Min_{int(r*100)}%++"] = -avg_val
+            k = max(int(stats.n * r), 1)  # 至少取 1
+            result[f"Min_{int(r*100)}%++"] = -stats.smallest_centered_mean(k) / sigma
     except Exception as e:
         logger.error(f"计算 Min_K%++ 时发生异常: {e}")
         traceback.print_exc()
@@ -159,7 +213,7 @@ def _calculate_min_k_plus_scores(lp_list: list[float], ratios: list[float] | Non
     return result
 
 
-def calculate_all_scores(sample: dict) -> dict:
+def calculate_all_scores(sample: dict, ref_pairs: list[tuple[str, str]] | None = None) -> dict:
     """根据样本字典计算分数 (多模型版本)。
 
     约定 sample 中包含字段：
@@ -168,8 +222,10 @@ def calculate_all_scores(sample: dict) -> dict:
         <model>_nb_logprobs,
         <model>_rec_new_Loss
     其中 <model> 取自 run.BaseSetAccessor._MODEL_DIRS 的键。
+    若样本来自特征表 (src/features.py)，可用 zlib_entropy / <model>_nb_loss 代替 text / <model>_nb_logprobs。
     为每个模型分别计算以下指标并在键前加上模型前缀：
         ppl, ppl/zlib, Min_k, Min_k++, Ref, Neighbor, ReCall_new
+    Ref 按 ref_pairs (默认 REF_PAIRS) 中的 (目标, 参考) 对计算。
     """
     text: str = sample.get("text", "") or ""
     # --------------------------- 解析模型列表 ---------------------------
@@ -184,7 +240,10 @@ def calculate_all_scores(sample: dict) -> dict:
         return {}
 
     scores: dict = {}
-    zlib_entropy_val = calculate_zlib_entropy(text)
+    if "zlib_entropy" in sample:
+        zlib_entropy_val = sample["zlib_entropy"]
+    else:
+        zlib_entropy_val = calculate_zlib_entropy(text)
     scores["zlib_entropy"] = zlib_entropy_val  # 可选：与模型无关
 
     # 记录每个模型的 loss 以便稍后计算 Ref
@@ -200,27 +259,36 @@ def calculate_all_scores(sample: dict) -> dict:
         except Exception:
             rec_new_loss_val = float('nan')
 
+        # 均值 / 标准差 / 排序只计算一次，供 ppl、loss、Min-K、Min-K++ 共用
+        stats = LogprobStats(lp)
+
         # ppl & avg_lp
-        ppl_val, avg_lp_val = calculate_ppl(lp)
+        if stats.n == 0:
+            ppl_val, avg_lp_val = float('nan'), None
+        else:
+            avg_lp_val = stats.mean
+            ppl_val = float(np.exp(-avg_lp_val)) if not np.isnan(avg_lp_val) else float('nan')
         scores[f"{m}_ppl"] = ppl_val
 
         # ppl/zlib
         if zlib_entropy_val == 0:
             scores[f"{m}_ppl/zlib"] = float('nan')
         else:
-            scores[f"{m}_ppl/zlib"] = calculate_ppl_zlib(text, avg_lp_val, ppl_val)
+            scores[f"{m}_ppl/zlib"] = calculate_ppl_zlib(text, avg_lp_val, ppl_val, zlib_entropy_val)
 
         # Min-K 及 Min-K++
-        mink_scores = calculate_mink_scores(lp)
+        mink_scores = calculate_mink_scores(lp, stats=stats)
         scores.update({f"{m}_{k}": v for k, v in mink_scores.items()})
 
-        minkpp_scores = _calculate_min_k_plus_scores(lp)
+        minkpp_scores = _calculate_min_k_plus_scores(lp, stats=stats)
         scores.update({f"{m}_{k}": v for k, v in minkpp_scores.items()})
 
         # Neighbor
-        _, nb_avg_lp = calculate_ppl(nb_lp)
-        loss_orig = _get_loss_from_logprobs(lp)
-        loss_nb = _get_loss_from_logprobs(nb_lp)
+        loss_orig = -stats.mean if stats.n else float('nan')
+        if f"{m}_nb_loss" in sample:
+            loss_nb = float(sample[f"{m}_nb_loss"])
+        else:
+            loss_nb = _get_loss_from_logprobs(nb_lp)
         scores[f"{m}_Neighbor"] = (
             loss_orig - loss_nb
             if not np.isnan(loss_orig) and not np.isnan(loss_nb) else float('nan')
@@ -241,38 +309,14 @@ def calculate_all_scores(sample: dict) -> dict:
         scores[f"{m}_nb_loss"] = loss_nb
         scores[f"{m}_rec_new_Loss"] = rec_new_loss_val
     # --------------------------- Ref 指标 ---------------------------
-    # 仅计算 starcoder2 与 deepseekcoder 两个 family 的 Ref
-    if "starcoder2_7b" in model_loss_map and "starcoder2_3b" in model_loss_map:
-        big_loss = model_loss_map["starcoder2_7b"]
-        small_loss = model_loss_map["starcoder2_3b"]
-        scores["starcoder2_7b_Ref"] = (
-            big_loss - small_loss
-            if not np.isnan(big_loss) and not np.isnan(small_loss) else float('nan')
-        )
-
-    if "deepseekcoder_6.7b" in model_loss_map and "deepseekcoder_1.3b" in model_loss_map:
-        big_loss = model_loss_map["deepseekcoder_6.7b"]
-        small_loss = model_loss_map["deepseekcoder_1.3b"]
-        scores["deepseekcoder_6.7b_Ref"] = (
-            big_loss - small_loss
-            if not np.isnan(big_loss) and not np.isnan(small_loss) else float('nan')
-        )
-
-    if "codellama_13b" in model_loss_map and "codellama_7b" in model_loss_map:
-        big_loss = model_loss_map["codellama_13b"]
-        small_loss = model_loss_map["codellama_7b"]
-        scores["codellama_13b_Ref"] = (
-            big_loss - small_loss
-            if not np.isnan(big_loss) and not np.isnan(small_loss) else float('nan')
-        )
-
-    if "deepseekcoder_33b" in model_loss_map and "deepseekcoder_6.7b" in model_loss_map:
-        big_loss = model_loss_map["deepseekcoder_33b"]
-        small_loss = model_loss_map["deepseekcoder_6.7b"]
-        scores["deepseekcoder_33b_Ref"] = (
-            big_loss - small_loss
-            if not np.isnan(big_loss) and not np.isnan(small_loss) else float('nan')
-        )
+    for big, small in (REF_PAIRS if ref_pairs is None else ref_pairs):
+        if big in model_loss_map and small in model_loss_map:
+            big_loss = model_loss_map[big]
+            small_loss = model_loss_map[small]
+            scores[ref_metric_name(big, small)] = (
+                big_loss - small_loss
+                if not np.isnan(big_loss) and not np.isnan(small_loss) else float('nan')
+            )
     return scores
 
 
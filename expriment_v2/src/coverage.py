@@ -0,0 +1,236 @@
+"""source 语料的覆盖矩阵 (coverage index)。
+
+回答 "某个 (tag, feature) 下哪些 index 在 8 个模型 × {analysis, analysis_nb,
+analysis_rec_new} 的全部文件中都存在" 过去需要列目录并完整扫描每个文件。
+本模块一次性扫描 source，持久化一个 index × 文件 的布尔矩阵，外加每个文件中
+input 字段的字符长度，供 exp_maker 与 run.BaseSetAccessor 以毫秒级查询：
+
+    <path>.npz
+        indices   int64 (n,)           全部出现过的 index (升序)
+        bits      uint8 (n, ceil(f/8)) np.packbits 压缩的覆盖矩阵，列为文件
+        lengths   int32 (n, f)         len(input)，文件中缺该 index 时为 -1
+        order     int32 (n, f)         每列按 (input 长度, index) 升序的行号
+        meta      str                  JSON：文件相对路径列表及其 mtime/size
+
+文件的 mtime/size 变化或出现新文件时，仅重新扫描对应的列；order 在构建时整体排序一次并随矩阵保存。
+
+长度区间查询 (exp_maker 的 --lb/--rb) 直接使用 order：按必需列过滤一次 (保持有序) 即得
+排好序的 (长度, index) 数组，之后任意 [lb, rb] 只需两次二分查找；length_buckets 一次回答
+一批区间 (exp_maker 的批量模式)。
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .jsonl_io import iter_jsonl
+from .store import STORE_SUFFIX, source_signature
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COVERAGE_NAME = "_coverage.npz"
+
+
+def _scan_column(fpath: Path) -> Dict[int, int]:
+    """扫描单个文件，返回 {index: len(input)}；与 exp_maker 一致，缺失的 input 视为空串。"""
+    col: Dict[int, int] = {}
+    for obj in iter_jsonl(fpath, fields=("index", "input")):
+        if "index" not in obj:
+            continue
+        inp = obj.get("input", "")
+        if not isinstance(inp, str):
+            inp = str(inp)
+        col[int(obj["index"])] = len(inp)
+    return col
+
+
+def _list_files(source_base: Path, dirs_rel: Iterable[str]) -> List[str]:
+    files: List[str] = []
+    for rel in dirs_rel:
+        d = source_base / rel
+        if not d.is_dir():
+            logger.warning(f"目录不存在，跳过: {d}")
+            continue
+        for fname in sorted(os.listdir(d)):
+            if fname.endswith(STORE_SUFFIX):
+                files.append(f"{rel}/{fname}")
+    return files
+
+
+class CoverageIndex:
+    """index × 文件 的覆盖矩阵及 input 长度表。"""
+
+    def __init__(self, source_base: Path, files: List[str], signatures: List[Dict], indices: np.ndarray,
+                 cover: np.ndarray, lengths: np.ndarray, order: Optional[np.ndarray] = None):
+        self.source_base = Path(source_base)
+        self.files = files
+        self.signatures = signatures
+        self.indices = indices
+        self.cover = cover
+        self.lengths = lengths
+        # 缺失项长度为 -1，排在每列最前；indices 升序，稳定排序后长度相同者按 index 升序
+        self.order = (order if order is not None
+                      else np.argsort(lengths, axis=0, kind="stable").astype(np.int32, copy=False))
+        self._col = {rel: i for i, rel in enumerate(files)}
+        self._row = {int(v): i for i, v in enumerate(indices.tolist())}
+        # (col, require_cols) -> (升序长度, 对应 index)
+        self._length_index: Dict[Tuple[int, Tuple[int, ...]], Tuple[np.ndarray, np.ndarray]] = {}
+
+    # ------------------------- 构建与持久化 -------------------------
+
+    @classmethod
+    def _assemble(cls, source_base: Path, files: List[str], signatures: List[Dict],
+                  columns: List[Dict[int, int]]) -> "CoverageIndex":
+        all_idx = sorted(set().union(*columns)) if columns else []
+        indices = np.asarray(all_idx, dtype=np.int64)
+        row = {v: i for i, v in enumerate(all_idx)}
+        lengths = np.full((len(all_idx), len(files)), -1, dtype=np.int32)
+        for j, col in enumerate(columns):
+            if col:
+                rows = np.fromiter((row[k] for k in col.keys()), dtype=np.int64, count=len(col))
+                lengths[rows, j] = np.fromiter(col.values(), dtype=np.int32, count=len(col))
+        return cls(source_base, files, signatures, indices, lengths >= 0, lengths)
+
+    def _column(self, j: int) -> Dict[int, int]:
+        mask = self.cover[:, j]
+        return dict(zip(self.indices[mask].tolist(), self.lengths[mask, j].tolist()))
+
+    @classmethod
+    def load_or_build(cls, path: Path, source_base: Path, dirs_rel: Sequence[str]) -> "CoverageIndex":
+        """读取已有矩阵并只重新扫描过期 / 新增的文件；有更新时写回 path。"""
+        path = Path(path)
+        source_base = Path(source_base)
+        old: Optional[CoverageIndex] = None
+        if path.exists():
+            try:
+                old = cls.load(path, source_base)
+            except Exception as e:
+                logger.warning(f"读取覆盖矩阵失败，将重新生成: {path} ({e})")
+
+        files = _list_files(source_base, dirs_rel)
+        signatures: List[Dict] = []
+        columns: List[Dict[int, int]] = []
+        n_scanned = 0
+        for rel in files:
+            sig = source_signature(source_base / rel)
+            sig = {"mtime": sig["mtime"], "size": sig["size"]}
+            j = old._col.get(rel) if old is not None else None
+            if j is not None and old.signatures[j] == sig:
+                columns.append(old._column(j))
+            else:
+                columns.append(_scan_column(source_base / rel))
+                n_scanned += 1
+            signatures.append(sig)
+
+        index = cls._assemble(source_base, files, signatures, columns)
+        if n_scanned or old is None or old.files != files:
+            index.save(path)
+            logger.info(f"覆盖矩阵已更新: {path} (重新扫描 {n_scanned}/{len(files)} 个文件)")
+        return index
+
+    @classmethod
+    def load(cls, path: Path, source_base: Path) -> "CoverageIndex":
+        with np.load(path) as npz:
+            meta = json.loads(str(npz["meta"]))
+            n_files = len(meta["files"])
+            cover = np.unpackbits(npz["bits"], axis=1, count=n_files).astype(bool)
+            # 旧版文件没有 order，在内存中重新排序
+            order = npz["order"] if "order" in npz.files else None
+            return cls(source_base, meta["files"], meta["signatures"], npz["indices"], cover, npz["lengths"], order)
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            indices=self.indices,
+            bits=np.packbits(self.cover, axis=1),
+            lengths=self.lengths,
+            order=self.order,
+            meta=np.asarray(json.dumps({"files": self.files, "signatures": self.signatures})),
+        )
+        os.replace(tmp_path, path)
+
+    # ------------------------- 查询 -------------------------
+
+    def column(self, rel_path: str) -> int:
+        """文件相对路径 -> 列号；不存在时抛 KeyError。"""
+        return self._col[str(rel_path)]
+
+    def columns_for(self, dirs_rel: Iterable[str], feature: str) -> List[int]:
+        """dirs_rel 各目录中文件名包含 feature 的列 (每个目录应恰有一个)。"""
+        cols: List[int] = []
+        for rel in dirs_rel:
+            matched = [j for j, f in enumerate(self.files) if f.rsplit("/", 1)[0] == rel and feature in f.rsplit("/", 1)[1]]
+            if len(matched) != 1:
+                raise FileNotFoundError(f"目录 {rel} 下与特征 {feature} 对应的文件数目为 {len(matched)}，应当恰为 1")
+            cols.extend(matched)
+        return cols
+
+    def covers(self, rel_path: str) -> bool:
+        """rel_path 是否为矩阵中的一列。"""
+        return str(rel_path) in self._col
+
+    def has(self, rel_path: str, idx: int) -> bool:
+        row = self._row.get(int(idx))
+        j = self._col.get(str(rel_path))
+        return row is not None and j is not None and bool(self.cover[row, j])
+
+    def present_in_all(self, cols: Sequence[int]) -> np.ndarray:
+        """在 cols 全部列中都存在的 index (升序)。"""
+        if not cols:
+            return self.indices.copy()
+        return self.indices[self.cover[:, list(cols)].all(axis=1)]
+
+    def length_index(self, col: int, require_cols: Sequence[int] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        """col 列中存在、且在 require_cols 中全部存在的样本，按 (input 长度, index) 升序排列。
+
+        返回 (lengths, indices) 两个等长数组；由预先排好的 order 过滤得到，不再排序。结果按参数缓存。
+        """
+        key = (int(col), tuple(sorted(int(c) for c in require_cols)))
+        cached = self._length_index.get(key)
+        if cached is None:
+            rows = self.order[:, col]
+            mask = self.cover[rows, col]
+            if require_cols:
+                mask &= self.cover[np.ix_(rows, list(require_cols))].all(axis=1)
+            rows = rows[mask]
+            cached = (self.lengths[rows, col], self.indices[rows])
+            self._length_index[key] = cached
+        return cached
+
+    def length_filter(self, col: int, lb: int, rb: int, require_cols: Sequence[int] = ()) -> np.ndarray:
+        """col 列中 lb <= len(input) <= rb，且在 require_cols 中全部存在的 index (升序)。"""
+        lens, idxs = self.length_index(col, require_cols)
+        lo = np.searchsorted(lens, lb, side="left")
+        hi = np.searchsorted(lens, rb, side="right")
+        return np.sort(idxs[lo:hi])
+
+    def length_buckets(self, col: int, bounds: Sequence[Tuple[int, int]],
+                       require_cols: Sequence[int] = ()) -> List[np.ndarray]:
+        """一次性回答多个 [lb, rb] 区间 (可重叠)，各返回升序 index 数组。"""
+        lens, idxs = self.length_index(col, require_cols)
+        lbs = np.searchsorted(lens, [lb for lb, _ in bounds], side="left")
+        rbs = np.searchsorted(lens, [rb for _, rb in bounds], side="right")
+        return [np.sort(idxs[lo:hi]) for lo, hi in zip(lbs, rbs)]
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from exp_maker import MEMBER_DIRS_REL, NONMEMBER_DIRS_REL, SOURCE_BASE
+
+    parser = argparse.ArgumentParser(description="生成 (或增量刷新) source 的覆盖矩阵")
+    parser.add_argument("--source_base", default=SOURCE_BASE, help="源数据根目录")
+    parser.add_argument("--out", default="", help=f"输出路径，默认 <source_base>/{DEFAULT_COVERAGE_NAME}")
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(args.source_base, DEFAULT_COVERAGE_NAME)
+    cov = CoverageIndex.load_or_build(Path(out), Path(args.source_base), MEMBER_DIRS_REL + NONMEMBER_DIRS_REL)
+    print(f"覆盖矩阵: {len(cov.indices)} 个 index × {len(cov.files)} 个文件 -> {out}")
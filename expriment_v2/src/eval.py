@@ -3,12 +3,15 @@ logging.basicConfig(level='ERROR')
 import numpy as np
 from tqdm import tqdm
 import json
+import os
 from collections import defaultdict
 import matplotlib.pyplot as plt
 from sklearn.metrics import auc, roc_curve
 import matplotlib
 import random
 
+from .jsonl_io import iter_jsonl
+
 
 matplotlib.rcParams['pdf.fonttype'] = 42
 matplotlib.rcParams['ps.fonttype'] = 42
@@ -58,11 +61,21 @@ def fig_fpr_tpr(all_output, output_dir):
             metric2predictions[metric].append(ex["pred"][metric])
     
     # plt.figure(figsize=(4,3))
-    with open(f"{output_dir}/auc.txt", "w") as f:
-        for metric, predictions in metric2predictions.items():
-            # print(metric)
-            legend, auc_val, acc, low = do_plot(predictions, answers, legend=metric, metric='auc', output_dir=output_dir)
-            f.write('%s   AUC %.4f, Accuracy %.4f, TPR@5%%FPR of %.4f\n'%(legend, auc_val, acc, low))
+    # 先写临时文件，全部指标写完后再原子替换：读者 (或并行的其他进程) 不会看到写了一半的 auc.txt；
+    # 出错时删除临时文件并抛出原异常，已有的 auc.txt 保持不变
+    auc_path = os.path.join(output_dir, "auc.txt")
+    tmp_path = f"{auc_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            for metric, predictions in metric2predictions.items():
+                # print(metric)
+                legend, auc_val, acc, low = do_plot(predictions, answers, legend=metric, metric='auc', output_dir=output_dir)
+                f.write('%s   AUC %.4f, Accuracy %.4f, TPR@5%%FPR of %.4f\n'%(legend, auc_val, acc, low))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, auc_path)
 
     # plt.semilogx()
     # plt.semilogy()
@@ -77,8 +90,7 @@ def fig_fpr_tpr(all_output, output_dir):
 
 
 def load_jsonl(input_path):
-    with open(input_path, 'r') as f:
-        data = [json.loads(line) for line in tqdm(f)]
+    data = list(tqdm(iter_jsonl(input_path)))
     random.seed(0)
     random.shuffle(data)
     return data
@@ -91,8 +103,7 @@ def dump_jsonl(data, path):
 
 
 def read_jsonl(path):
-    with open(path, 'r') as f:
-        return [json.loads(line) for line in tqdm(f)]
+    return list(tqdm(iter_jsonl(path)))
 
 
 def convert_huggingface_data_to_list_dic(dataset):
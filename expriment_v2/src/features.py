@@ -0,0 +1,201 @@
+"""逐样本特征表 (feature table)。
+
+calc.calculate_all_scores 对每个 (model, tag, feature, index) 所需的中间量都是确定的：
+排序后的 logprob、邻域 loss、rec_new Loss 以及输入文本的 zlib 长度。
+本模块在 ingest 阶段对 source 计算一次并按 (tag, level) 写入 NumPy .npz：
+
+    <table_dir>/tag<tag>_<level>.npz
+        index                 int64   (n,)
+        zlib_len              int64   (n,)
+        <model>__valid        bool    (n,)    三个 variant 均可取到时为 True
+        <model>__offsets      int64   (n+1,)
+        <model>__sorted       float64 (m,)    升序 logprob 的扁平拼接 (与 JSON 源同精度)
+        <model>__nb_loss      float64 (n,)
+        <model>__rec_new_loss float64 (n,)
+
+均值 / 标准差由打分器从 logprob 计算，不单独存储。
+打分时 build_samples_from_features 只需按 index 做一次 join，不再访问 source。
+特征表样本不含 text，因此不支持 ppl/<压缩器> 指标 (见 reject_text_metrics)。
+"""
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .calc import _get_loss_from_logprobs, calculate_zlib_entropy
+
+logger = logging.getLogger(__name__)
+
+
+def _table_path(table_dir: Path, tag: int, level_code: str) -> Path:
+    return Path(table_dir) / f"tag{int(tag)}_{level_code}.npz"
+
+
+def _to_float(val: Any) -> float:
+    try:
+        return float(val) if val is not None else float("nan")
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+# -----------------------------------------------------------------------------
+# ingest
+
+
+def build_level_table(accessor, tag: int, level_code: str) -> Optional[Dict[str, np.ndarray]]:
+    """计算单个 (tag, level) 的特征表；首个模型的 origin 文件不存在时返回 None。"""
+    from .run import BaseSetAccessor, _get_log_probs
+
+    model_keys = list(BaseSetAccessor._MODEL_DIRS.keys())
+    try:
+        # 与 _build_samples 一致：以首个模型 origin 文件中的 index 为全集
+        first = dict(accessor.iter_file(tag, level_code, model_keys[0]))
+    except FileNotFoundError:
+        return None
+    indices = sorted(first)
+
+    table: Dict[str, np.ndarray] = {"index": np.asarray(indices, dtype=np.int64)}
+    zlib_len = np.zeros(len(indices), dtype=np.int64)
+    for row, idx in enumerate(indices):
+        zlib_len[row] = calculate_zlib_entropy(first[idx].get("input") or "")
+    table["zlib_len"] = zlib_len
+
+    for mkey in model_keys:
+        valid = np.zeros(len(indices), dtype=bool)
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        nb_loss = np.full(len(indices), np.nan)
+        rec_new_loss = np.full(len(indices), np.nan)
+        chunks: List[np.ndarray] = []
+        for row, idx in enumerate(indices):
+            lp = np.zeros(0, dtype=np.float64)
+            try:
+                origin_obj = accessor.fetch(tag, level_code, idx, variant=mkey)
+                nb_obj = accessor.fetch(tag, level_code, idx, variant=f"{mkey}_nb")
+                rec_new_obj = accessor.fetch(tag, level_code, idx, variant=f"{mkey}_rec_new")
+                lp = np.sort(np.asarray(_get_log_probs(origin_obj), dtype=np.float64))
+                valid[row] = True
+                nb_loss[row] = _get_loss_from_logprobs(_get_log_probs(nb_obj))
+                rec_new_loss[row] = _to_float(rec_new_obj.get("Loss", rec_new_obj.get("loss")))
+            except Exception:
+                pass
+            chunks.append(lp)
+            offsets[row + 1] = offsets[row] + len(lp)
+        table[f"{mkey}__valid"] = valid
+        table[f"{mkey}__offsets"] = offsets
+        table[f"{mkey}__sorted"] = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float64)
+        table[f"{mkey}__nb_loss"] = nb_loss
+        table[f"{mkey}__rec_new_loss"] = rec_new_loss
+    return table
+
+
+def build_feature_table(accessor, table_dir: Path) -> Dict[str, int]:
+    """对全部 (tag, level) 生成特征表，返回 {文件名: 行数}。"""
+    table_dir = Path(table_dir)
+    table_dir.mkdir(parents=True, exist_ok=True)
+    stats: Dict[str, int] = {}
+    for tag in (1, 0):
+        for level_code in accessor.level2feature:
+            table = build_level_table(accessor, tag, level_code)
+            if table is None:
+                logger.warning(f"跳过 tag={tag}, level={level_code}：找不到源文件")
+                continue
+            path = _table_path(table_dir, tag, level_code)
+            np.savez(path, **table)
+            stats[path.name] = len(table["index"])
+            logger.info(f"已写入 {path} ({len(table['index'])} 条)")
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# 读取与 join
+
+
+class FeatureTable:
+    """按 (tag, level) 懒加载 .npz 特征表，并按 index 组装 calc 所需的样本字典。"""
+
+    def __init__(self, table_dir: str):
+        self.table_dir = Path(table_dir)
+        if not self.table_dir.exists():
+            raise FileNotFoundError(f"特征表目录不存在: {self.table_dir}")
+        self._tables: Dict[Tuple[int, str], Dict[str, np.ndarray]] = {}
+        self._rows: Dict[Tuple[int, str], Dict[int, int]] = {}
+
+    def _load(self, tag: int, level_code: str):
+        key = (int(tag), str(level_code))
+        if key not in self._tables:
+            with np.load(_table_path(self.table_dir, tag, level_code)) as npz:
+                self._tables[key] = {k: npz[k] for k in npz.files}
+            self._rows[key] = {int(v): i for i, v in enumerate(self._tables[key]["index"].tolist())}
+        return self._tables[key], self._rows[key]
+
+    def preload(self, keys: Iterable[Tuple[int, str]]):
+        """预先加载给定 (tag, level) 的特征表 (如在 fork 工作进程之前，使其以写时复制方式共享)。"""
+        for tag, level_code in keys:
+            if _table_path(self.table_dir, tag, level_code).exists():
+                self._load(tag, level_code)
+
+    def model_keys(self, tag: int, level_code: str) -> List[str]:
+        table, _ = self._load(tag, level_code)
+        return sorted(k[: -len("__valid")] for k in table if k.endswith("__valid"))
+
+    def sample(self, tag: int, level_code: str, idx: int, models: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """返回 calc.calculate_all_scores 可直接使用的样本字典；index 不存在时抛 KeyError。
+
+        models 非空时只取这些模型的特征。
+        """
+        table, rows = self._load(tag, level_code)
+        row = rows.get(int(idx))
+        if row is None:
+            raise KeyError(f"特征表 tag={tag}, level={level_code} 中未找到 index={idx}")
+
+        wanted = set(models) if models is not None else None
+        sample: Dict[str, Any] = {"zlib_entropy": int(table["zlib_len"][row])}
+        for mkey in self.model_keys(tag, level_code):
+            if wanted is not None and mkey not in wanted:
+                continue
+            if not table[f"{mkey}__valid"][row]:
+                continue
+            offsets = table[f"{mkey}__offsets"]
+            # 升序 logprob：均值 / 标准差 / Min-K 均与顺序无关
+            sample[f"{mkey}_logprobs"] = table[f"{mkey}__sorted"][offsets[row]:offsets[row + 1]]
+            sample[f"{mkey}_nb_loss"] = float(table[f"{mkey}__nb_loss"][row])
+            sample[f"{mkey}_rec_new_Loss"] = float(table[f"{mkey}__rec_new_loss"][row])
+        return sample
+
+
+def reject_text_metrics(selection) -> None:
+    """特征表样本只有 zlib 长度而不含 text：选择了 ppl/<压缩器> 指标时抛 ValueError，而非静默输出 NaN。"""
+    if selection is not None and selection.codec_metrics:
+        raise ValueError(f"特征表不含原始文本，无法计算 {list(selection.codec_metrics)}；"
+                         f"请去掉这些指标或不使用特征表")
+
+
+def build_samples_from_features(raw_records: List[Dict[str, Any]], table: FeatureTable,
+                                models: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """attempt 记录与特征表按 (tag, level, index) join，得到打分用样本列表 (models 非空时只取这些模型)。"""
+    processed: List[Dict[str, Any]] = []
+    for rec in raw_records:
+        try:
+            sample = table.sample(rec["tag"], rec["level"], rec["index"], models=models)
+            sample["label"] = rec["label"]
+            processed.append(sample)
+        except Exception as e:
+            logger.warning(f"跳过样本 (index={rec.get('index')})，原因: {e}")
+    return processed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .run import BaseSetAccessor, DEFAULT_SOURCE_BASE
+
+    parser = argparse.ArgumentParser(description="对 source 预先计算逐样本特征表 (.npz)")
+    parser.add_argument("--source_base", default=DEFAULT_SOURCE_BASE, help="源数据根目录")
+    parser.add_argument("--store_base", default="", help="可选：从二进制列式存储读取 (见 src/store.py)")
+    parser.add_argument("--out_dir", required=True, help="特征表输出目录")
+    args = parser.parse_args()
+
+    accessor = BaseSetAccessor(source_base=args.source_base, store_base=args.store_base)
+    stats = build_feature_table(accessor, Path(args.out_dir))
+    print(f"特征表生成完成: {len(stats)} 个文件，共 {sum(stats.values())} 条")
@@ -0,0 +1,209 @@
+"""统一的流式 JSONL 读取。
+
+run.py / exp_maker.py / attempt_maker.py / eval.py 过去各自手写
+``for line in f: json.loads(line)`` 并以 ``except: continue`` 静默跳过坏行。
+本模块集中实现：
+
+    • 按块 (默认 1 MiB) 读取二进制数据后切行，减少逐行 I/O 调用；
+    • 优先使用 orjson / simdjson 解析，未安装时回退到标准库 json；
+    • 坏行计数到 ReadStats，并在读取结束时汇总打印一条 warning；
+    • fields=(...) 时按字节扫描只抽取指定的顶层键 (如 index / input)，
+      不再为每行完整解析体积巨大的 tokens 数组。
+"""
+import json
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def _select_backend() -> Tuple[str, Callable[[bytes], Any]]:
+    try:
+        import orjson
+        return "orjson", orjson.loads
+    except ImportError:
+        pass
+    try:
+        import simdjson
+        return "simdjson", simdjson.loads
+    except ImportError:
+        pass
+    return "json", json.loads
+
+
+JSON_BACKEND, loads = _select_backend()
+
+
+@dataclass
+class ReadStats:
+    """单次 (或多次累计) 读取的行数统计。"""
+    lines: int = 0
+    records: int = 0
+    malformed: int = 0
+
+
+def iter_lines(path: Union[str, Path], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """按块读取文件并切分为行，产出 (字节偏移, 行内容)；行内容保留结尾换行符。"""
+    offset = 0
+    carry = b""
+    with open(path, "rb") as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            buf = carry + chunk
+            start = 0
+            while True:
+                end = buf.find(b"\n", start)
+                if end < 0:
+                    break
+                yield offset, buf[start:end + 1]
+                offset += end + 1 - start
+                start = end + 1
+            carry = buf[start:]
+    if carry:
+        yield offset, carry
+
+
+_WS = b" \t\r\n"
+_NUMBER_RE = re.compile(rb"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+_STRING_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_LITERALS = {b"true": True, b"false": False, b"null": None}
+
+
+def _is_top_level(line: bytes, pos: int) -> bool:
+    """以 pos 处引号开头的字符串是否为第一层对象中的键。
+
+    去掉 pos 一侧的全部完整字符串后按括号计数求嵌套深度 (C 层面的 re.sub / bytes.count，
+    不逐字节循环)。整行是一个对象，因此可从较短的一侧计算：前缀中 开括号 - 闭括号，
+    或后缀中 闭括号 - 开括号，等于 1 即为顶层；残留引号说明无法对齐字符串边界，按非顶层处理。
+    """
+    if pos <= len(line) - pos:
+        rest = _STRING_RE.sub(b"", line[:pos])
+        sign = 1
+    else:
+        rest = _STRING_RE.sub(b"", line[pos:])
+        sign = -1
+    if b'"' in rest:
+        return False
+    depth = rest.count(b"{") + rest.count(b"[") - rest.count(b"}") - rest.count(b"]")
+    return sign * depth == 1
+
+
+def _value_start(line: bytes, key: bytes) -> int:
+    """返回顶层键 "key": 之后值的起始下标；找不到返回 -1。
+
+    跳过前面有奇数个反斜杠的匹配 (即出现在字符串内部、被转义的引号)。其余匹配中只看第一处
+    后接冒号的 "key"：它若不是顶层键 (如出现在 tokens 元素等嵌套对象中) 同样返回 -1，
+    由调用方回退为完整解析，不会误取嵌套的值。
+    """
+    needle = b'"' + key + b'"'
+    pos = line.find(needle)
+    while pos >= 0:
+        n_backslash = 0
+        k = pos - 1
+        while k >= 0 and line[k] == 0x5C:
+            n_backslash += 1
+            k -= 1
+        if n_backslash % 2 == 0:
+            j = pos + len(needle)
+            while j < len(line) and line[j] in _WS:
+                j += 1
+            if j < len(line) and line[j] == 0x3A:  # ':'
+                if not _is_top_level(line, pos):
+                    return -1
+                j += 1
+                while j < len(line) and line[j] in _WS:
+                    j += 1
+                return j
+        pos = line.find(needle, pos + 1)
+    return -1
+
+
+def _project(line: bytes, fields: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """按字节扫描抽取 fields 中的标量值；任一字段无法就地解析时返回 None (由调用方完整解析)。"""
+    out: Dict[str, Any] = {}
+    for field in fields:
+        start = _value_start(line, field.encode("utf-8"))
+        if start < 0:
+            return None
+        head = line[start:start + 1]
+        if head == b'"':
+            m = _STRING_RE.match(line, start)
+            if m is None:
+                return None
+            out[field] = loads(m.group(0))
+        elif head == b"-" or head.isdigit():
+            m = _NUMBER_RE.match(line, start)
+            if m is None:
+                return None
+            out[field] = loads(m.group(0))
+        else:
+            for lit, val in _LITERALS.items():
+                if line.startswith(lit, start):
+                    out[field] = val
+                    break
+            else:
+                # 对象 / 数组等复合值不做就地解析
+                return None
+    return out
+
+
+def iter_jsonl(
+    path: Union[str, Path],
+    *,
+    stats: Optional[ReadStats] = None,
+    with_offsets: bool = False,
+    fields: Optional[Sequence[str]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Any]:
+    """逐条产出 path 中的 JSON 记录；空行跳过，坏行计入 stats.malformed。
+
+    with_offsets=True 时产出 (字节偏移, 行长度, 记录)。
+    fields 非空时只返回这些顶层键组成的字典 (缺失的键不出现)：标量值按字节就地抽取，
+    抽取失败 (键缺失、值为对象/数组、首个同名键位于嵌套对象中) 的行才回退为完整解析。
+    投影模式下不校验整行是否为合法 JSON。
+    """
+    own_stats = stats is None
+    if own_stats:
+        stats = ReadStats()
+    malformed_before = stats.malformed
+    for offset, line in iter_lines(path, chunk_size):
+        stats.lines += 1
+        if not line.strip():
+            continue
+        obj = None
+        if fields:
+            try:
+                obj = _project(line, fields)
+            except ValueError:
+                obj = None
+        if obj is None:
+            try:
+                obj = loads(line)
+            except ValueError:
+                stats.malformed += 1
+                continue
+            if fields:
+                if not isinstance(obj, dict):
+                    stats.malformed += 1
+                    continue
+                obj = {k: obj[k] for k in fields if k in obj}
+        stats.records += 1
+        if with_offsets:
+            yield offset, len(line), obj
+        else:
+            yield obj
+    n_bad = stats.malformed - malformed_before
+    if n_bad:
+        logger.warning(f"{path}: 跳过 {n_bad} 行无法解析的 JSON")
+
+
+def read_jsonl(path: Union[str, Path], *, stats: Optional[ReadStats] = None) -> List[Any]:
+    """读取整个 JSONL 文件为列表。"""
+    return list(iter_jsonl(path, stats=stats))
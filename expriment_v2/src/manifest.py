@@ -0,0 +1,183 @@
+"""source 目录的持久化清单 (manifest)。
+
+BaseSetAccessor.fetch 每次都会调用 _resolve_file_path，对 variant 目录执行一次
+os.listdir 并做子串匹配；而 _load_file_to_cache 又要把整个文件解析进内存。
+本模块把这两步的结果写入一个 JSON 清单，供之后的运行直接复用：
+
+    {
+      "version": 1,
+      "source_base": "...",
+      "resolve": {"<variant>|<tag>|<level>": "<相对 source_base 的路径>"},
+      "files": {
+        "<相对路径>": {"mtime": ..., "size": ..., "offsets": {"<index>": [字节偏移, 行长度]}}
+      }
+    }
+
+源文件的 mtime/size 变化时，对应 offsets 会被重新扫描。有了 offsets，
+OffsetFile 只需一次 os.pread 即可读出单条样本，而无需载入整个文件。
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from .jsonl_io import iter_jsonl, loads
+from .store import source_signature
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+DEFAULT_MANIFEST_NAME = "_manifest.json"
+
+
+def scan_offsets(fpath: Path) -> Dict[int, Tuple[int, int]]:
+    """扫描 .jsonl_ 文件，返回 {index: (字节偏移, 行长度)}；无法解析的行跳过。"""
+    offsets: Dict[int, Tuple[int, int]] = {}
+    for pos, length, obj in iter_jsonl(fpath, with_offsets=True, fields=("index",)):
+        try:
+            idx = obj.get("index")
+            if idx is not None:
+                offsets[int(idx)] = (pos, length)
+        except Exception:
+            continue
+    return offsets
+
+
+class SourceManifest:
+    """(variant, tag, level) -> 文件路径，以及文件路径 -> {index: 偏移} 的持久化映射。"""
+
+    def __init__(self, path: Path, source_base: Path):
+        self.path = Path(path)
+        self.source_base = Path(source_base)
+        self._resolve: Dict[str, str] = {}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as fin:
+                    data = json.load(fin)
+                if data.get("version") == MANIFEST_VERSION and data.get("source_base") == str(self.source_base):
+                    self._resolve = data.get("resolve", {})
+                    self._files = data.get("files", {})
+                else:
+                    logger.info(f"manifest 版本或 source_base 不匹配，将重新生成: {self.path}")
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"读取 manifest 失败，将重新生成: {self.path} ({e})")
+
+    # ------------------------- 路径解析 -------------------------
+
+    @staticmethod
+    def _resolve_key(variant: str, tag: int, level_code: str) -> str:
+        return f"{variant}|{int(tag)}|{level_code}"
+
+    def lookup(self, variant: str, tag: int, level_code: str) -> Optional[Path]:
+        """返回已记录的文件路径；未记录或文件已不存在时返回 None。"""
+        rel = self._resolve.get(self._resolve_key(variant, tag, level_code))
+        if rel is None:
+            return None
+        fpath = self.source_base / rel
+        return fpath if fpath.exists() else None
+
+    def record(self, variant: str, tag: int, level_code: str, fpath: Path):
+        rel = str(Path(fpath).relative_to(self.source_base))
+        key = self._resolve_key(variant, tag, level_code)
+        if self._resolve.get(key) != rel:
+            self._resolve[key] = rel
+            self._dirty = True
+
+    # ------------------------- 样本偏移 -------------------------
+
+    def offsets_for(self, fpath: Path) -> Dict[int, Tuple[int, int]]:
+        """返回 fpath 的 {index: (offset, length)}，签名不一致时重新扫描。"""
+        rel = str(Path(fpath).relative_to(self.source_base))
+        sig = source_signature(fpath)
+        entry = self._files.get(rel)
+        if entry is not None and entry.get("mtime") == sig["mtime"] and entry.get("size") == sig["size"]:
+            return {int(k): (v[0], v[1]) for k, v in entry["offsets"].items()}
+
+        offsets = scan_offsets(fpath)
+        self._files[rel] = {
+            "mtime": sig["mtime"],
+            "size": sig["size"],
+            "offsets": {str(k): list(v) for k, v in offsets.items()},
+        }
+        self._dirty = True
+        return offsets
+
+    def save(self):
+        """有变更时原子写回 manifest。"""
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "source_base": str(self.source_base),
+                "resolve": self._resolve,
+                "files": self._files,
+            }, fout)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+class OffsetFile:
+    """按 manifest 偏移随机读取单条样本，提供与 {index: record} 映射相同的 get 接口。"""
+
+    def __init__(self, fpath: Path, offsets: Dict[int, Tuple[int, int]]):
+        self.path = Path(fpath)
+        self.offsets = offsets
+        self._fd = os.open(self.path, os.O_RDONLY)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def nbytes(self) -> int:
+        """常驻内存的粗略估算：仅 offsets 字典，每条约 100 字节。"""
+        return 100 * len(self.offsets)
+
+    def __contains__(self, idx: int) -> bool:
+        return int(idx) in self.offsets
+
+    def keys(self):
+        return self.offsets.keys()
+
+    def get(self, idx: int, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        loc = self.offsets.get(int(idx))
+        if loc is None:
+            return default
+        return loads(os.pread(self._fd, loc[1], loc[0]))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .run import BaseSetAccessor, DEFAULT_SOURCE_BASE
+
+    parser = argparse.ArgumentParser(description="为 source 目录生成 (或刷新) 路径与样本偏移清单")
+    parser.add_argument("--source_base", default=DEFAULT_SOURCE_BASE, help="源数据根目录")
+    parser.add_argument("--manifest", default="", help=f"清单路径，默认 <source_base>/{DEFAULT_MANIFEST_NAME}")
+    args = parser.parse_args()
+
+    manifest_path = args.manifest or str(Path(args.source_base) / DEFAULT_MANIFEST_NAME)
+    accessor = BaseSetAccessor(source_base=args.source_base, manifest_path=manifest_path)
+    n_files = 0
+    for fpath in accessor.iter_source_files():
+        accessor.manifest.offsets_for(fpath)
+        n_files += 1
+    accessor.manifest.save()
+    print(f"manifest 已写入 {accessor.manifest.path} ({n_files} 个文件)")
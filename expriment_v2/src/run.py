@@ -2,8 +2,12 @@ import logging
 from pathlib import Path
 import os
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
 
 # 保证可以导入 sampling_strategies
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -12,7 +16,14 @@ if str(BASE_DIR) not in sys.path:
 
 from sampling_strategies import LEVEL_TO_FEATURE
 from .calc import calculate_all_scores
+from .batch import MetricSelection, VARIANT_SUFFIXES, parse_ref_pairs, score_samples
 from .eval import fig_fpr_tpr
+from .store import StoreFile, is_up_to_date, store_dir_for
+from .manifest import OffsetFile, SourceManifest
+from .features import FeatureTable, build_samples_from_features, reject_text_metrics
+from .coverage import CoverageIndex
+from .jsonl_io import iter_jsonl, read_jsonl
+from .textcache import get_text_cache, use_text_cache
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -35,9 +46,33 @@ class BaseSetAccessor:
 
     因此，本类初始化时既接受 baseset_dir（可选，仅为兼容旧接口），也接受 source_base。
     _resolve_file_path 将仅依赖 source_base 来定位文件。
+
+    若给定 store_base（由 src/store.py 预先转换得到的二进制列式存储），则样本从
+    store 中读取，不再逐行解析 JSON；返回的样本字典含 logprobs 字段而非 tokens。
+    打开每个 store 目录时校验其 meta 与源文件的 mtime/size：未转换或已过期的文件
+    记录一条 warning 后回退为读取源文件，不会读到旧数据。
+    再指定 mmap=True 时 store 以内存映射方式打开，logprobs 为 np.ndarray 零拷贝视图。
+
+    若给定 manifest_path（见 src/manifest.py），路径解析结果与每个文件的样本字节偏移
+    会持久化到该清单：fetch 退化为一次字典查找加一次 pread，不再整文件解析。
+
+    JSON 模式下可通过 set_needed_indices 预先声明 {(tag, level): indices}，加载文件时
+    仅保留这些 index 的记录，并把 tokens 精简为 logprobs，峰值内存随实验规模而非语料规模增长。
+
+    文件缓存可用 max_cache_records / max_cache_bytes 设定预算，超出时按文件 LRU 淘汰；
+    命中 / 未命中 / 淘汰次数记录在 cache_stats 中。
+
+    prefetch 可并发加载一组 (tag, level, variant) 的文件；prefetch_workers > 0 时
+    _build_samples 会在每遇到新的 (tag, level) 时自动调用。
+
+    若给定 coverage_path（见 src/coverage.py），fetch 先查询覆盖矩阵，源文件中不存在的
+    index 直接抛 KeyError，不再为此加载 / 重新加载整个文件。
     """
 
-    def __init__(self, baseset_dir: str = "", source_base: str = DEFAULT_SOURCE_BASE):
+    def __init__(self, baseset_dir: str = "", source_base: str = DEFAULT_SOURCE_BASE, store_base: str = "",
+                 mmap: bool = False, manifest_path: str = "",
+                 max_cache_records: int = 0, max_cache_bytes: int = 0, prefetch_workers: int = 0,
+                 coverage_path: str = ""):
         # index 根目录（可能为空，仅用于外部兼容）
         self.index_root = Path(baseset_dir) if baseset_dir else None
 
@@ -45,12 +80,48 @@ class BaseSetAccessor:
         self.source_base = Path(source_base)
         assert self.source_base.exists(), f"source_base 不存在: {self.source_base}"
 
-        # cache: (file_path) -> {index: obj}
-        self._file_cache: Dict[Path, Dict[int, Dict[str, Any]]] = {}
+        # 二进制列式存储根目录（可选）
+        self.store_base = Path(store_base) if store_base else None
+        if mmap and self.store_base is None:
+            raise ValueError("mmap 模式需要同时指定 store_base")
+        self.mmap = mmap
+
+        # 持久化清单（可选）
+        self.manifest = SourceManifest(Path(manifest_path), self.source_base) if manifest_path else None
+
+        # cache: (file_path) -> {index: obj} / StoreFile / OffsetFile，按最近使用排序
+        self._file_cache: "OrderedDict[Path, Any]" = OrderedDict()
+        # LRU 预算：0 表示不限制；以文件为单位淘汰
+        self.max_cache_records = max_cache_records
+        self.max_cache_bytes = max_cache_bytes
+        self._cache_sizes: Dict[Path, Tuple[int, int]] = {}
+        self._cache_records = 0
+        self._cache_bytes = 0
+        self.cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+        # >0 时 _build_samples 在遇到新的 (tag, level) 时并发预取其全部 variant 文件
+        self.prefetch_workers = prefetch_workers
+
+        # 限定 prefetch / _build_samples 访问的 variant；None 表示全部
+        self.variants: Optional[List[str]] = None
+
+        # cache: (tag, level_code, variant) -> file_path
+        self._path_cache: Dict[tuple, Path] = {}
+
+        # (tag, level_code) -> 需要保留的 index；None 表示不过滤
+        self._needed: Optional[Dict[Tuple[int, str], Set[int]]] = None
+        # file_path -> 加载该文件时实际使用的 keep 集合
+        self._loaded_keep: Dict[Path, Set[int]] = {}
 
         # level -> feature 缓存
         self.level2feature = LEVEL_TO_FEATURE
 
+        # 覆盖矩阵（可选）：按需增量刷新后常驻内存
+        self.coverage = (
+            CoverageIndex.load_or_build(Path(coverage_path), self.source_base, self.coverage_dirs())
+            if coverage_path else None
+        )
+
     # ------------------------- 内部辅助 -------------------------
     # 支持的模型前缀与其目录名映射
     _MODEL_DIRS = {
@@ -80,9 +151,20 @@ class BaseSetAccessor:
 
         与旧实现区别：不再在 baseset_dir 中查找，而是直接使用 source_base 下的原始分析文件。
         """
+        key = (tag, level_code, variant)
+        cached = self._path_cache.get(key)
+        if cached is not None:
+            return cached
+
         if variant not in self._VARIANT_TEMPLATE:
             raise ValueError(f"未知的 variant: {variant}")
 
+        if self.manifest is not None:
+            fpath = self.manifest.lookup(variant, tag, level_code)
+            if fpath is not None:
+                self._path_cache[key] = fpath
+                return fpath
+
         # tag -> memall / nmeall
         base_name = "memall" if tag == 1 else "nmeall"
         variant_rel = self._VARIANT_TEMPLATE[variant].format(base=base_name)
@@ -95,31 +177,199 @@ class BaseSetAccessor:
 
         for fname in os.listdir(dir_path):
             if feature in fname and fname.endswith(".jsonl_"):
-                return dir_path / fname
+                fpath = dir_path / fname
+                self._path_cache[key] = fpath
+                if self.manifest is not None:
+                    self.manifest.record(variant, tag, level_code, fpath)
+                return fpath
 
         raise FileNotFoundError(
             f"在 {dir_path} 中找不到包含特征 {feature} 的文件 (variant={variant})。")
 
-    def _load_file_to_cache(self, fpath: Path):
-        """将文件加载到缓存 (一次性)。"""
-        mapping: Dict[int, Dict[str, Any]] = {}
-        with open(fpath, "r", encoding="utf-8") as fin:
-            for line in fin:
-                try:
-                    obj = json.loads(line)
-                    idx = obj.get("index")
-                    if idx is not None:
-                        mapping[int(idx)] = obj
-                except Exception:
-                    continue
-        self._file_cache[fpath] = mapping
+    def iter_source_files(self):
+        """遍历全部 (tag, level, variant) 对应的源文件路径，缺失的文件跳过。"""
+        for variant in self._VARIANT_TEMPLATE:
+            for tag in (1, 0):
+                for level_code in self.level2feature:
+                    try:
+                        yield self._resolve_file_path(tag, level_code, variant)
+                    except FileNotFoundError:
+                        continue
+
+    @classmethod
+    def coverage_dirs(cls) -> List[str]:
+        """全部 variant 目录 (相对 source_base)，与 exp_maker 的 MEMBER/NONMEMBER_DIRS_REL 一致。"""
+        dirs: List[str] = []
+        for base_name in ("memall", "nmeall"):
+            for template in cls._VARIANT_TEMPLATE.values():
+                dirs.append(template.format(base=base_name))
+        return dirs
+
+    def select_variants(self, variants: Optional[Iterable[str]]):
+        """限定后续访问的 variant (见 batch.MetricSelection.variants)；未选中的文件不会被打开。None 恢复全部。"""
+        if variants is None:
+            self.variants = None
+            return
+        variants = list(variants)
+        unknown = [v for v in variants if v not in self._VARIANT_TEMPLATE]
+        if unknown:
+            raise ValueError(f"未知的 variant: {unknown}")
+        self.variants = variants
+
+    def set_needed_indices(self, needed: Dict[Tuple[int, str], Set[int]]):
+        """声明后续 fetch 会用到的 {(tag, level_code): indices}，JSON 模式下据此过滤加载。"""
+        self._needed = {(int(t), str(lv)): set(v) for (t, lv), v in needed.items()}
+
+    def _parse_file(self, fpath: Path, keep: Optional[Set[int]] = None) -> Tuple[Any, int]:
+        """读取单个源文件，返回 (缓存条目, 估算的常驻字节数)，不修改缓存。
+
+        keep 非空时仅保留其中的 index，并把 tokens 精简为 logprobs 列表 (仅 JSON 模式生效)。
+        """
+        if self.store_base is not None:
+            dst = store_dir_for(fpath, self.source_base, self.store_base)
+            if is_up_to_date(fpath, dst):
+                entry = StoreFile(dst, mmap=self.mmap)
+                return entry, entry.nbytes
+            logger.warning(f"store 未转换或已过期 (源文件已变化)，改为读取源文件: {fpath}")
+        if self.manifest is not None:
+            entry = OffsetFile(fpath, self.manifest.offsets_for(fpath))
+            return entry, entry.nbytes
+
+        return _parse_json_file(fpath, keep)
+
+    def _cache_put(self, fpath: Path, entry: Any, nbytes: int, keep: Optional[Set[int]] = None):
+        """写入缓存并按 LRU 淘汰，直到满足 max_cache_records / max_cache_bytes。"""
+        self._cache_evict_one(fpath)
+        self._file_cache[fpath] = entry
+        self._cache_sizes[fpath] = (len(entry), nbytes)
+        self._cache_records += len(entry)
+        self._cache_bytes += nbytes
+        # 只有 JSON 模式的字典条目按 keep 过滤；store / manifest 条目含全部 index，不记录
+        if keep is not None and isinstance(entry, dict):
+            self._loaded_keep[fpath] = set(keep)
+
+        while len(self._file_cache) > 1 and (
+            (self.max_cache_records and self._cache_records > self.max_cache_records)
+            or (self.max_cache_bytes and self._cache_bytes > self.max_cache_bytes)
+        ):
+            oldest = next(iter(self._file_cache))
+            self._cache_evict_one(oldest)
+            self.cache_stats["evictions"] += 1
+
+    def _cache_evict_one(self, fpath: Path):
+        entry = self._file_cache.pop(fpath, None)
+        if entry is None:
+            return
+        n_records, nbytes = self._cache_sizes.pop(fpath)
+        self._cache_records -= n_records
+        self._cache_bytes -= nbytes
+        self._loaded_keep.pop(fpath, None)
+        # OffsetFile 不在此关闭：iter_file 的生成器可能仍持有该条目，最后一个引用释放时由 __del__ 关闭
+
+    def _load_file_to_cache(self, fpath: Path, keep: Optional[Set[int]] = None):
+        """将文件加载到缓存。"""
+        entry, nbytes = self._parse_file(fpath, keep)
+        self._cache_put(fpath, entry, nbytes, keep)
+
+    def prefetch(self, tags: Iterable[int], levels: Iterable[str], variants: Optional[Iterable[str]] = None,
+                 workers: Optional[int] = None):
+        """并发加载 tags × levels × variants (默认为 select_variants 选定的 variant) 对应的全部源文件并写入缓存。
+
+        不存在的文件、以及已缓存且覆盖当前所需 index 的文件会被跳过。JSON 模式解析受 GIL 限制，使用进程池；
+        store / manifest 模式以 I/O 为主，使用线程池。冷缓存耗时由最慢的单个文件决定。
+        """
+        workers = workers or self.prefetch_workers
+        if variants is None:
+            variants = self.variants if self.variants is not None else list(self._VARIANT_TEMPLATE.keys())
+        else:
+            variants = list(variants)
+
+        jobs: Dict[Path, Optional[Set[int]]] = {}
+        for tag in tags:
+            for level_code in levels:
+                keep = None
+                if self._needed is not None:
+                    keep = self._needed.setdefault((int(tag), str(level_code)), set())
+                for variant in variants:
+                    try:
+                        fpath = self._resolve_file_path(tag, level_code, variant)
+                    except FileNotFoundError:
+                        continue
+                    if fpath in jobs:
+                        continue
+                    loaded_keep = self._loaded_keep.get(fpath)
+                    # 已缓存且覆盖了当前所需 index 的文件跳过
+                    if fpath in self._file_cache and (keep is None or loaded_keep is None or keep <= loaded_keep):
+                        continue
+                    jobs[fpath] = keep
+        if not jobs:
+            return
+
+        json_mode = self.store_base is None and self.manifest is None
+        if workers <= 1:
+            for fpath, keep in jobs.items():
+                self.cache_stats["misses"] += 1
+                self._load_file_to_cache(fpath, keep)
+            return
+
+        if json_mode:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            parse = _parse_json_file
+        else:
+            pool = ThreadPoolExecutor(max_workers=workers)
+            parse = self._parse_file
+        with pool:
+            futures = {pool.submit(parse, fpath, keep): fpath for fpath, keep in jobs.items()}
+            for fut in as_completed(futures):
+                fpath = futures[fut]
+                entry, nbytes = fut.result()
+                self.cache_stats["misses"] += 1
+                self._cache_put(fpath, entry, nbytes, jobs[fpath])
+
+    def save_manifest(self):
+        """将本次运行新增的路径解析 / 偏移结果写回 manifest (若启用)。"""
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def iter_file(self, tag: int, level_code: str, variant: str = "origin") -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """按文件中的顺序产出 (index, 样本)，覆盖文件中的全部 index (不受 set_needed_indices 过滤)。
+
+        文件不存在时 (首次迭代时) 抛 FileNotFoundError。
+        """
+        fpath = self._resolve_file_path(tag, level_code, variant)
+        if fpath in self._file_cache and fpath not in self._loaded_keep:
+            self.cache_stats["hits"] += 1
+            self._file_cache.move_to_end(fpath)
+        else:
+            # 未缓存，或缓存的是按 keep 过滤后的 JSON 条目：完整加载
+            self.cache_stats["misses"] += 1
+            self._load_file_to_cache(fpath)
+        entry = self._file_cache[fpath]
+        for idx in list(entry.keys()):
+            yield int(idx), entry.get(idx)
 
     def fetch(self, tag: int, level_code: str, idx: int, variant: str = "origin") -> Dict[str, Any]:
         """根据 variant 返回样本字典。"""
         fpath = self._resolve_file_path(tag, level_code, variant)
-        if fpath not in self._file_cache:
-            self._load_file_to_cache(fpath)
+        if self.coverage is not None:
+            rel = fpath.relative_to(self.source_base).as_posix()
+            if self.coverage.covers(rel) and not self.coverage.has(rel, idx):
+                raise KeyError(f"在文件 {fpath} 中未找到 index={idx} (覆盖矩阵)")
+        keep = None
+        if self._needed is not None:
+            keep = self._needed.setdefault((int(tag), str(level_code)), set())
+        if fpath in self._file_cache:
+            self.cache_stats["hits"] += 1
+            self._file_cache.move_to_end(fpath)
+        else:
+            self.cache_stats["misses"] += 1
+            self._load_file_to_cache(fpath, keep)
         sample = self._file_cache[fpath].get(int(idx))
+        if sample is None and fpath in self._loaded_keep and int(idx) not in self._loaded_keep[fpath]:
+            # 按 keep 过滤加载的 JSON 文件中未声明的 index：补充后重新加载该文件
+            keep.add(int(idx))
+            self._load_file_to_cache(fpath, keep)
+            sample = self._file_cache[fpath].get(int(idx))
         if sample is None:
             raise KeyError(f"在文件 {fpath} 中未找到 index={idx}")
         return sample
@@ -146,15 +396,69 @@ def _get_log_probs_from_tokens(precomputed_tokens: Any) -> List[float]:
     return log_probs
 
 
+def _get_log_probs(obj: Dict[str, Any]) -> "List[float] | np.ndarray":
+    """从样本字典中取 logprob 序列：store 模式下直接使用 logprobs (mmap 时为 ndarray 视图)，否则从 tokens 抽取。"""
+    if "logprobs" in obj:
+        return obj["logprobs"]
+    return _get_log_probs_from_tokens(obj.get("tokens"))
+
+
+def _parse_json_file(fpath: Path, keep: Optional[Set[int]] = None) -> Tuple[Dict[int, Dict[str, Any]], int]:
+    """逐行解析 .jsonl_ 源文件，返回 ({index: obj}, 保留行的字节数)。
+
+    定义为模块级函数，以便 prefetch 在进程池中调用。
+    """
+    mapping: Dict[int, Dict[str, Any]] = {}
+    nbytes = 0
+    for _, length, obj in iter_jsonl(fpath, with_offsets=True):
+        try:
+            idx = obj.get("index")
+            if idx is None:
+                continue
+            idx = int(idx)
+            if keep is not None:
+                if idx not in keep:
+                    continue
+                if "tokens" in obj:
+                    obj["logprobs"] = _get_log_probs_from_tokens(obj.pop("tokens"))
+            mapping[idx] = obj
+            nbytes += length
+        except Exception:
+            continue
+    return mapping, nbytes
+
+
+def collect_needed_indices(dataset_paths: Iterable[str]) -> Dict[Tuple[int, str], Set[int]]:
+    """预扫描 attempt 数据集，汇总全部 (tag, level) -> index 集合，供 set_needed_indices 使用。"""
+    needed: Dict[Tuple[int, str], Set[int]] = {}
+    for path in dataset_paths:
+        for rec in iter_jsonl(path):
+            try:
+                key = (int(rec["tag"]), str(rec["level"]))
+                needed.setdefault(key, set()).add(int(rec["index"]))
+            except Exception:
+                continue
+    return needed
+
+
 # -----------------------------------------------------------------------------
 # 推理与评估
 
 
-def _build_samples(raw_records: List[Dict[str, Any]], accessor: BaseSetAccessor) -> List[Dict[str, Any]]:
-    """根据 index/tag/level/label 构造包含多模型 logprobs / rec_new_Loss 的样本。"""
+def _build_samples(raw_records: List[Dict[str, Any]], accessor: BaseSetAccessor,
+                   selection: Optional[MetricSelection] = None) -> List[Dict[str, Any]]:
+    """根据 index/tag/level/label 构造包含多模型 logprobs / rec_new_Loss 的样本。
+
+    给定 selection 时只读取所选指标用到的模型与 variant (如只选 Min-K 时不读取 nb / rec_new 文件)。
+    """
     processed: List[Dict[str, Any]] = []
 
     model_keys = list(BaseSetAccessor._MODEL_DIRS.keys())
+    suffixes = list(VARIANT_SUFFIXES)
+    if selection is not None:
+        model_keys = selection.fetch_models(model_keys)
+        suffixes = selection.variant_suffixes()
+    prefetched: Set[Tuple[int, str]] = set()
 
     for rec in raw_records:
         try:
@@ -163,6 +467,11 @@ def _build_samples(raw_records: List[Dict[str, Any]], accessor: BaseSetAccessor)
             level_code: str = rec["level"]
             label_val: int = rec["label"]
 
+            # 新 (tag, level) 的首个样本：并发加载其全部 variant 文件
+            if accessor.prefetch_workers > 0 and (tag, level_code) not in prefetched:
+                accessor.prefetch([tag], [level_code])
+                prefetched.add((tag, level_code))
+
             # 统一使用第一个模型的文本作为 text（各模型 input 应一致）
             first_origin = accessor.fetch(tag, level_code, idx, variant=model_keys[0])
             text_val = first_origin.get("input")
@@ -175,12 +484,15 @@ def _build_samples(raw_records: List[Dict[str, Any]], accessor: BaseSetAccessor)
             for mkey in model_keys:
                 try:
                     origin_obj = accessor.fetch(tag, level_code, idx, variant=mkey)
-                    nb_obj = accessor.fetch(tag, level_code, idx, variant=f"{mkey}_nb")
-                    rec_new_obj = accessor.fetch(tag, level_code, idx, variant=f"{mkey}_rec_new")
-
-                    sample_dict[f"{mkey}_logprobs"] = _get_log_probs_from_tokens(origin_obj.get("tokens"))
-                    sample_dict[f"{mkey}_nb_logprobs"] = _get_log_probs_from_tokens(nb_obj.get("tokens"))
-                    sample_dict[f"{mkey}_rec_new_Loss"] = rec_new_obj.get("Loss", rec_new_obj.get("loss"))
+                    nb_obj = accessor.fetch(tag, level_code, idx, variant=f"{mkey}_nb") if "_nb" in suffixes else None
+                    rec_new_obj = (accessor.fetch(tag, level_code, idx, variant=f"{mkey}_rec_new")
+                                   if "_rec_new" in suffixes else None)
+
+                    sample_dict[f"{mkey}_logprobs"] = _get_log_probs(origin_obj)
+                    if nb_obj is not None:
+                        sample_dict[f"{mkey}_nb_logprobs"] = _get_log_probs(nb_obj)
+                    if rec_new_obj is not None:
+                        sample_dict[f"{mkey}_rec_new_Loss"] = rec_new_obj.get("Loss", rec_new_obj.get("loss"))
                 except Exception as inner_e:
                     logger.warning(f"模型 {mkey} 样本(index={idx}) 获取失败: {inner_e}")
 
@@ -190,22 +502,43 @@ def _build_samples(raw_records: List[Dict[str, Any]], accessor: BaseSetAccessor)
     return processed
 
 
-def _inference(ex: Dict[str, Any]) -> Dict[str, Any]:
+def make_selection(metrics: Optional[List[str]] = None, models: Optional[List[str]] = None,
+                   ref_pairs: Optional[List[str]] = None) -> Optional[MetricSelection]:
+    """由 --metrics / --models / --ref_pairs 构造 MetricSelection；三者均为空时返回 None (计算全部默认指标)。"""
+    if not (metrics or models or ref_pairs):
+        return None
+    known = list(BaseSetAccessor._MODEL_DIRS)
+    pairs = parse_ref_pairs(ref_pairs, known) if ref_pairs else None
+    return MetricSelection(metrics, models, known_models=known, ref_pairs=pairs)
+
+
+def _inference(ex: Dict[str, Any], ref_pairs: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Any]:
     """针对单个样本计算分数，结果写入 ex['pred']"""
     try:
-        ex["pred"] = calculate_all_scores(ex)
+        ex["pred"] = calculate_all_scores(ex, ref_pairs)
     except Exception as e:
         logger.error(f"计算分数时出错: {e}")
         ex["pred"] = {"error": str(e)}
     return ex
 
 
-def _evaluate(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """对全部样本逐一推理，无进度条输出（避免嵌套 tqdm）。"""
+def _evaluate(data: List[Dict[str, Any]], selection: Optional[MetricSelection] = None) -> List[Dict[str, Any]]:
+    """对全部样本批量打分 (见 src/batch.py)，失败时退回逐样本推理；无进度条输出（避免嵌套 tqdm）。"""
     logger.info(f"开始评估，共 {len(data)} 条样本……")
+    try:
+        preds = score_samples(data, selection=selection)
+    except Exception as e:
+        logger.error(f"批量打分失败，改为逐样本计算: {e}")
+    else:
+        for ex, pred in zip(data, preds):
+            ex["pred"] = pred
+        return data
+
     output = []
     for ex in data:
-        output.append(_inference(ex))
+        output.append(_inference(ex, selection.ref_pairs if selection is not None else None))
+        if selection is not None and "error" not in ex["pred"]:
+            ex["pred"] = {k: v for k, v in ex["pred"].items() if selection.keep_name(k)}
         # print(output)
         # return
     return output
@@ -214,27 +547,43 @@ def _evaluate(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
 # -----------------------------------------------------------------------------
 # 对外主函数
 
-def process_jsonl(dataset_path: str, baseset_dir: str, output_dir: str, *, accessor: "BaseSetAccessor | None" = None):
-    """给定 attempt 的某个测试数据集，输出评估结果到 output_dir"""
+def process_jsonl(dataset_path: str, baseset_dir: str, output_dir: str, *, accessor: "BaseSetAccessor | None" = None,
+                  feature_table: "FeatureTable | None" = None, metrics: Optional[List[str]] = None,
+                  models: Optional[List[str]] = None, ref_pairs: Optional[List[str]] = None):
+    """给定 attempt 的某个测试数据集，输出评估结果到 output_dir
+
+    给定 feature_table（见 src/features.py）时直接按 index join 预计算特征，不再访问 source。
+    metrics / models 限定计算的指标与模型 (见 batch.MetricSelection)：未选模型 / variant 的源文件
+    不会被读取，未选指标不会被计算。外部传入的 accessor 应已按同一选择调用过 select_variants。
+    ref_pairs 为 Ref 指标的 "目标:参考" 列表 (见 batch.parse_ref_pairs)，默认 calc.REF_PAIRS。
+    """
     dataset_path = str(dataset_path)
     baseset_dir = str(baseset_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    logger.info(f"处理数据集: {dataset_path}")
-    with open(dataset_path, "r", encoding="utf-8") as fin:
-        raw_records = [json.loads(line) for line in fin]
-
-    # 允许外部复用同一 accessor 以减少重复 I/O
-    if accessor is None:
-        accessor = BaseSetAccessor(baseset_dir)
+    selection = make_selection(metrics, models, ref_pairs)
 
-    samples = _build_samples(raw_records, accessor)
+    logger.info(f"处理数据集: {dataset_path}")
+    raw_records = read_jsonl(dataset_path)
+
+    if feature_table is not None:
+        reject_text_metrics(selection)
+        feature_models = selection.fetch_models(BaseSetAccessor._MODEL_DIRS) if selection is not None else None
+        samples = build_samples_from_features(raw_records, feature_table, models=feature_models)
+    else:
+        # 允许外部复用同一 accessor 以减少重复 I/O
+        if accessor is None:
+            accessor = BaseSetAccessor(baseset_dir)
+            accessor.set_needed_indices(collect_needed_indices([dataset_path]))
+            if selection is not None:
+                accessor.select_variants(selection.variants(BaseSetAccessor._MODEL_DIRS))
+        samples = _build_samples(raw_records, accessor, selection)
     if not samples:
         logger.error("未能构造任何可用样本，跳过。")
         return
 
-    all_output = _evaluate(samples)
+    all_output = _evaluate(samples, selection)
 
     # # 保存预测
     # pred_path = output_dir / "predictions.jsonl"
@@ -257,6 +606,28 @@ if __name__ == "__main__":
     parser.add_argument("--data", required=True, help="待评估的数据集 jsonl")
     parser.add_argument("--baseset_dir", required=True, help="对应的 baseset 目录 (如 baseset/exp1)")
     parser.add_argument("--output_dir", required=True, help="结果输出目录")
+    parser.add_argument("--store_base", default="", help="二进制列式存储根目录 (见 src/store.py)，为空则直接解析 JSON")
+    parser.add_argument("--mmap", action="store_true", help="以内存映射方式读取 store (需配合 --store_base)")
+    parser.add_argument("--manifest", default="", help="路径/偏移清单文件 (见 src/manifest.py)，为空则不使用")
+    parser.add_argument("--coverage", default="", help="source 覆盖矩阵文件 (见 src/coverage.py)，为空则不使用")
+    parser.add_argument("--metrics", nargs="+", default=None,
+                        help="只计算这些指标 (如 Min_20%%++ 或 starcoder2_7b_Min_20%%++)，默认输出全部默认指标；"
+                             "其他压缩器的参考熵需显式选择，如 ppl/lzma ppl/zstd-19")
+    parser.add_argument("--models", nargs="+", default=None, help="只读取 / 计算这些模型，默认全部")
+    parser.add_argument("--ref_pairs", nargs="+", default=None,
+                        help="Ref 指标的 目标:参考 对 (可用 * 通配，all 表示全部有序对)，默认四个同系列大小模型对")
+    parser.add_argument("--text_cache", default="", help="文本 zlib 长度缓存文件 (见 src/textcache.py)，为空则不持久化")
     args = parser.parse_args()
 
-    process_jsonl(args.data, args.baseset_dir, args.output_dir) 
\ No newline at end of file
+    if args.text_cache:
+        use_text_cache(args.text_cache)
+
+    accessor = BaseSetAccessor(args.baseset_dir, store_base=args.store_base, mmap=args.mmap,
+                               manifest_path=args.manifest, coverage_path=args.coverage)
+    selection = make_selection(args.metrics, args.models, args.ref_pairs)
+    if selection is not None:
+        accessor.select_variants(selection.variants(BaseSetAccessor._MODEL_DIRS))
+    process_jsonl(args.data, args.baseset_dir, args.output_dir, accessor=accessor,
+                  metrics=args.metrics, models=args.models, ref_pairs=args.ref_pairs)
+    accessor.save_manifest()
+    get_text_cache().save() 
\ No newline at end of file
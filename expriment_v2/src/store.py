@@ -0,0 +1,245 @@
+"""二进制列式样本存储 (sample store)。
+
+source/<model>/analysis*/{memall,nmeall}/*.jsonl_ 中每行都是完整的 JSON 记录
+(input 文本 + tokens 列表)，每次运行 result_maker 都需要重新 json.loads 全部文件。
+本模块提供一次性转换：把每个源文件写成一个紧凑的列式目录
+
+    <store_base>/<与 source_base 相同的相对路径>/<文件名去掉 .jsonl_>/
+        index.npy         int64   (n,)    样本 index
+        offsets.npy       int64   (n+1,)  第 i 条样本的 logprob 位于 logprobs[offsets[i]:offsets[i+1]]
+        logprobs.npy      float32 (m,)    全部样本 logprob 的扁平拼接
+        loss.npy          float32 (n,)    rec_new 文件中的 Loss，缺失为 NaN
+        text.bin          bytes           全部 input 文本 (utf-8) 的拼接
+        text_offsets.npy  int64   (n+1,)  text.bin 中的字节偏移
+        meta.json         源文件路径 / mtime / size，用于判断是否需要重新转换
+
+BaseSetAccessor 在指定 store_base 后直接读取上述数组，不再解析 JSON。
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .jsonl_io import iter_jsonl
+
+logger = logging.getLogger(__name__)
+
+STORE_SUFFIX = ".jsonl_"
+_META_FILE = "meta.json"
+
+
+# -----------------------------------------------------------------------------
+# 路径工具
+
+
+def store_dir_for(source_path: Path, source_base: Path, store_base: Path) -> Path:
+    """源文件 -> 对应的存储目录 (镜像 source_base 下的相对路径)。"""
+    rel = Path(source_path).relative_to(source_base)
+    name = rel.name
+    if name.endswith(STORE_SUFFIX):
+        name = name[: -len(STORE_SUFFIX)]
+    return Path(store_base) / rel.parent / name
+
+
+def source_signature(source_path: Path) -> Dict[str, Any]:
+    """源文件的 (路径, mtime, size) 签名，用于判断派生数据是否过期。"""
+    st = os.stat(source_path)
+    return {"source": str(source_path), "mtime": st.st_mtime, "size": st.st_size}
+
+
+def is_up_to_date(source_path: Path, dst_dir: Path) -> bool:
+    """存储目录存在且 meta 与源文件的 mtime/size 一致时返回 True。"""
+    meta_path = Path(dst_dir) / _META_FILE
+    if not meta_path.exists():
+        return False
+    try:
+        with open(meta_path, "r", encoding="utf-8") as fin:
+            meta = json.load(fin)
+    except (OSError, json.JSONDecodeError):
+        return False
+    sig = source_signature(source_path)
+    return meta.get("mtime") == sig["mtime"] and meta.get("size") == sig["size"]
+
+
+# -----------------------------------------------------------------------------
+# 转换
+
+
+def convert_file(source_path: Path, dst_dir: Path) -> int:
+    """将单个 .jsonl_ 源文件转换为列式存储，返回写入的样本数。"""
+    source_path = Path(source_path)
+    dst_dir = Path(dst_dir)
+
+    indices: List[int] = []
+    offsets: List[int] = [0]
+    losses: List[float] = []
+    text_offsets: List[int] = [0]
+    logprob_chunks: List[np.ndarray] = []
+    text_chunks: List[bytes] = []
+
+    n_tokens = 0
+    n_text = 0
+    for obj in iter_jsonl(source_path):
+        try:
+            idx = obj.get("index")
+            if idx is None:
+                continue
+            idx = int(idx)
+        except Exception:
+            continue
+
+        # 与 run._get_log_probs_from_tokens 的抽取规则保持一致
+        lps: List[float] = []
+        tokens = obj.get("tokens")
+        if isinstance(tokens, list):
+            for item in tokens:
+                if isinstance(item, dict) and "logprob" in item:
+                    try:
+                        lps.append(float(item["logprob"]))
+                    except (TypeError, ValueError):
+                        continue
+
+        loss = obj.get("Loss", obj.get("loss"))
+        try:
+            loss_val = float(loss) if loss is not None else float("nan")
+        except (TypeError, ValueError):
+            loss_val = float("nan")
+
+        text = obj.get("input")
+        text_bytes = b"" if text is None else str(text).encode("utf-8")
+
+        indices.append(idx)
+        logprob_chunks.append(np.asarray(lps, dtype=np.float32))
+        n_tokens += len(lps)
+        offsets.append(n_tokens)
+        losses.append(loss_val)
+        text_chunks.append(text_bytes)
+        n_text += len(text_bytes)
+        text_offsets.append(n_text)
+
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    logprobs = np.concatenate(logprob_chunks) if logprob_chunks else np.zeros(0, dtype=np.float32)
+    np.save(dst_dir / "index.npy", np.asarray(indices, dtype=np.int64))
+    np.save(dst_dir / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+    np.save(dst_dir / "logprobs.npy", logprobs.astype(np.float32, copy=False))
+    np.save(dst_dir / "loss.npy", np.asarray(losses, dtype=np.float32))
+    np.save(dst_dir / "text_offsets.npy", np.asarray(text_offsets, dtype=np.int64))
+    with open(dst_dir / "text.bin", "wb") as fout:
+        fout.write(b"".join(text_chunks))
+
+    # meta 最后写入：中途失败时 is_up_to_date 仍返回 False
+    meta = source_signature(source_path)
+    meta["n"] = len(indices)
+    with open(dst_dir / _META_FILE, "w", encoding="utf-8") as fout:
+        json.dump(meta, fout, ensure_ascii=False)
+    return len(indices)
+
+
+def build_store(source_files: Iterable[Path], source_base: Path, store_base: Path, *, force: bool = False) -> Dict[str, int]:
+    """批量转换 source_files；已是最新的文件会被跳过 (除非 force=True)。
+
+    返回统计信息 {"converted": x, "skipped": y}。
+    """
+    stats = {"converted": 0, "skipped": 0}
+    for src in source_files:
+        dst = store_dir_for(src, source_base, store_base)
+        if not force and is_up_to_date(src, dst):
+            stats["skipped"] += 1
+            continue
+        n = convert_file(src, dst)
+        stats["converted"] += 1
+        logger.info(f"已转换 {src} -> {dst} ({n} 条)")
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# 读取
+
+
+class StoreFile:
+    """单个源文件对应的列式存储，提供与 {index: record} 映射相同的 get 接口。
+
+    mmap=True 时 logprobs.npy / text.bin 以只读内存映射方式打开，get 返回的
+    logprobs 为 np.ndarray 视图 (零拷贝)，而非 List[float]。
+    """
+
+    def __init__(self, dst_dir: Path, mmap: bool = False):
+        self.path = Path(dst_dir)
+        if not (self.path / _META_FILE).exists():
+            raise FileNotFoundError(f"存储目录不存在或未完成转换: {self.path}")
+
+        self.mmap = mmap
+        self.index = np.load(self.path / "index.npy")
+        self.offsets = np.load(self.path / "offsets.npy")
+        self.logprobs = np.load(self.path / "logprobs.npy", mmap_mode="r" if mmap else None)
+        self.loss = np.load(self.path / "loss.npy")
+        self.text_offsets = np.load(self.path / "text_offsets.npy")
+        if mmap:
+            # 空文件无法 mmap
+            text_path = self.path / "text.bin"
+            self.text = np.memmap(text_path, dtype=np.uint8, mode="r") if text_path.stat().st_size else b""
+        else:
+            with open(self.path / "text.bin", "rb") as fin:
+                self.text = fin.read()
+
+        # index -> 行号
+        self._row: Dict[int, int] = {int(v): i for i, v in enumerate(self.index.tolist())}
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    def keys(self):
+        return self._row.keys()
+
+    @property
+    def nbytes(self) -> int:
+        """常驻内存的估算字节数 (mmap 模式下 logprobs / text 由页缓存承担，不计入)。"""
+        n = self.index.nbytes + self.offsets.nbytes + self.loss.nbytes + self.text_offsets.nbytes
+        if not self.mmap:
+            n += self.logprobs.nbytes + len(self.text)
+        return n
+
+    def __contains__(self, idx: int) -> bool:
+        return int(idx) in self._row
+
+    def get_logprobs(self, idx: int) -> Optional[np.ndarray]:
+        """返回 index 对应的 logprob 切片 (mmap 模式下为零拷贝视图)；不存在时返回 None。"""
+        row = self._row.get(int(idx))
+        if row is None:
+            return None
+        return self.logprobs[int(self.offsets[row]):int(self.offsets[row + 1])]
+
+    def get(self, idx: int, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """返回 {"index", "input", "logprobs", "Loss"}；index 不存在时返回 default。"""
+        row = self._row.get(int(idx))
+        if row is None:
+            return default
+        lo, hi = int(self.offsets[row]), int(self.offsets[row + 1])
+        t_lo, t_hi = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        loss = float(self.loss[row])
+        lps = self.logprobs[lo:hi]
+        return {
+            "index": int(idx),
+            "input": bytes(self.text[t_lo:t_hi]).decode("utf-8"),
+            "logprobs": lps if self.mmap else lps.tolist(),
+            "Loss": None if np.isnan(loss) else loss,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .run import BaseSetAccessor, DEFAULT_SOURCE_BASE
+
+    parser = argparse.ArgumentParser(description="将 source 目录下的 .jsonl_ 分析文件转换为二进制列式存储")
+    parser.add_argument("--source_base", default=DEFAULT_SOURCE_BASE, help="源数据根目录")
+    parser.add_argument("--store_base", required=True, help="存储输出根目录")
+    parser.add_argument("--force", action="store_true", help="忽略 mtime/size 检查，全部重新转换")
+    args = parser.parse_args()
+
+    accessor = BaseSetAccessor(source_base=args.source_base)
+    stats = build_store(accessor.iter_source_files(), accessor.source_base, Path(args.store_base), force=args.force)
+    print(f"转换完成: {stats}")
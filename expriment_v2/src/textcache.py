@@ -0,0 +1,263 @@
+"""按文本内容哈希缓存的压缩长度 (zlib / lzma / bz2 / zstd 熵)。
+
+calc.calculate_zlib_entropy 对每个样本都要压缩一次 text，而同一 index 会出现在大量
+attempt 数据集中。本模块以 blake2b(text) 为键缓存各压缩器下的长度：进程内全部数据集
+共享同一缓存，给定路径时还可持久化到 source 旁，使整个 sweep 中每段代码只压缩一次：
+
+    <path>.npz
+        <codec>__keys  uint8 (n, 16)   blake2b-128 摘要 (按字节序升序)
+        <codec>__len   int64 (n,)      压缩后长度
+
+保存时与磁盘上已有内容合并后原子替换，多个进程 (如 result_maker --workers) 可安全地并发写入。
+
+压缩器以 "<名称>[-<级别>]" 指定 (如 lzma、bz2-1、zstd-19)，缓存按该字符串分表。
+未命中的文本在线程池中压缩 (lzma / bz2 压缩时释放 GIL)；zlib / zstd 对短代码段本身很快，
+只在未命中文本总量较大时才用线程池，避免线程调度开销超过压缩本身。
+zstd 需要安装 zstandard，未安装时请求 zstd 会报错，其余压缩器不受影响。
+"""
+import bz2
+import hashlib
+import logging
+import lzma
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .calc import calculate_zlib_entropy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEXT_CACHE_NAME = "_text_lengths.npz"
+ZLIB = "zlib"
+# 未命中文本的压缩线程数
+COMPRESS_WORKERS = min(8, os.cpu_count() or 1)
+# 总是使用线程池的慢速压缩器；其余压缩器仅当未命中文本总字节数达到阈值时使用
+_SLOW_CODECS = ("lzma", "bz2")
+_PARALLEL_MIN_BYTES = 1 << 20
+
+
+def _select_zstd() -> Optional[Callable[[bytes, int], bytes]]:
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    # ZstdCompressor 不可跨线程共享，每次调用新建
+    return lambda data, level: zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# 压缩器名称 -> (默认级别, compress(data, level))
+CODECS: Dict[str, Tuple[int, Callable[[bytes, int], bytes]]] = {
+    "zlib": (zlib.Z_DEFAULT_COMPRESSION, lambda data, level: zlib.compress(data, level)),
+    "lzma": (6, lambda data, level: lzma.compress(data, preset=level)),
+    "bz2": (9, lambda data, level: bz2.compress(data, level)),
+}
+_zstd = _select_zstd()
+if _zstd is not None:
+    CODECS["zstd"] = (3, _zstd)
+del _zstd
+
+_KEY_SIZE = 16
+_CODEC_RE = re.compile(r"^([a-z0-9]+?)(?:-(\d+))?$")
+
+
+def parse_codec(codec: str) -> Tuple[str, int]:
+    """"lzma-9" -> ("lzma", 9)；未给级别时取默认级别。未知或不可用的压缩器抛 ValueError。"""
+    m = _CODEC_RE.match(codec)
+    if m is None:
+        raise ValueError(f"无法解析压缩器: {codec}，应为 <名称>[-<级别>]，如 lzma-9")
+    name, level = m.group(1), m.group(2)
+    if name not in CODECS:
+        hint = "；zstd 需要安装 zstandard" if name == "zstd" else ""
+        raise ValueError(f"未知或不可用的压缩器: {name}，可选: {sorted(CODECS)}{hint}")
+    return name, CODECS[name][0] if level is None else int(level)
+
+
+def codec_length_fn(codec: str) -> Callable[[Any], int]:
+    """codec 下单段文本的压缩长度函数；"zlib" 与 calc.calculate_zlib_entropy 完全一致。"""
+    if codec == ZLIB:
+        return calculate_zlib_entropy
+    name, level = parse_codec(codec)
+    compress = CODECS[name][1]
+
+    def length(text: Any) -> int:
+        if not isinstance(text, (str, bytes)):
+            return 0
+        try:
+            return len(compress(bytes(str(text), "utf-8"), level))
+        except Exception as e:
+            logger.error(f"计算 {codec} 熵时出错: {e}")
+            return 0
+    return length
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=_KEY_SIZE).digest()
+
+
+class TextLengthCache:
+    """{codec: {文本摘要: 压缩长度}}；path 为空时仅驻留内存。"""
+
+    def __init__(self, path: str = ""):
+        self.path = Path(path) if path else None
+        self._lengths: Dict[str, Dict[bytes, int]] = {}
+        # 上次 take_new 以来新计算的条目 (并行子进程据此把增量交回父进程)
+        self._new: Dict[str, Dict[bytes, int]] = {}
+        self._dirty = False
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+        if self.path is not None and self.path.exists():
+            self._merge(self._read(self.path))
+
+    @staticmethod
+    def _read(path: Path) -> Dict[str, Dict[bytes, int]]:
+        tables: Dict[str, Dict[bytes, int]] = {}
+        try:
+            with np.load(path) as npz:
+                for name in npz.files:
+                    if name.endswith("__keys"):
+                        codec = name[:-len("__keys")]
+                        # 按定长原始字节还原 (S16 会截掉摘要末尾的 0x00)
+                        keys = np.ascontiguousarray(npz[name], dtype=np.uint8).reshape(-1, _KEY_SIZE)
+                        tables[codec] = dict(zip((k.tobytes() for k in keys), npz[f"{codec}__len"].tolist()))
+        except Exception as e:
+            logger.warning(f"读取文本长度缓存失败，忽略: {path} ({e})")
+        return tables
+
+    def _merge(self, tables: Dict[str, Dict[bytes, int]]):
+        for codec, table in tables.items():
+            self._lengths.setdefault(codec, {}).update(table)
+
+    def __len__(self) -> int:
+        return sum(len(t) for t in self._lengths.values())
+
+    def take_new(self) -> Dict[str, Dict[bytes, int]]:
+        """取出并清空上次调用以来新计算的条目。"""
+        new, self._new = self._new, {}
+        return new
+
+    def update(self, tables: Dict[str, Dict[bytes, int]]):
+        """并入其他进程 take_new 得到的条目 (于下次 save 时写回)。"""
+        if any(tables.values()):
+            self._merge(tables)
+            self._dirty = True
+
+    def lengths(self, codec: str, texts: Sequence[Any], compute: Callable[[str], int],
+                workers: int = 1, parallel_min_bytes: int = 0) -> np.ndarray:
+        """texts 在 codec 下的压缩长度 (int64 数组)；未命中的不同文本各调用 compute 一次。
+
+        workers > 1 且未命中文本总长度不小于 parallel_min_bytes 时在线程池中计算。
+        非字符串 (如 None) 不入缓存，直接交给 compute。
+        """
+        table = self._lengths.setdefault(codec, {})
+        keys = [text_key(t) if isinstance(t, str) else None for t in texts]
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key is not None and key not in table and key not in missing:
+                missing[key] = text
+        if missing:
+            items = list(missing.items())
+            if (workers > 1 and len(items) > 1
+                    and (not parallel_min_bytes or sum(len(t) for _, t in items) >= parallel_min_bytes)):
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    values = list(pool.map(compute, (text for _, text in items)))
+            else:
+                values = [compute(text) for _, text in items]
+            new = self._new.setdefault(codec, {})
+            for (key, _), val in zip(items, values):
+                table[key] = new[key] = int(val)
+            self._dirty = True
+        n_cached = sum(key is not None for key in keys)
+        self.stats["misses"] += len(missing)
+        self.stats["hits"] += n_cached - len(missing)
+        return np.asarray([table[key] if key is not None else compute(text) for key, text in zip(keys, texts)],
+                          dtype=np.int64)
+
+    def save(self):
+        """与磁盘上 (可能由其他进程写入) 的内容合并后原子替换；无新条目或未设置路径时不写。"""
+        if self.path is None or not self._dirty:
+            return
+        if self.path.exists():
+            on_disk = self._read(self.path)
+            for codec, table in self._lengths.items():
+                on_disk.setdefault(codec, {}).update(table)
+            self._lengths = on_disk
+        arrays: Dict[str, np.ndarray] = {}
+        for codec, table in self._lengths.items():
+            keys = sorted(table)
+            arrays[f"{codec}__keys"] = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, _KEY_SIZE)
+            arrays[f"{codec}__len"] = np.asarray([table[k] for k in keys], dtype=np.int64)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+# 进程内共享的缓存：batch 打分的 zlib_len 中间量经由此处计算
+_CACHE = TextLengthCache()
+
+
+def get_text_cache() -> TextLengthCache:
+    return _CACHE
+
+
+def use_text_cache(path: str = "") -> TextLengthCache:
+    """切换进程内缓存：path 非空时从该文件加载 (并在 save 时写回)，保留已在内存中的条目。"""
+    global _CACHE
+    old = _CACHE
+    _CACHE = TextLengthCache(path)
+    _CACHE._merge(old._lengths)
+    _CACHE._dirty = _CACHE._dirty or bool(len(old))
+    return _CACHE
+
+
+def compressed_lengths(codec: str, texts: Sequence[Any], workers: Optional[int] = None) -> np.ndarray:
+    """texts 在 codec (如 "lzma-9") 下的压缩长度，按文本内容缓存。
+
+    未命中者在线程池中压缩：lzma / bz2 总是如此，zlib / zstd 仅当未命中文本总量较大时。
+    """
+    compute = codec_length_fn(codec)
+    name = codec if codec == ZLIB else parse_codec(codec)[0]
+    min_bytes = 0 if name in _SLOW_CODECS else _PARALLEL_MIN_BYTES
+    return _CACHE.lengths(codec, texts, compute, workers or COMPRESS_WORKERS, min_bytes)
+
+
+def zlib_lengths(texts: Sequence[Any]) -> np.ndarray:
+    """与 calc.calculate_zlib_entropy 相同的 zlib 熵，按文本内容缓存。"""
+    return compressed_lengths(ZLIB, texts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .jsonl_io import iter_jsonl
+    from .run import BaseSetAccessor, DEFAULT_SOURCE_BASE
+
+    parser = argparse.ArgumentParser(description="预先计算 source 中全部 input 的压缩长度缓存")
+    parser.add_argument("--source_base", default=DEFAULT_SOURCE_BASE, help="源数据根目录")
+    parser.add_argument("--out", default="", help=f"输出路径，默认 <source_base>/{DEFAULT_TEXT_CACHE_NAME}")
+    parser.add_argument("--codecs", nargs="+", default=[ZLIB], help="压缩器 (如 zlib lzma bz2-9 zstd-19)，默认 zlib")
+    args = parser.parse_args()
+    for codec in args.codecs:
+        codec_length_fn(codec)
+
+    out = args.out or os.path.join(args.source_base, DEFAULT_TEXT_CACHE_NAME)
+    cache = use_text_cache(out)
+    accessor = BaseSetAccessor(source_base=args.source_base)
+    # 各模型 input 一致，扫描首个模型的 origin 文件即可
+    first_model = next(iter(BaseSetAccessor._MODEL_DIRS))
+    for tag in (1, 0):
+        for level_code in accessor.level2feature:
+            try:
+                fpath = accessor._resolve_file_path(tag, level_code, first_model)
+            except FileNotFoundError:
+                continue
+            texts = [obj.get("input", "") or "" for obj in iter_jsonl(fpath, fields=("input",))]
+            for codec in args.codecs:
+                compressed_lengths(codec, texts)
+    cache.save()
+    print(f"文本长度缓存: {len(cache)} 条 (新增 {cache.stats['misses']}) -> {out}")
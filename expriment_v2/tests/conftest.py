@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 测试以 expriment_v2 为根导入 src.*，与 result_maker.py 等脚本一致
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
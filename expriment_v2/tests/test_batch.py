@@ -0,0 +1,124 @@
+import copy
+import math
+import random
+
+import numpy as np
+import pytest
+
+from src import batch
+from src.batch import Intermediate, Metric, RaggedArray, score_matrix, score_samples
+from src.calc import calculate_all_scores
+from src.textcache import codec_length_fn
+
+_MODELS = ["starcoder2_7b", "starcoder2_3b", "deepseekcoder_6.7b", "deepseekcoder_1.3b", "codellama_13b", "x"]
+
+
+def _random_samples(n=200, seed=0):
+    """随机样本：部分模型缺失、logprobs 可为空、rec_new_Loss 可为 None / 非数值，另附一个无模型样本。"""
+    rng = random.Random(seed)
+    samples = []
+    for i in range(n):
+        s = {"text": "".join(rng.choice("abc def\n") for _ in range(rng.randint(0, 200))), "label": i % 2}
+        for m in _MODELS:
+            if rng.random() < 0.1:
+                continue
+            k = rng.choice([0, 1, 2, 3, 5, 9, 10, 19, 20, 21, 40])
+            s[f"{m}_logprobs"] = [-rng.expovariate(1) for _ in range(k)]
+            if rng.random() < 0.3:
+                s[f"{m}_nb_loss"] = rng.random()
+            else:
+                s[f"{m}_nb_logprobs"] = [-rng.expovariate(1) for _ in range(rng.choice([0, 3, 7]))]
+            s[f"{m}_rec_new_Loss"] = rng.choice([rng.random(), None, "x", 0.5])
+        if i % 50 == 0:
+            s["zlib_entropy"] = 0
+        samples.append(s)
+    samples.append({"text": "x", "label": 0})
+    return samples
+
+
+def _assert_preds_equal(expected, actual):
+    assert len(expected) == len(actual)
+    for x, y in zip(expected, actual):
+        assert list(x) == list(y)
+        for k in x:
+            u, v = float(x[k]), y[k]
+            if math.isnan(u):
+                assert math.isnan(v), k
+            else:
+                assert v == pytest.approx(u, rel=1e-9, abs=1e-9), k
+
+
+def test_matches_calculate_all_scores():
+    samples = _random_samples()
+    expected = [calculate_all_scores(copy.deepcopy(s)) for s in samples]
+    _assert_preds_equal(expected, score_samples(samples))
+    assert score_samples(samples)[-1] == {}
+
+
+def test_ragged_smallest_k_mean():
+    rng = np.random.default_rng(0)
+    seqs = [rng.normal(size=n) for n in (0, 1, 5, 17, 3)]
+    ragged = RaggedArray.from_sequences(seqs)
+    k = np.array([0, 1, 2, 5, 3])
+    out = ragged.smallest_k_mean(k)
+    for seq, kk, val in zip(seqs, k, out):
+        if kk == 0 or len(seq) == 0:
+            assert math.isnan(val)
+        else:
+            assert val == pytest.approx(np.sort(seq)[:kk].mean())
+
+
+def test_context_evaluates_shared_intermediates_once():
+    samples = _random_samples(10, seed=4)
+    calls = []
+
+    def n_chars(samples):
+        calls.append("n_chars")
+        return np.asarray([len(s["text"]) for s in samples], dtype=np.float64)
+
+    specs = {**batch.INTERMEDIATES, "n_chars": Intermediate("n_chars", ("samples",), n_chars, per_model=False)}
+    metric = Metric("loss_per_char", ("loss", "n_chars"), lambda loss, n: loss / n)
+    root = batch._Context({"samples": samples}, intermediates=specs)
+    for model in ("starcoder2_7b", "starcoder2_3b"):
+        ctx = batch._Context({"model": model}, parent=root)
+        out = ctx.evaluate(metric)
+        np.testing.assert_array_equal(out, ctx.evaluate(metric))
+        np.testing.assert_array_equal(out, ctx["loss"] / root["n_chars"])
+    # 与模型无关的中间量在根上下文中只求值一次
+    assert calls == ["n_chars"]
+    assert "n_chars" not in batch.INTERMEDIATES
+    with pytest.raises(KeyError):
+        root["no_such_intermediate"]
+
+
+def test_subset_equals_full_run():
+    samples = _random_samples(80, seed=2)
+    full = score_samples(samples)
+    wanted = ["Min_20%++", "starcoder2_3b_Neighbor", "zlib_entropy"]
+    subset = score_samples(samples, metrics=wanted)
+    selection = batch.MetricSelection(wanted)
+    expected = [{k: v for k, v in f.items() if selection.keep_name(k)} for f in full]
+    _assert_preds_equal(expected, subset)
+    assert any(subset)
+
+
+def test_matches_calculate_all_scores_all_ref_pairs():
+    samples = _random_samples(60, seed=1)
+    pairs = batch.parse_ref_pairs(["all"], _MODELS)
+    expected = [calculate_all_scores(copy.deepcopy(s), ref_pairs=pairs) for s in samples]
+    selection = batch.MetricSelection(ref_pairs=pairs)
+    _assert_preds_equal(expected, score_samples(samples, selection=selection))
+
+
+def test_codec_metric_not_registered():
+    samples = _random_samples(20, seed=3)
+    n_metrics, n_intermediates = len(batch.METRICS), len(batch.INTERMEDIATES)
+    names, scores, mask = score_matrix(samples, metrics=["starcoder2_7b_ppl/lzma"])
+    assert names == ["starcoder2_7b_ppl/lzma"]
+    assert (len(batch.METRICS), len(batch.INTERMEDIATES)) == (n_metrics, n_intermediates)
+
+    length = codec_length_fn("lzma")
+    for s, val, ok in zip(samples, scores[:, 0], mask[:, 0]):
+        lp = s.get("starcoder2_7b_logprobs")
+        if ok and lp:
+            assert val == pytest.approx(-np.mean(lp) / length(s["text"]))
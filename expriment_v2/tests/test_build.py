@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+from src.build import BuildGraph, Node
+
+
+def _pipeline(tmp_path, calls, fail=()):
+    """src.txt -> a.txt -> b.txt；calls 记录各节点的执行次数。"""
+    src, a, b = tmp_path / "src.txt", tmp_path / "a.txt", tmp_path / "b.txt"
+
+    def make(name, inp, out):
+        def action():
+            calls[name] = calls.get(name, 0) + 1
+            if name in fail:
+                return False
+            out.write_text(inp.read_text().upper())
+        return action
+
+    graph = BuildGraph(str(tmp_path / "state"))
+    graph.add(Node("a", make("a", src, a), inputs=[str(src)], outputs=[str(a)]))
+    graph.add(Node("b", make("b", a, b), inputs=[str(a)], outputs=[str(b)], deps=["a"]))
+    return graph
+
+
+def test_build_then_skip(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    assert _pipeline(tmp_path, calls).run() == {"a": "built", "b": "built"}
+    assert _pipeline(tmp_path, calls).run() == {"a": "skipped", "b": "skipped"}
+    assert calls == {"a": 1, "b": 1}
+    assert (tmp_path / "b.txt").read_text() == "HELLO"
+
+
+def test_input_change_rebuilds(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    _pipeline(tmp_path, calls).run()
+    (tmp_path / "src.txt").write_text("hello, world")
+    assert _pipeline(tmp_path, calls).run() == {"a": "built", "b": "built"}
+    assert (tmp_path / "b.txt").read_text() == "HELLO, WORLD"
+
+
+def test_unchanged_upstream_output_skips_downstream(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    _pipeline(tmp_path, calls).run()
+    # 内容变化但大写后产出相同：a 重跑，b 的输入哈希不变
+    src = tmp_path / "src.txt"
+    mtime_ns = src.stat().st_mtime_ns
+    src.write_text("HELLO")
+    # 同样大小的改写须有不同的 mtime，文件哈希缓存才会失效 (粗粒度时间戳的文件系统上显式推进)
+    os.utime(src, ns=(mtime_ns + 1_000_000_000, mtime_ns + 1_000_000_000))
+    assert _pipeline(tmp_path, calls).run() == {"a": "built", "b": "skipped"}
+
+
+def test_tampered_output_rebuilds(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    _pipeline(tmp_path, calls).run()
+    (tmp_path / "b.txt").write_text("tampered")
+    assert _pipeline(tmp_path, calls).run() == {"a": "skipped", "b": "built"}
+    (tmp_path / "b.txt").unlink()
+    assert _pipeline(tmp_path, calls).run()["b"] == "built"
+    assert (tmp_path / "b.txt").read_text() == "HELLO"
+
+
+def test_params_change_rebuilds(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    _pipeline(tmp_path, calls).run()
+    graph = _pipeline(tmp_path, calls)
+    graph.nodes["b"].params["seed"] = 1
+    assert graph.run() == {"a": "skipped", "b": "built"}
+
+
+def test_failure_blocks_dependents(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    assert _pipeline(tmp_path, calls, fail=("a",)).run() == {"a": "failed", "b": "blocked"}
+    assert calls == {"a": 1}
+    # 失败不记录状态，下次照常重试
+    assert _pipeline(tmp_path, calls).run() == {"a": "built", "b": "built"}
+
+
+def test_force_and_targets(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    calls = {}
+    assert _pipeline(tmp_path, calls).run(targets=["a"]) == {"a": "built"}
+    assert _pipeline(tmp_path, calls).run(force=True) == {"a": "built", "b": "built"}
+    assert calls == {"a": 2, "b": 1}
+
+
+def test_adopt_existing(tmp_path):
+    (tmp_path / "src.txt").write_text("hello")
+    (tmp_path / "a.txt").write_text("HELLO")
+    (tmp_path / "b.txt").write_text("HELLO")
+    calls = {}
+    assert _pipeline(tmp_path, calls).run(adopt_existing=True) == {"a": "skipped", "b": "skipped"}
+    assert calls == {}
+    assert _pipeline(tmp_path, calls).run() == {"a": "skipped", "b": "skipped"}
+
+
+def test_cycle_and_unknown_dep(tmp_path):
+    graph = BuildGraph(str(tmp_path / "state"))
+    graph.add(Node("a", lambda: None, deps=["b"]))
+    graph.add(Node("b", lambda: None, deps=["a"]))
+    with pytest.raises(ValueError):
+        graph.order()
+    with pytest.raises(ValueError):
+        graph.add(Node("a", lambda: None))
+    other = BuildGraph(str(tmp_path / "state2"))
+    other.add(Node("c", lambda: None, deps=["missing"]))
+    with pytest.raises(ValueError):
+        other.run()
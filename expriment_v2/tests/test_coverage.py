@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+
+from src.coverage import CoverageIndex
+
+_DIRS = ["m/analysis", "n/analysis"]
+
+
+def _write_source(base, rel, lengths):
+    """每个 {index: len(input)} 写一行；另加一个坏行和一个缺 index 的行。"""
+    path = base / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [json.dumps({"index": idx, "input": "x" * n, "tokens": [{"index": -1}]}) for idx, n in lengths.items()]
+    lines += ["{not json", json.dumps({"input": "orphan"})]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+def _build(tmp_path, name="coverage.npz"):
+    return CoverageIndex.load_or_build(tmp_path / name, tmp_path / "source", _DIRS)
+
+
+def test_coverage_matrix(tmp_path):
+    base = tmp_path / "source"
+    _write_source(base, "m/analysis/level_a.jsonl_", {3: 10, 1: 0, 7: 4})
+    _write_source(base, "n/analysis/level_a.jsonl_", {3: 10})
+    _write_source(base, "n/analysis/level_b.jsonl_", {9: 1})
+
+    cov = _build(tmp_path)
+    assert cov.files == ["m/analysis/level_a.jsonl_", "n/analysis/level_a.jsonl_", "n/analysis/level_b.jsonl_"]
+    assert cov.indices.tolist() == [1, 3, 7, 9]
+    cols = cov.columns_for(_DIRS, "level_a")
+    assert cov.present_in_all(cols).tolist() == [3]
+    assert cov.has("n/analysis/level_a.jsonl_", 3) and not cov.has("n/analysis/level_a.jsonl_", 1)
+    assert cov.covers("n/analysis/level_b.jsonl_") and not cov.covers("n/analysis/level_c.jsonl_")
+
+
+def test_incremental_refresh_matches_fresh_build(tmp_path):
+    base = tmp_path / "source"
+    _write_source(base, "m/analysis/level_a.jsonl_", {3: 10, 1: 0, 7: 4})
+    _write_source(base, "n/analysis/level_a.jsonl_", {3: 10})
+    cov = _build(tmp_path)
+    loaded = CoverageIndex.load(tmp_path / "coverage.npz", base)
+    np.testing.assert_array_equal(loaded.cover, cov.cover)
+    np.testing.assert_array_equal(loaded.lengths, cov.lengths)
+
+    _write_source(base, "n/analysis/level_a.jsonl_", {3: 10, 1: 0, 7: 4, 12: 2})
+    updated = _build(tmp_path)
+    assert updated.present_in_all(updated.columns_for(_DIRS, "level_a")).tolist() == [1, 3, 7]
+    fresh = _build(tmp_path, "fresh.npz")
+    np.testing.assert_array_equal(updated.indices, fresh.indices)
+    np.testing.assert_array_equal(updated.lengths, fresh.lengths)
+    np.testing.assert_array_equal(updated.cover, fresh.cover)
+
+
+def test_length_queries(tmp_path):
+    base = tmp_path / "source"
+    lengths = {i: (i * 37) % 50 for i in range(40)}
+    _write_source(base, "m/analysis/level_a.jsonl_", lengths)
+    _write_source(base, "n/analysis/level_a.jsonl_", {i: 1 for i in range(0, 40, 3)})
+    cov = _build(tmp_path)
+    m, n = cov.columns_for(_DIRS, "level_a")
+
+    lens, idxs = cov.length_index(m)
+    assert lens.tolist() == sorted(lengths.values())
+    assert [(lengths[i], i) for i in idxs.tolist()] == sorted((n_, i) for i, n_ in lengths.items())
+
+    def brute(lb, rb, require=()):
+        return [i for i in sorted(lengths) if lb <= lengths[i] <= rb and all(cov.has(cov.files[c], i) for c in require)]
+    assert cov.length_filter(m, 10, 20).tolist() == brute(10, 20)
+    assert cov.length_filter(m, 10, 20, require_cols=[n]).tolist() == brute(10, 20, [n])
+    bounds = [(0, 9), (5, 30), (49, 49), (60, 70)]
+    assert [b.tolist() for b in cov.length_buckets(m, bounds, require_cols=[n])] == [brute(lb, rb, [n]) for lb, rb in bounds]
+
+
+def test_order_persisted_and_rebuilt_for_old_files(tmp_path):
+    base = tmp_path / "source"
+    _write_source(base, "m/analysis/level_a.jsonl_", {i: (i * 7) % 11 for i in range(30)})
+    cov = _build(tmp_path)
+    with np.load(tmp_path / "coverage.npz") as npz:
+        np.testing.assert_array_equal(npz["order"], cov.order)
+        legacy = {k: npz[k] for k in npz.files if k != "order"}
+    np.savez(tmp_path / "legacy.npz", **legacy)
+    old = CoverageIndex.load(tmp_path / "legacy.npz", base)
+    np.testing.assert_array_equal(old.order, cov.order)
+    assert [a.tolist() for a in old.length_index(0)] == [a.tolist() for a in cov.length_index(0)]
@@ -0,0 +1,25 @@
+import pytest
+
+from src.eval import fig_fpr_tpr
+
+
+def _outputs(n=20):
+    return [{"label": i % 2, "pred": {"loss": float(i % 2) + i / 100}} for i in range(n)]
+
+
+def test_auc_written(tmp_path):
+    fig_fpr_tpr(_outputs(), str(tmp_path))
+    lines = (tmp_path / "auc.txt").read_text().splitlines()
+    assert len(lines) == 1 and lines[0].startswith("loss   AUC")
+    assert [p.name for p in tmp_path.iterdir()] == ["auc.txt"]
+
+
+def test_failure_keeps_previous_auc(tmp_path):
+    (tmp_path / "auc.txt").write_text("old\n")
+    outputs = _outputs()
+    # 只有部分样本带有的指标与标签数不一致，roc_curve 报错
+    outputs[0]["pred"]["partial"] = 1.0
+    with pytest.raises(ValueError):
+        fig_fpr_tpr(outputs, str(tmp_path))
+    assert (tmp_path / "auc.txt").read_text() == "old\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["auc.txt"]
@@ -0,0 +1,71 @@
+import json
+import random
+
+import pytest
+
+import exp_maker
+from src.coverage import CoverageIndex
+
+_DIRS = ["a/analysis/memall", "b/analysis/memall"]
+
+
+def _write_tree(base, n=40, skip=()):
+    for d in _DIRS:
+        for feat in exp_maker.FEATURES:
+            fname = "original.jsonl_" if feat == "original" else f"mem_{feat}.jsonl_"
+            if f"{d}/{fname}" in skip:
+                continue
+            path = base / d / fname
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as fout:
+                for i in range(n):
+                    if d.startswith("b") and i % 5 == 0:
+                        continue
+                    fout.write(json.dumps({"index": i, "input": "x" * (i * 3)}) + "\n")
+
+
+def _coverage(tmp_path):
+    return CoverageIndex.load_or_build(tmp_path / "coverage.npz", tmp_path / "source", _DIRS)
+
+
+def test_sample_feature_sets(tmp_path):
+    _write_tree(tmp_path / "source")
+    cov = _coverage(tmp_path)
+    bounds = [(30, 90), (0, 10000), (30, 90)]
+    per_bound = exp_maker.feature_candidates(cov, _DIRS, "mem", bounds)
+    assert per_bound[0] == per_bound[2]
+    assert per_bound[0]["level1"] == [i for i in range(10, 31) if i % 5]
+    assert per_bound[1]["original"] == [i for i in range(40) if i % 5]
+
+    first = exp_maker.sample_feature_sets(per_bound[0], "mem", 8, random.Random(1))
+    assert first == exp_maker.sample_feature_sets(per_bound[0], "mem", 8, random.Random(1))
+    assert set(first) == set(exp_maker.FEATURES)
+    assert all(len(v) == 8 and v <= set(per_bound[0]["original"]) for v in first.values())
+    with pytest.raises(RuntimeError):
+        exp_maker.sample_feature_sets(per_bound[0], "mem", 100)
+
+
+def test_batch_matches_single_builds(tmp_path, monkeypatch):
+    _write_tree(tmp_path / "source")
+    cov = _coverage(tmp_path)
+    monkeypatch.setattr(exp_maker, "MEMBER_DIRS_REL", _DIRS)
+    monkeypatch.setattr(exp_maker, "NONMEMBER_DIRS_REL", _DIRS)
+    monkeypatch.setattr(exp_maker, "FEATURES", ["original"])
+    monkeypatch.setattr(exp_maker, "LEVEL_ORDER", {"original": "0"})
+    configs = [("e1", 4, 30, 90, 1), ("e2", 6, 0, 200, 2), ("e3", 4, 30, 90, 3)]
+    exp_maker.build_basesets(configs, str(tmp_path / "batch"), cov=cov)
+    for exp_name, size, lb, rb, seed in configs:
+        exp_maker.build_baseset(cov, exp_name, size, lb, rb, seed, str(tmp_path / "single"))
+        for part in ("member", "nonmember"):
+            rel = f"{exp_name}/{part}/index_tag_0.jsonl"
+            assert (tmp_path / "batch" / rel).read_text() == (tmp_path / "single" / rel).read_text()
+
+
+def test_missing_reference_file_is_reported(tmp_path, monkeypatch):
+    missing = f"{_DIRS[0]}/mem_level1.jsonl_"
+    _write_tree(tmp_path / "source", skip=(missing,))
+    cov = _coverage(tmp_path)
+    monkeypatch.setattr(exp_maker, "MEMBER_DIRS_REL", _DIRS)
+    with pytest.raises(FileNotFoundError) as exc:
+        exp_maker.build_basesets([("exp_x", 5, 0, 200, 1)], str(tmp_path / "baseset"), cov=cov)
+    assert "exp_x" in str(exc.value) and missing in str(exc.value)
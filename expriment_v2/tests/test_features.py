@@ -0,0 +1,92 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+from sampling_strategies import LEVEL_TO_FEATURE
+from src.batch import score_samples
+from src.features import (FeatureTable, build_feature_table, build_level_table, build_samples_from_features,
+                          reject_text_metrics)
+from src.run import BaseSetAccessor, _build_samples, make_selection
+from src.store import build_store
+
+_LEVEL = next(iter(LEVEL_TO_FEATURE))
+_MODELS = ["starcoder2_3b", "starcoder2_7b"]
+_N = 30
+
+
+@pytest.fixture
+def source(tmp_path):
+    """两个模型、tag=1、单个 level 的最小 source 目录；rec_new 文件缺少部分 index。"""
+    rng = random.Random(0)
+    base = tmp_path / "source"
+    feature = LEVEL_TO_FEATURE[_LEVEL]
+    fname = "original.jsonl_" if feature == "original" else f"mem_{feature}.jsonl_"
+    for mkey in _MODELS:
+        mdir = BaseSetAccessor._MODEL_DIRS[mkey]
+        for sub in ("analysis/memall", "analysis/memall_nb", "analysis_rec_new/memall"):
+            d = base / mdir / sub
+            d.mkdir(parents=True)
+            with open(d / fname, "w", encoding="utf-8") as fout:
+                for i in range(_N):
+                    if sub.startswith("analysis_rec_new"):
+                        if i % 7 == 3:
+                            continue
+                        obj = {"index": i, "Loss": rng.random()}
+                    else:
+                        obj = {"index": i, "input": "x = 1\n" * (i + 1),
+                               "tokens": [{"logprob": -rng.random() * 5} for _ in range(rng.randint(0, 25))]}
+                    fout.write(json.dumps(obj) + "\n")
+    return base
+
+
+def _records():
+    return [{"index": i, "tag": 1, "level": _LEVEL, "label": i % 2} for i in range(_N)]
+
+
+def test_feature_scores_match_source(source, tmp_path):
+    accessor = BaseSetAccessor(source_base=str(source))
+    stats = build_feature_table(accessor, tmp_path / "ft")
+    assert list(stats.values()) == [_N]
+
+    table = FeatureTable(str(tmp_path / "ft"))
+    assert set(_MODELS) <= set(table.model_keys(1, _LEVEL))
+    from_features = score_samples(build_samples_from_features(_records(), table))
+    from_source = score_samples(_build_samples(_records(), BaseSetAccessor(source_base=str(source))))
+    assert len(from_features) == len(from_source) == _N
+    for f, s in zip(from_features, from_source):
+        assert list(f) == list(s)
+        # 特征表保存 float64 logprob：只有求和顺序 (排序后) 不同
+        np.testing.assert_allclose(list(f.values()), list(s.values()), rtol=1e-12, atol=1e-12)
+    # rec_new 缺失的 index 上整个模型缺席
+    assert not any(k.startswith("starcoder2_3b") for k in from_features[3])
+
+
+def test_level_table_same_from_store(source, tmp_path):
+    accessor = BaseSetAccessor(source_base=str(source))
+    build_store(list(accessor.iter_source_files()), source, tmp_path / "store")
+    stored = BaseSetAccessor(source_base=str(source), store_base=str(tmp_path / "store"))
+
+    expected = build_level_table(accessor, 1, _LEVEL)
+    actual = build_level_table(stored, 1, _LEVEL)
+    assert set(expected) == set(actual)
+    for key in expected:
+        # 列式存储以 float32 保存 logprob，由其计算的均值 / loss 只在 float32 精度内一致
+        np.testing.assert_allclose(expected[key], actual[key], rtol=1e-6, err_msg=key)
+        assert expected[key].dtype == actual[key].dtype, key
+    assert build_level_table(accessor, 0, _LEVEL) is None
+
+
+def test_table_columns(source):
+    table = build_level_table(BaseSetAccessor(source_base=str(source)), 1, _LEVEL)
+    for mkey in _MODELS:
+        assert table[f"{mkey}__sorted"].dtype == np.float64
+        assert f"{mkey}__mean" not in table and f"{mkey}__std" not in table
+
+
+def test_codec_metrics_rejected():
+    reject_text_metrics(None)
+    reject_text_metrics(make_selection(["ppl/zlib", "Min_20%++"]))
+    with pytest.raises(ValueError):
+        reject_text_metrics(make_selection(["ppl/lzma"]))
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from src.jsonl_io import ReadStats, iter_jsonl, iter_lines, read_jsonl
+
+
+def _write(tmp_path, lines):
+    path = tmp_path / "data.jsonl"
+    path.write_bytes(b"".join(line + b"\n" for line in lines))
+    return path
+
+
+def _project(tmp_path, line, fields=("index", "input")):
+    return next(iter_jsonl(_write(tmp_path, [line]), fields=fields))
+
+
+@pytest.mark.parametrize("line, expected", [
+    # 嵌套对象中的同名键不得被当作顶层键
+    (b'{"tokens":[{"index":99}],"index":8}', {"index": 8}),
+    (b'{"meta":{"input":"nested"},"input":"top"}', {"input": "top"}),
+    (b'{"index":3,"meta":{"index":99,"input":"nested"}}', {"index": 3}),
+    # 字符串中的转义引号、括号
+    (b'{"input":"a \\"index\\": 3","index":4}', {"index": 4, "input": 'a "index": 3'}),
+    (b'{"k\\"index": 5, "index": 6}', {"index": 6}),
+    (b'{"a":"[[{","index":2,"b":"}}"}', {"index": 2}),
+    (b'{"input":"\\\\","index":7}', {"index": 7, "input": "\\"}),
+    # 标量类型与空白
+    (b'{ "index" : -1.5e3 , "input" : null }', {"index": -1500.0, "input": None}),
+    (b'{"index":true,"input":"\\u00e9"}', {"index": True, "input": "é"}),
+    # 复合值回退为完整解析
+    (b'{"index":[1,2],"input":"x"}', {"index": [1, 2], "input": "x"}),
+    # 缺失的键不出现
+    (b'{"input":"only"}', {"input": "only"}),
+])
+def test_projection_matches_full_parse(tmp_path, line, expected):
+    assert _project(tmp_path, line) == expected
+    full = json.loads(line)
+    assert expected == {k: full[k] for k in ("index", "input") if k in full}
+
+
+def test_projection_long_tokens_either_side(tmp_path):
+    tokens = [{"token": 'a"]}{[', "logprob": -0.5, "index": i} for i in range(500)]
+    lines = [json.dumps({"index": 1, "tokens": tokens, "input": "x"}).encode(),
+             json.dumps({"tokens": tokens, "input": "y", "index": 2}).encode()]
+    assert list(iter_jsonl(_write(tmp_path, lines), fields=("index", "input"))) == [
+        {"index": 1, "input": "x"}, {"index": 2, "input": "y"}]
+
+
+def test_offsets_and_malformed(tmp_path):
+    lines = [b'{"index": 1}', b"", b"{broken", b'{"index": 2}', b"[1, 2]"]
+    path = _write(tmp_path, lines)
+    stats = ReadStats()
+    out = list(iter_jsonl(path, stats=stats, with_offsets=True, fields=("index",)))
+    raw = path.read_bytes()
+    assert [obj for _, _, obj in out] == [{"index": 1}, {"index": 2}]
+    for offset, length, obj in out:
+        assert json.loads(raw[offset:offset + length]) == obj
+    assert stats.malformed == 2 and stats.records == 2 and stats.lines == 5
+
+
+def test_iter_lines_small_chunks(tmp_path):
+    lines = [b'{"index": %d, "input": "%s"}' % (i, b"x" * i) for i in range(50)]
+    path = _write(tmp_path, lines)
+    got = [line for _, line in iter_lines(path, chunk_size=7)]
+    assert got == [line + b"\n" for line in lines]
+    assert read_jsonl(path) == [json.loads(line) for line in lines]
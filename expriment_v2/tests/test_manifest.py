@@ -0,0 +1,81 @@
+import json
+
+from sampling_strategies import LEVEL_TO_FEATURE
+from src.manifest import OffsetFile, SourceManifest, scan_offsets
+from src.run import BaseSetAccessor
+
+_RECORDS = [
+    {"index": 3, "input": "def f():\n    return \"é\"", "tokens": [{"token": "\"index\": 5", "logprob": -0.5}]},
+    {"index": 7, "input": ""},
+    {"input": "x = 1", "index": 1, "tokens": []},
+]
+
+
+def _write_source(base, rel="m/analysis/level_a.jsonl_", records=_RECORDS):
+    path = base / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [json.dumps(r, ensure_ascii=False) for r in records]
+    lines.insert(1, "{not json")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+def test_offsets_and_random_reads(tmp_path):
+    base = tmp_path / "source"
+    src = _write_source(base)
+    offsets = scan_offsets(src)
+    assert sorted(offsets) == [1, 3, 7]
+
+    manifest = SourceManifest(tmp_path / "manifest.json", base)
+    manifest.record("m", 1, "a", src)
+    assert manifest.offsets_for(src) == offsets
+    manifest.save()
+
+    reloaded = SourceManifest(tmp_path / "manifest.json", base)
+    assert reloaded.lookup("m", 1, "a") == src
+    assert reloaded.lookup("m", 0, "a") is None
+    assert reloaded.offsets_for(src) == offsets
+
+    entry = OffsetFile(src, offsets)
+    try:
+        assert sorted(entry.keys()) == [1, 3, 7]
+        for rec in _RECORDS:
+            assert entry.get(rec["index"]) == rec
+        assert entry.get(42) is None
+    finally:
+        entry.close()
+
+
+def test_rescans_changed_file(tmp_path):
+    base = tmp_path / "source"
+    src = _write_source(base)
+    manifest = SourceManifest(tmp_path / "manifest.json", base)
+    manifest.offsets_for(src)
+    _write_source(base, records=_RECORDS + [{"index": 11, "input": "y"}])
+    assert sorted(manifest.offsets_for(src)) == [1, 3, 7, 11]
+
+
+def test_mismatched_source_base_ignored(tmp_path):
+    base = tmp_path / "source"
+    src = _write_source(base)
+    manifest = SourceManifest(tmp_path / "manifest.json", base)
+    manifest.record("m", 1, "a", src)
+    manifest.save()
+    assert SourceManifest(tmp_path / "manifest.json", tmp_path).lookup("m", 1, "a") is None
+
+
+def test_iter_file_survives_eviction(tmp_path):
+    base = tmp_path / "source"
+    level = next(iter(LEVEL_TO_FEATURE))
+    for mdir in ("starcoder2-3b", "starcoder2-7b"):
+        _write_source(base, f"{mdir}/analysis/memall/mem_{LEVEL_TO_FEATURE[level]}.jsonl_")
+    accessor = BaseSetAccessor(source_base=str(base), manifest_path=str(tmp_path / "manifest.json"),
+                               max_cache_records=len(_RECORDS))
+
+    seen = []
+    for idx, rec in accessor.iter_file(1, level, "starcoder2_3b"):
+        # 读取另一个文件会淘汰正在迭代的条目
+        accessor.fetch(1, level, idx, variant="starcoder2_7b")
+        seen.append(rec)
+    assert accessor.cache_stats["evictions"] >= 1
+    assert sorted(seen, key=lambda r: r["index"]) == sorted(_RECORDS, key=lambda r: r["index"])
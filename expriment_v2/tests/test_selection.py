@@ -0,0 +1,83 @@
+import pytest
+
+from src.batch import MetricSelection, parse_ref_pairs
+from src.calc import REF_PAIRS
+from src.run import BaseSetAccessor, make_selection
+
+_KNOWN = list(BaseSetAccessor._MODEL_DIRS)
+
+
+def test_empty_is_none():
+    assert make_selection() is None
+    assert make_selection([], [], []) is None
+
+
+def test_prefixed_metric_limits_models():
+    s = make_selection(["starcoder2_7b_Min_20%++"])
+    assert s.models == ["starcoder2_7b"]
+    assert s.pairs == {("starcoder2_7b", "Min_20%++")}
+    assert s.keep_name("starcoder2_7b_Min_20%++")
+    assert not s.keep_name("starcoder2_3b_Min_20%++")
+    assert not s.keep_name("starcoder2_7b_ppl")
+
+
+def test_longest_suffix_wins():
+    s = make_selection(["starcoder2_7b_nb_loss"])
+    assert s.pairs == {("starcoder2_7b", "nb_loss")}
+    assert s.variant_suffixes() == ["", "_nb"]
+    assert make_selection(["ReCall_new"]).variant_suffixes() == ["", "_rec_new"]
+    assert make_selection(["ppl"]).variant_suffixes() == [""]
+
+
+def test_ref_name():
+    s = make_selection(["starcoder2_7b_Ref_starcoder2_3b"])
+    assert s.pairs == {("starcoder2_7b", "Ref")}
+    assert s.models == ["starcoder2_7b"]
+    assert s.keep_name("starcoder2_7b_Ref_starcoder2_3b")
+
+
+def test_bare_metric_with_models():
+    s = make_selection(["Min_20%++"], ["starcoder2_3b"])
+    assert s.models == ["starcoder2_3b"]
+    assert s.keep_name("starcoder2_3b_Min_20%++")
+    assert not s.keep_name("starcoder2_7b_Min_20%++")
+
+
+@pytest.mark.parametrize("metrics, models", [
+    (["not_a_metric"], None),
+    (["ppl/nosuchcodec"], None),
+    (["unknown_model_ppl"], None),
+    (["ppl"], ["unknown_model"]),
+])
+def test_unknown_names_raise(metrics, models):
+    with pytest.raises(ValueError):
+        make_selection(metrics, models)
+
+
+def test_model_independent_metric_falls_back_to_first_model():
+    s = make_selection(["zlib_entropy"])
+    assert s.models == []
+    assert s.fetch_models(_KNOWN) == _KNOWN[:1]
+    assert s.variants(_KNOWN) == [_KNOWN[0]]
+
+
+def test_ref_fetches_reference_model():
+    s = make_selection(["starcoder2_7b_Ref"], ref_pairs=["starcoder2_7b:starcoder2_3b"])
+    assert s.ref_pairs == [("starcoder2_7b", "starcoder2_3b")]
+    assert s.fetch_models(_KNOWN) == ["starcoder2_7b", "starcoder2_3b"]
+
+
+def test_parse_ref_pairs():
+    models = ["a", "b", "c"]
+    assert parse_ref_pairs(["all"], models) == [("a", "b"), ("a", "c"), ("b", "a"), ("b", "c"), ("c", "a"), ("c", "b")]
+    assert parse_ref_pairs(["a:*", "a:b"], models) == [("a", "b"), ("a", "c")]
+    assert parse_ref_pairs(["*:c"], models) == [("a", "c"), ("b", "c")]
+    for spec in ("a", "a:", ":b", "a:d"):
+        with pytest.raises(ValueError):
+            parse_ref_pairs([spec], models)
+
+
+def test_default_ref_pairs():
+    s = make_selection(["Ref"])
+    assert s.ref_pairs == list(REF_PAIRS)
+    assert MetricSelection().is_default
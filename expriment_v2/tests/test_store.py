@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+from sampling_strategies import LEVEL_TO_FEATURE
+from src.run import BaseSetAccessor, _get_log_probs, _parse_json_file
+from src.store import StoreFile, build_store, is_up_to_date, store_dir_for
+
+_RECORDS = [
+    {"index": 3, "input": "def f():\n    return \"é\"", "Loss": 1.5,
+     "tokens": [{"token": "a", "logprob": -0.5}, {"token": "b", "logprob": -1.25}]},
+    {"index": 7, "input": "", "Loss": None, "tokens": []},
+    {"index": 1, "input": "x = 1", "loss": 0.25, "tokens": [{"token": "x", "logprob": -2.0}, {"index": 9}]},
+]
+
+
+def _write_source(base, rel="m/analysis/level_a.jsonl_", records=_RECORDS):
+    path = base / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [json.dumps(r, ensure_ascii=False) for r in records]
+    lines.insert(1, "{not json")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_store_round_trip(tmp_path, mmap):
+    src = _write_source(tmp_path / "source")
+    expected, _ = _parse_json_file(src)
+    stats = build_store([src], tmp_path / "source", tmp_path / "store")
+    assert stats == {"converted": 1, "skipped": 0}
+    assert build_store([src], tmp_path / "source", tmp_path / "store") == {"converted": 0, "skipped": 1}
+
+    store = StoreFile(store_dir_for(src, tmp_path / "source", tmp_path / "store"), mmap=mmap)
+    assert sorted(store.keys()) == sorted(expected)
+    for idx, rec in expected.items():
+        got = store.get(idx)
+        assert got["input"] == rec["input"]
+        np.testing.assert_allclose(np.asarray(got["logprobs"], dtype=np.float64), _get_log_probs(rec))
+    assert store.get(3)["Loss"] == 1.5
+    assert store.get(7)["Loss"] is None
+    assert store.get(1)["Loss"] == 0.25
+    assert store.get(42) is None
+
+
+def test_store_rebuilt_when_source_changes(tmp_path):
+    src = _write_source(tmp_path / "source")
+    dst = store_dir_for(src, tmp_path / "source", tmp_path / "store")
+    build_store([src], tmp_path / "source", tmp_path / "store")
+    assert is_up_to_date(src, dst)
+    _write_source(tmp_path / "source", records=_RECORDS + [{"index": 11, "input": "y", "tokens": []}])
+    assert not is_up_to_date(src, dst)
+    assert build_store([src], tmp_path / "source", tmp_path / "store") == {"converted": 1, "skipped": 0}
+    assert 11 in StoreFile(dst)
+
+
+def test_accessor_falls_back_to_source_when_store_stale(tmp_path):
+    base = tmp_path / "source"
+    level = next(iter(LEVEL_TO_FEATURE))
+    rel = f"starcoder2-3b/analysis/memall/mem_{LEVEL_TO_FEATURE[level]}.jsonl_"
+    src = _write_source(base, rel)
+    build_store([src], base, tmp_path / "store")
+    _write_source(base, rel, records=_RECORDS + [{"index": 11, "input": "y", "tokens": []}])
+
+    accessor = BaseSetAccessor(source_base=str(base), store_base=str(tmp_path / "store"))
+    assert accessor.fetch(1, level, 11, variant="starcoder2_3b")["input"] == "y"
+    assert accessor.fetch(1, level, 3, variant="starcoder2_3b")["input"] == _RECORDS[0]["input"]
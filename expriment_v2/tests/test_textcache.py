@@ -0,0 +1,65 @@
+import numpy as np
+
+from src.calc import calculate_zlib_entropy
+from src.textcache import TextLengthCache, codec_length_fn, text_key
+
+
+def _texts(n=600):
+    # 'x132' 的摘要以 0x00 结尾 (曾被 S16 截断)
+    return ["x132"] + [f"def f{i}():\n    return {i}\n" for i in range(n)]
+
+
+def test_trailing_nul_digest_present():
+    assert text_key("x132")[-1] == 0
+
+
+def test_save_load_round_trip(tmp_path):
+    path = tmp_path / "lengths.npz"
+    texts = _texts()
+    cache = TextLengthCache(str(path))
+    expected = cache.lengths("zlib", texts, calculate_zlib_entropy)
+    cache.lengths("lzma", texts[:10], codec_length_fn("lzma"))
+    cache.save()
+
+    loaded = TextLengthCache(str(path))
+    assert len(loaded) == len(set(texts)) + 10
+    assert all(len(k) == 16 for table in loaded._lengths.values() for k in table)
+
+    def fail(_):
+        raise AssertionError("应全部命中缓存")
+    np.testing.assert_array_equal(loaded.lengths("zlib", texts, fail), expected)
+    assert loaded.stats == {"hits": len(texts), "misses": 0}
+    # 再次保存 (与磁盘合并) 仍可读回
+    loaded.lengths("zlib", ["new text"], calculate_zlib_entropy)
+    loaded.save()
+    assert len(TextLengthCache(str(path))) == len(loaded)
+
+
+def test_save_merges_concurrent_writers(tmp_path):
+    path = tmp_path / "lengths.npz"
+    a, b = TextLengthCache(str(path)), TextLengthCache(str(path))
+    a.lengths("zlib", ["a"], calculate_zlib_entropy)
+    b.lengths("zlib", ["b"], calculate_zlib_entropy)
+    a.save()
+    b.save()
+    assert len(TextLengthCache(str(path))) == 2
+
+
+def test_take_new_and_update():
+    child = TextLengthCache()
+    child.lengths("zlib", ["a", "b", "a"], calculate_zlib_entropy)
+    new = child.take_new()
+    assert {k: len(v) for k, v in new.items()} == {"zlib": 2}
+    assert child.take_new() == {}
+
+    parent = TextLengthCache()
+    parent.update(new)
+    out = parent.lengths("zlib", ["a", "b"], lambda _: -1)
+    assert (out > 0).all()
+
+
+def test_non_str_texts_not_cached():
+    cache = TextLengthCache()
+    out = cache.lengths("zlib", [None, "x"], calculate_zlib_entropy)
+    assert out[0] == calculate_zlib_entropy(None)
+    assert len(cache) == 1
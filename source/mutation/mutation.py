@@ -1,13 +1,22 @@
 import argparse
+import glob
 import os
 import sys
 
+# 增量构建图与 expriment_v2 共用同一份实现 (expriment_v2/src/build.py)
+EXPRIMENT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../expriment_v2'))
+if EXPRIMENT_DIR not in sys.path:
+    sys.path.append(EXPRIMENT_DIR)
+
+from src.build import BuildGraph, Node
+
 # python3 mutation.py --input_file /home/yunxiang/work_may/week2/dataset/git2401_p3/original.jsonl --output_dir /home/yunxiang/work_may/week2/dataset/git2401_p3 --output_name git2401_p3
 def main():
     parser = argparse.ArgumentParser(description="批量生成多等级扰动数据集")
     parser.add_argument("--input_file", required=True, help="输入JSONL文件路径")
     parser.add_argument("--output_dir", required=True, help="输出文件夹")
     parser.add_argument("--output_name", required=True, help="输出文件基础名（不带后缀）")
+    parser.add_argument("--force", action="store_true", help="忽略构建记录，全部重新生成")
     args = parser.parse_args()
 
     input_file = args.input_file
@@ -44,29 +53,46 @@ def main():
     cmd3_09 = f"python3 mutaor3.py --input_file {input_file} --output_file {out3_09} --similarity 0.9"
     cmd3_08_RE = f"python3 mutaor3.py --input_file {out2_1} --output_file {out3_08_RE} --similarity 0.8"
 
-    # 定义每个命令对应的输出文件（有的命令有多个输出文件）
-    cmd_outputs = [
-        (cmd1, [out1]),
-        (cmd2, [out2_1, out2_2, out2_3]),
-        (cmd_clean_1, [out2_1]),  # clean.py会覆盖原文件
-        (cmd_clean_2, [out2_2]),
-        (cmd3_05, [out3_05]),
-        (cmd3_07, [out3_07]),
-        (cmd3_09, [out3_09]),
-        (cmd3_08_RE, [out3_08_RE]),
-    ]
+    # 构建图：每个节点以 输入文件内容 + 参数 + 生成脚本内容 的哈希为键，只重跑过期的节点
+    # (clean.py 原地覆盖 level2 输出，因此与 rewriter 合并为同一节点)
+    here = os.path.dirname(os.path.abspath(__file__))
+    mutator_code = sorted(glob.glob(os.path.join(here, "*.py")))
+    # 只取文件 (目录如 __pycache__ 不计入代码哈希)
+    rewriter_code = sorted(p for p in glob.glob(os.path.join(os.path.dirname(rewriter_py), "*"))
+                           if os.path.isfile(p)) + [clean_py]
+
+    def shell(*cmds):
+        def action():
+            for cmd in cmds:
+                print(f"运行命令: {cmd}")
+                if os.system(cmd) != 0:
+                    print(f"命令执行失败: {cmd}")
+                    return False
+            return True
+        return action
+
+    graph = BuildGraph(os.path.join(output_dir, ".build", output_name))
+    graph.add(Node("level1", shell(cmd1), inputs=[input_file], outputs=[out1], code=mutator_code))
+    graph.add(Node("level2", shell(cmd2, cmd_clean_1, cmd_clean_2), inputs=[input_file],
+                   outputs=[out2_1, out2_2, out2_3], code=rewriter_code))
+    for name, cmd, out, sim in [
+        ("level3_sim0.5", cmd3_05, out3_05, 0.5),
+        ("level3_sim0.7", cmd3_07, out3_07, 0.7),
+        ("level3_sim0.9", cmd3_09, out3_09, 0.9),
+    ]:
+        graph.add(Node(name, shell(cmd), inputs=[input_file], outputs=[out], params={"similarity": sim},
+                       code=mutator_code))
+    graph.add(Node("level3_0.8RE", shell(cmd3_08_RE), inputs=[out2_1], outputs=[out3_08_RE],
+                   params={"similarity": 0.8}, code=mutator_code, deps=["level2"]))
 
-    for cmd, outs in cmd_outputs:
-        # 检查所有输出文件是否都已存在
-        all_exist = all([os.path.exists(out) for out in outs])
-        if all_exist:
-            print(f"跳过命令（输出文件已存在）: {cmd}")
-            continue
-        print(f"运行命令: {cmd}")
-        ret = os.system(cmd)
-        if ret != 0:
-            print(f"命令执行失败: {cmd}")
-            sys.exit(1)
+    # 首次启用构建图时，沿用旧逻辑下已生成的输出 (level2 需调用 LLM，代价高昂)
+    status = graph.run(force=args.force, adopt_existing=True)
+    for name, st in status.items():
+        if st == "skipped":
+            print(f"跳过 {name}（输入与生成脚本均未变化）")
+    if any(st in ("failed", "blocked") for st in status.values()):
+        print(f"存在失败的扰动任务: {status}")
+        sys.exit(1)
     print("全部扰动数据集已生成！")
 
 if __name__ == "__main__":